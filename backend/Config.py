@@ -32,17 +32,45 @@ class Config:
     PROFIT_MARGIN = 0.02  # 2%
     
     
-    # Opérateurs mobiles
-    MOBILE_OPERATORS = {
+    # Registre des pays, opérateurs mobiles et réseaux crypto (operateurs.py).
+    # OPERATEURS_FICHIER : JSON de même forme {"pays": ..., "reseaux": ...} qui
+    # remplace ces valeurs ; relu quand il change (au plus toutes les N secondes).
+    OPERATEURS = {
         'CM': {
-            'MTN': '237671737948',
-            'ORANGE': '237696574076'
+            'nom': 'Cameroun',
+            'devise': 'XAF',
+            'operateurs': {
+                'MTN': {'nom': 'MTN Mobile Money', 'numero_marchand': '237671737948',
+                        'ussd': '*126*14*{numero}*{montant}#'},
+                'ORANGE': {'nom': 'Orange Money', 'numero_marchand': '237696574076',
+                           'ussd': '#150*14*505874*{numero}*{montant}'},
+            },
         },
         'TG': {
-            'TOGOCEL': '2289xxxxxxx',
-            'MOOV': '2287xxxxxxx'
+            'nom': 'Togo',
+            'devise': 'XOF',
+            'operateurs': {
+                'TOGOCEL': {'nom': 'Togocel Money', 'numero_marchand': '2289xxxxxxx',
+                            'ussd': '#150*14*505874*{numero}*{montant}'},  # adaptez selon vos opérateurs
+                'MOOV': {'nom': 'Moov Money', 'numero_marchand': '2287xxxxxxx',
+                         'ussd': '#150*14*505874*{numero}*{montant}'},
+            },
         },
     }
+    # Réseaux crypto, dans l'ordre de reconnaissance d'une adresse :
+    # préfixe, puis longueur alphanumérique, puis motif contenu (insensible à la casse)
+    RESEAUX_CRYPTO = {
+        'TRC20': {'nom': 'TRC20 (Tron)', 'prefixe': 'T', 'defaut': True},
+        'ETHEREUM': {'nom': 'Ethereum', 'prefixe': '0x'},
+        'SOL': {'nom': 'Solana', 'longueur': 44},
+        'USDT_TON': {'nom': 'USDT_TON (Toncoin)', 'contient': 'TON'},
+        'USDT_APTOS': {'nom': 'USDT_APTOS (Aptos)', 'contient': 'APT'},
+    }
+    OPERATEURS_FICHIER = os.environ.get('OPERATEURS_FICHIER')
+    OPERATEURS_VERIFICATION = float(os.environ.get('OPERATEURS_VERIFICATION', 30))
+
+    # Devises locales : parité fixe (unités pour 1 EUR). Les taux et montant_xaf restent en XAF (devises.py)
+    DEVISES = {'XAF': 655.957, 'XOF': 655.957}
 
     # Configuration Admin (à sécuriser dans les variables d'environnement)
     ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', 'ddevisafx@gmail.com')
@@ -54,3 +82,52 @@ class Config:
     # Firebase Cloud Messaging (push hors application)
     FIREBASE_CREDENTIALS_PATH = os.environ.get('FIREBASE_CREDENTIALS_PATH')
     FIREBASE_SERVICE_ACCOUNT_JSON = os.environ.get('FIREBASE_SERVICE_ACCOUNT_JSON')
+
+    # Anti-rafale des pushs (relais outbox) : un push par destinataire et par fenêtre
+    PUSH_FENETRE_REGROUPEMENT = int(os.environ.get('PUSH_FENETRE_REGROUPEMENT', 60))  # secondes, 0 = désactivé
+    PUSH_TYPES_REGROUPES = os.environ.get('PUSH_TYPES_REGROUPES', 'admin_notification').split(',')
+
+    # Relais outbox : 'integre' = thread dans chaque worker web, 'externe' = python maintenance.py outbox --continu
+    OUTBOX_RELAIS = os.environ.get('OUTBOX_RELAIS', 'integre')
+    OUTBOX_INTERVALLE = float(os.environ.get('OUTBOX_INTERVALLE', 1.0))  # secondes entre deux lots vides
+    OUTBOX_BAIL = int(os.environ.get('OUTBOX_BAIL', 300))  # secondes avant reprise d'un lot en cours d'envoi
+
+    # Nettoyage des tokens push (python maintenance.py tokens)
+    PUSH_TOKEN_EXPIRATION_JOURS = int(os.environ.get('PUSH_TOKEN_EXPIRATION_JOURS', 60))
+    PUSH_TOKEN_SUPPRESSION_JOURS = int(os.environ.get('PUSH_TOKEN_SUPPRESSION_JOURS', 180))
+    PUSH_TOKENS_MAX_PAR_UTILISATEUR = int(os.environ.get('PUSH_TOKENS_MAX_PAR_UTILISATEUR', 5))
+
+    # Rétention des notifications (python maintenance.py retention)
+    NOTIFICATIONS_RETENTION_JOURS = int(os.environ.get('NOTIFICATIONS_RETENTION_JOURS', 90))  # lues
+    NOTIFICATIONS_FLUX_RETENTION_JOURS = int(os.environ.get('NOTIFICATIONS_FLUX_RETENTION_JOURS', 90))
+
+    # Temps réel (flux SSE /api/events) : 'memoire' (un worker) ou 'postgres' (LISTEN/NOTIFY)
+    PUBSUB_BACKEND = os.environ.get('PUBSUB_BACKEND', 'memoire')
+    SSE_HEARTBEAT = int(os.environ.get('SSE_HEARTBEAT', 15))  # secondes
+
+    # Index en mémoire des versions de taux : rechargement au plus tard après N secondes
+    TAUX_INDEX_TTL = int(os.environ.get('TAUX_INDEX_TTL', 30))
+
+    # Moteur de taux (python maintenance.py taux) : 'fichier:/chemin.json' ou URL JSON
+    TAUX_MONDIAL_SOURCE = os.environ.get('TAUX_MONDIAL_SOURCE')
+    TAUX_MONDIAL_CHAMP = os.environ.get('TAUX_MONDIAL_CHAMP', 'rate')
+    TAUX_MOTEUR_INTERVALLE = int(os.environ.get('TAUX_MOTEUR_INTERVALLE', 60))  # secondes
+    TAUX_MOTEUR_SEUIL = float(os.environ.get('TAUX_MOTEUR_SEUIL', 0.5))  # XAF
+    TAUX_MOTEUR_ECART_MAX = float(os.environ.get('TAUX_MOTEUR_ECART_MAX', 0.1))  # 10 %
+
+    # Cache des paramètres système : relecture du numéro de version au plus toutes les N secondes
+    PARAMETRES_VERIFICATION = float(os.environ.get('PARAMETRES_VERIFICATION', 1.0))
+
+    # Registre des portefeuilles admin : relecture du numéro de version au plus toutes les N secondes
+    PORTEFEUILLES_VERIFICATION = float(os.environ.get('PORTEFEUILLES_VERIFICATION', 5.0))
+
+    # Devis signés (/api/quote) : durée de verrouillage du taux
+    DEVIS_CLE = os.environ.get('DEVIS_CLE')  # à défaut SECRET_KEY
+    DEVIS_DUREE_SECONDES = int(os.environ.get('DEVIS_DUREE_SECONDES', 60))
+
+    # File de validation partagée entre admins (/api/admin/queue)
+    FILE_VALIDATION_BAIL_SECONDES = int(os.environ.get('FILE_VALIDATION_BAIL_SECONDES', 300))
+    FILE_VALIDATION_MAX_RESERVATION = int(os.environ.get('FILE_VALIDATION_MAX_RESERVATION', 20))
+
+    # Réservation du solde USDT des ventes (soldes.py) : essais en cas de conflit de version
+    SOLDE_TENTATIVES = int(os.environ.get('SOLDE_TENTATIVES', 10))
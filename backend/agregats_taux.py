@@ -0,0 +1,165 @@
+"""
+Statistiques des taux journaliers maintenues de façon incrémentale.
+
+La table `agregats_taux` garde, pour tout l'historique (`total`), le nombre
+de jours, les sommes et les min/max des taux d'achat et de vente. Chaque
+écriture ORM d'un TauxJournalier (ajout, modification, suppression) met la
+ligne à jour dans la même transaction (écouteur `after_flush`) : la lecture
+des moyennes est une lecture par clé primaire, quelle que soit la taille de
+la table. Seul le retrait de la valeur min ou max oblige à recalculer ce
+min/max.
+
+Les fenêtres glissantes (`7j`, `30j`, jours <= aujourd'hui) sont
+recalculées à la lecture quand le jour a changé ou qu'une écriture les a
+invalidées ; elles portent sur 30 lignes au plus (index unique sur `date`).
+
+Les insertions Core (seed) ne passent pas par l'ORM : `recalculer()` (ou
+`python maintenance.py agregats`) reconstruit les agrégats.
+"""
+
+from datetime import date, timedelta
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, AgregatTaux, TauxJournalier
+
+FENETRES = {'7j': 7, '30j': 30}
+
+_agregats = AgregatTaux.__table__
+_taux = TauxJournalier.__table__
+
+
+def _calculer(connexion, debut=None, fin=None):
+    """Agrégats des taux dont la date est dans [debut, fin] (bornes optionnelles)."""
+    requete = select(
+        func.count(),
+        func.coalesce(func.sum(_taux.c.taux_achat), 0.0),
+        func.coalesce(func.sum(_taux.c.taux_vente), 0.0),
+        func.min(_taux.c.taux_achat), func.max(_taux.c.taux_achat),
+        func.min(_taux.c.taux_vente), func.max(_taux.c.taux_vente),
+    )
+    if debut is not None:
+        requete = requete.where(_taux.c.date >= debut)
+    if fin is not None:
+        requete = requete.where(_taux.c.date <= fin)
+    nombre, somme_achat, somme_vente, min_achat, max_achat, min_vente, max_vente = connexion.execute(requete).one()
+    return {
+        'nombre': nombre, 'somme_achat': float(somme_achat), 'somme_vente': float(somme_vente),
+        'min_achat': min_achat, 'max_achat': max_achat, 'min_vente': min_vente, 'max_vente': max_vente,
+    }
+
+
+def _enregistrer(connexion, portee, valeurs, date_reference=None):
+    """Insère ou remplace la ligne `portee`."""
+    ligne = dict(valeurs, portee=portee, date_reference=date_reference)
+    dialecte = postgresql if connexion.dialect.name == 'postgresql' else sqlite
+    instruction = dialecte.insert(_agregats).values(**ligne)
+    connexion.execute(instruction.on_conflict_do_update(
+        index_elements=[_agregats.c.portee],
+        set_={cle: valeur for cle, valeur in ligne.items() if cle != 'portee'},
+    ))
+
+
+def recalculer(connexion=None):
+    """Reconstruit tous les agrégats depuis la table des taux."""
+    connexion = connexion or db.session.connection()
+    _enregistrer(connexion, 'total', _calculer(connexion))
+    aujourd_hui = date.today()
+    for portee, jours in FENETRES.items():
+        debut = aujourd_hui - timedelta(days=jours - 1)
+        _enregistrer(connexion, portee, _calculer(connexion, debut, aujourd_hui), aujourd_hui)
+
+
+def _mettre_a_jour_total(connexion, ajouts, retraits):
+    total = connexion.execute(
+        select(_agregats).where(_agregats.c.portee == 'total').with_for_update()
+    ).mappings().first()
+    if total is None:
+        # Première écriture depuis la création de la table : état complet
+        recalculer(connexion)
+        return
+
+    valeurs = {
+        'nombre': total['nombre'] + len(ajouts) - len(retraits),
+        'somme_achat': total['somme_achat'] + sum(a for a, _ in ajouts) - sum(a for a, _ in retraits),
+        'somme_vente': total['somme_vente'] + sum(v for _, v in ajouts) - sum(v for _, v in retraits),
+    }
+    bornes = {champ: (total[f'min_{champ}'], total[f'max_{champ}']) for champ in ('achat', 'vente')}
+    retire_une_borne = any(
+        (bas is not None and retrait[indice] <= bas) or (haut is not None and retrait[indice] >= haut)
+        for indice, (bas, haut) in enumerate(bornes.values())
+        for retrait in retraits
+    )
+    if retire_une_borne:
+        # Une borne a pu disparaître : agrégats relus sur la table (cas rare, corrige aussi la dérive des sommes)
+        valeurs = _calculer(connexion)
+    else:
+        for indice, (champ, (bas, haut)) in enumerate(bornes.items()):
+            candidats = [ajout[indice] for ajout in ajouts] + [x for x in (bas, haut) if x is not None]
+            valeurs[f'min_{champ}'] = min(candidats) if candidats else None
+            valeurs[f'max_{champ}'] = max(candidats) if candidats else None
+    connexion.execute(update(_agregats).where(_agregats.c.portee == 'total').values(**valeurs))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _suivre_taux(session, flush_context):
+    ajouts, retraits, dates = [], [], set()
+    for obj in session.new:
+        if isinstance(obj, TauxJournalier):
+            ajouts.append((obj.taux_achat, obj.taux_vente))
+            dates.add(obj.date)
+    for obj in session.deleted:
+        if isinstance(obj, TauxJournalier):
+            retraits.append((obj.taux_achat, obj.taux_vente))
+            dates.add(obj.date)
+    for obj in session.dirty:
+        if not isinstance(obj, TauxJournalier):
+            continue
+        etat = inspect(obj).attrs
+        if not any(etat[nom].history.has_changes() for nom in ('taux_achat', 'taux_vente', 'date')):
+            continue
+        ancien = {nom: (etat[nom].history.deleted or [getattr(obj, nom)])[0]
+                  for nom in ('taux_achat', 'taux_vente', 'date')}
+        retraits.append((ancien['taux_achat'], ancien['taux_vente']))
+        ajouts.append((obj.taux_achat, obj.taux_vente))
+        dates.update((ancien['date'], obj.date))
+    if not (ajouts or retraits):
+        return
+
+    connexion = session.connection()
+    _mettre_a_jour_total(connexion, ajouts, retraits)
+    aujourd_hui = date.today()
+    if any(aujourd_hui - timedelta(days=max(FENETRES.values())) < jour <= aujourd_hui for jour in dates):
+        connexion.execute(update(_agregats).where(_agregats.c.portee != 'total').values(date_reference=None))
+
+
+def _formater(ligne):
+    nombre = ligne['nombre']
+    return {
+        'nombre': nombre,
+        'moyenne_achat': ligne['somme_achat'] / nombre if nombre else 0.0,
+        'moyenne_vente': ligne['somme_vente'] / nombre if nombre else 0.0,
+        'min_achat': ligne['min_achat'], 'max_achat': ligne['max_achat'],
+        'min_vente': ligne['min_vente'], 'max_vente': ligne['max_vente'],
+    }
+
+
+def statistiques():
+    """Statistiques par portée : {'total': {...}, '7j': {...}, '30j': {...}}."""
+    lignes = {l['portee']: l for l in db.session.execute(select(_agregats)).mappings()}
+    aujourd_hui = date.today()
+    a_jour = 'total' in lignes and all(
+        portee in lignes and lignes[portee]['date_reference'] == aujourd_hui for portee in FENETRES
+    )
+    if not a_jour:
+        connexion = db.session.connection()
+        if 'total' not in lignes:
+            recalculer(connexion)
+        else:
+            for portee, jours in FENETRES.items():
+                debut = aujourd_hui - timedelta(days=jours - 1)
+                _enregistrer(connexion, portee, _calculer(connexion, debut, aujourd_hui), aujourd_hui)
+        db.session.commit()
+        lignes = {l['portee']: l for l in db.session.execute(select(_agregats)).mappings()}
+    return {portee: _formater(ligne) for portee, ligne in lignes.items()}
@@ -1,20 +1,37 @@
 # api_routes.py
-from flask import Blueprint, request, jsonify, current_app
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask import Blueprint, Response, request, jsonify, current_app
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt, get_jwt_identity
 from functools import wraps
-from datetime import date
+from sqlalchemy.orm import joinedload
+from werkzeug.exceptions import HTTPException
+from datetime import date, datetime, timedelta, timezone
+import queue
 import uuid
 
 from models import db, Utilisateur, Transaction, PortefeuilleAdmin, TauxJournalier, Notification, PushToken
 from utils import calculer_taux_vente_usdt, calculer_taux_achat_usdt, formater_montant
 from Config import Config
-from push_service import send_push
+import notifications as notifications_service
+import outbox
+import pubsub
+import file_validation
+import devis as devis_service
+import taux as taux_service
+import agregats_taux
+import operateurs as operateurs_service
+import devises
+import montants
+import soldes
+import portefeuilles  # registre des portefeuilles admin (écouteurs de session)
 
 # Vérification du token Google
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+SYNC_MARGE = timedelta(seconds=5)
+SSE_RECONNEXION_MS = 5000
 
 
 def current_user_id():
@@ -22,39 +39,33 @@ def current_user_id():
     return int(get_jwt_identity())
 
 
-def _notification_to_dict(notification):
+def _jeton_acces(user):
+    """Jeton d'accès ; le pays (claim) donne la devise de l'utilisateur sans relire son profil."""
+    return create_access_token(identity=str(user.id), additional_claims={'pays': user.pays})
+
+
+def _notification_to_dict(notification, est_lue=None):
     return {
         "id": notification.id,
         "utilisateur_id": notification.utilisateur_id,
         "admin_id": notification.admin_id,
         "type_notification": notification.type_notification,
         "message": notification.message,
-        "est_lue": notification.est_lue,
+        "est_lue": notification.est_lue if est_lue is None else est_lue,
+        "est_flux_admin": bool(notification.est_flux_admin),
         "date_creation": notification.date_creation.isoformat() if notification.date_creation else None,
     }
 
 
-def _push_to_users(user_ids, title, body, data=None):
-    """Envoie un push FCM à une liste d'utilisateurs et invalide les tokens morts."""
-    if not user_ids:
-        return
-
-    rows = PushToken.query.filter(
-        PushToken.utilisateur_id.in_(list(set(user_ids))),
-        PushToken.est_actif.is_(True),
-    ).all()
-    tokens = [row.token for row in rows]
-    if not tokens:
-        return
-
-    result = send_push(tokens, title, body, data=data or {})
-    invalid = result.get("invalid_tokens", [])
-    if invalid:
-        PushToken.query.filter(PushToken.token.in_(invalid)).update(
-            {"est_actif": False},
-            synchronize_session=False,
-        )
-        db.session.commit()
+def _lire_ids(data, maximum=500):
+    """Extrait la liste d'identifiants entiers `ids` du corps JSON (None si invalide)."""
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids or len(ids) > maximum:
+        return None
+    try:
+        return [int(i) for i in ids]
+    except (TypeError, ValueError):
+        return None
 
 
 # -------------------------------------------------------------------
@@ -101,7 +112,7 @@ def register():
     db.session.add(user)
     db.session.commit()
 
-    access_token = create_access_token(identity=str(user.id))
+    access_token = _jeton_acces(user)
     return jsonify(
         access_token=access_token,
         user=user.to_dict(),), 201
@@ -117,7 +128,7 @@ def login():
     user = Utilisateur.query.filter_by(email=email).first()
     taux = TauxJournalier.query.filter_by(date=date.today()).first()
     if user and user.mot_de_passe_hash==password:
-        access_token = create_access_token(identity=str(user.id))
+        access_token = _jeton_acces(user)
         return jsonify(access_token=access_token, user=user.to_dict())
     return jsonify({"msg": "Email ou mot de passe incorrect"}), 401
 
@@ -151,7 +162,7 @@ def google_login():
             db.session.add(user)
             db.session.commit()
 
-        access_token = create_access_token(identity=str(user.id))
+        access_token = _jeton_acces(user)
         return jsonify(access_token=access_token, user=user.to_dict())
     except ValueError as e:
         return jsonify({"msg": str(e)}), 401
@@ -178,10 +189,142 @@ def user_transactions():
 @jwt_required()
 def balance():
     user_id = current_user_id()
-    transactions = Transaction.query.filter_by(utilisateur_id=user_id, statut='complete').all()
-    solde_usdt = sum(t.montant_usdt for t in transactions if t.type_transaction == 'achat') \
-                 - sum(t.montant_usdt for t in transactions if t.type_transaction == 'vente')
-    return jsonify(balance_usdt=round(solde_usdt, 2))
+    solde = soldes.etat(user_id)
+    db.session.commit()  # conserve la ligne de solde si elle vient d'être créée
+    # Le solde disponible déduit les ventes en attente
+    return jsonify(balance_usdt=round(solde['solde'], 2),
+                   reserve_usdt=round(solde['reserve'], 2),
+                   disponible_usdt=round(solde['disponible'], 2))
+
+
+def _lire_jeton_sync(jeton):
+    """Date encodée dans un jeton de synchronisation (None si invalide)."""
+    try:
+        return datetime.fromisoformat(jeton)
+    except (TypeError, ValueError):
+        return None
+
+
+@api_bp.route('/sync', methods=['GET'])
+@jwt_required()
+def sync():
+    """
+    Synchronisation de l'application en un appel : profil, solde, taux du jour,
+    transactions et notifications modifiés depuis le jeton `since` (tout si
+    absent). Le jeton renvoyé est à repasser au prochain appel ; une marge
+    de SYNC_MARGE couvre les transactions en cours de commit au moment du
+    jeton précédent (le client dédoublonne par id). Les clés non modifiées
+    valent null.
+    """
+    user_id = current_user_id()
+    maintenant = datetime.utcnow()
+    depuis = None
+    if request.args.get('since'):
+        depuis = _lire_jeton_sync(request.args['since'])
+        if depuis is None:
+            return jsonify({"msg": "Jeton de synchronisation invalide"}), 400
+        depuis -= SYNC_MARGE
+
+    user = Utilisateur.query.get_or_404(user_id)
+
+    transactions = Transaction.query.filter(Transaction.utilisateur_id == user_id)
+    if depuis is not None:
+        transactions = transactions.filter(Transaction.date_mise_a_jour > depuis)
+    transactions = transactions.order_by(Transaction.date_creation.desc()).all()
+
+    solde = None
+    if depuis is None or transactions:
+        solde = montants.solde_usdt(db.session, user_id)
+
+    taux = TauxJournalier.query.filter_by(date=maintenant.date()).first()
+    taux_modifie = taux is not None and (
+        depuis is None or depuis.date() != maintenant.date() or taux.date_mise_a_jour > depuis
+    )
+
+    entrees = notifications_service.notifications_utilisateur(user, 200, depuis)
+
+    reponse = {
+        "token": maintenant.isoformat(),
+        "complet": depuis is None,
+        "profil": user.to_dict() if depuis is None or user.date_mise_a_jour > depuis else None,
+        "balance_usdt": round(solde, 2) if solde is not None else None,
+        "taux": {
+            'date': taux.date.isoformat(),
+            'taux_achat': taux.taux_achat,
+            'taux_vente': taux.taux_vente,
+        } if taux_modifie else None,
+        "transactions": [t.to_dict() for t in transactions],
+        "notifications": [_notification_to_dict(n, est_lue) for n, est_lue in entrees],
+        "unread_count": user.notifications_non_lues,
+    }
+    if user.est_admin:
+        # Événements du flux d'id <= repère : lus (« tout marquer comme lu »)
+        reponse["flux_admin_lu_jusqua"] = user.flux_admin_lu_jusqua
+    return jsonify(reponse)
+
+@api_bp.route('/events', methods=['GET'])
+@jwt_required()
+def events():
+    """
+    Flux Server-Sent Events de l'utilisateur : changements de statut de ses
+    transactions (`event: transaction`) et nouvelles notifications
+    (`event: notification`). À la reconnexion, l'en-tête Last-Event-ID (ou
+    `?last_event_id=`) rejoue depuis la base ce qui a changé entre-temps.
+    Un commentaire `: ping` est envoyé toutes les SSE_HEARTBEAT secondes.
+    Chaque flux occupe un worker : servir avec des workers threadés/gevent.
+    """
+    user_id = current_user_id()
+    user = Utilisateur.query.get_or_404(user_id)
+    heartbeat = current_app.config.get('SSE_HEARTBEAT', 15)
+
+    rattrapage = []
+    depuis = _lire_jeton_sync(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    if depuis is not None:
+        depuis -= SYNC_MARGE
+        transactions = Transaction.query.filter(
+            Transaction.utilisateur_id == user_id,
+            Transaction.date_mise_a_jour > depuis,
+        ).order_by(Transaction.date_mise_a_jour).all()
+        rattrapage += [('transaction', pubsub.resume_transaction(t)) for t in transactions]
+        entrees = notifications_service.notifications_utilisateur(user, 200, depuis)
+        rattrapage += [('notification', _notification_to_dict(n, est_lue)) for n, est_lue in reversed(entrees)]
+
+    canaux = [pubsub.canal_utilisateur(user_id)]
+    if user.est_admin:
+        canaux.append(pubsub.CANAL_FLUX_ADMINS)
+    return _reponse_sse(canaux, rattrapage, heartbeat)
+
+
+def _reponse_sse(canaux, rattrapage, heartbeat):
+    """Réponse text/event-stream : événements de rattrapage puis ceux publiés sur `canaux`."""
+    backend = pubsub.backend()
+    abonnement = None
+    for canal in canaux:
+        abonnement = backend.abonner(canal, abonnement)
+    identifiant = datetime.utcnow().isoformat()
+    # Le flux peut durer des heures : la connexion à la base est rendue au pool
+    db.session.close()
+
+    def flux():
+        try:
+            yield f"retry: {SSE_RECONNEXION_MS}\n\n"
+            for type_evenement, donnees in rattrapage:
+                yield pubsub.formater_sse(identifiant, type_evenement, donnees)
+            while True:
+                try:
+                    evenement = abonnement.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield pubsub.formater_sse(evenement['id'], evenement['type'], evenement['data'])
+        finally:
+            for canal in canaux:
+                backend.desabonner(canal, abonnement)
+
+    return Response(flux(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
 # -------------------------------------------------------------------
 # Achat / Vente
@@ -190,37 +333,62 @@ def balance():
 @jwt_required()
 def buy():
     user_id = current_user_id()
+    pays = get_jwt().get('pays')  # claim du jeton d'accès : pas de relecture de l'utilisateur
     data = request.get_json()
-    required = ['montant_xaf', 'reseau', 'operateur_mobile', 'adresse_wallet']
-    if not all(k in data for k in required):
+    required = ['reseau', 'operateur_mobile', 'adresse_wallet']
+    if not all(k in data for k in required) or not (data.get('devis') or 'montant_xaf' in data or 'montant' in data):
         print("champs manquant")
         return jsonify({"msg": "Champs manquants"}), 400
 
-    taux = TauxJournalier.query.filter_by(date=date.today()).first()
-    if not taux:
-        print("Taux manquants")
-        return jsonify({"msg": "Taux non définis pour aujourd'hui"}), 400
+    if data.get('devis'):
+        # Prix verrouillé par /api/quote : aucune relecture du taux
+        devis, erreur = devis_service.verifier(data['devis'], user_id, 'achat')
+        if erreur:
+            return jsonify({"msg": erreur}), 400
+        montant_xaf, montant_usdt, taux_applique = devis['montant_xaf'], devis['montant_usdt'], devis['taux']
+        devise = devis.get('devise', devises.REFERENCE)
+        montant_local = devis.get('montant_local', montant_xaf)
+        version_taux_id = devis.get('version')
+    else:
+        devise = devises.devise_requete()
+        if not devise:
+            return jsonify({"msg": "Devise inconnue"}), 400
+        taux = TauxJournalier.query.filter_by(date=date.today()).first()
+        if not taux:
+            print("Taux manquants")
+            return jsonify({"msg": "Taux non définis pour aujourd'hui"}), 400
+        if 'montant' in data:
+            # Montant dans la devise du client (XOF pour le Togo)
+            montant_local = montants.arrondir(float(data['montant']))
+            montant_xaf = montants.arrondir(devises.convertir(montant_local, devise))
+        else:
+            montant_xaf = montants.arrondir(float(data['montant_xaf']))
+            montant_local = montants.arrondir(devises.convertir(montant_xaf, devises.REFERENCE, devise))
+        montant_usdt = montant_xaf / taux.taux_vente
+        taux_applique = taux.taux_vente
+        version = taux_service.version_de(taux)
+        version_taux_id = version.id if version else None
 
-    montant_xaf = float(data['montant_xaf'])
-    montant_usdt = montant_xaf / taux.taux_vente
+    if not operateurs_service.operateur(data['operateur_mobile'], pays):
+        return jsonify({"msg": "Opérateur mobile inconnu"}), 400
 
-    portefeuille = PortefeuilleAdmin.get_numero_marchand(data['operateur_mobile'])
+    portefeuille = PortefeuilleAdmin.get_numero_marchand(data['operateur_mobile'], pays=pays, montant=montant_xaf)
     if not portefeuille:
         print("portefeuille absent")
         return jsonify({"msg": "Numéro marchand non disponible"}), 400
 
     numero = portefeuille.adresse
-    if data['operateur_mobile'] == 'MTN':
-        code_ussd = f"*126*14*{numero}*{montant_xaf}#"
-    else:
-        code_ussd = f"#150*14*505874*{numero}*{montant_xaf}"  # adaptez selon vos opérateurs
+    code_ussd = operateurs_service.code_ussd(data['operateur_mobile'], numero, montant_local, pays)
 
     transaction = Transaction(
         utilisateur_id=user_id,
         type_transaction='achat',
         montant_xaf=montant_xaf,
         montant_usdt=round(montant_usdt, 2),
-        taux_applique=taux.taux_vente,
+        taux_applique=taux_applique,
+        devise=devise,
+        montant_local=montant_local,
+        version_taux_id=version_taux_id,
         reseau=data['reseau'],
         adresse_wallet=data['adresse_wallet'],
         operateur_mobile=data['operateur_mobile'],
@@ -228,6 +396,7 @@ def buy():
         statut='en_attente'
     )
     db.session.add(transaction)
+    db.session.flush()  # attribue identifiant_transaction
 
     user_notif = Notification(
         utilisateur_id=user_id,
@@ -236,34 +405,34 @@ def buy():
     )
     db.session.add(user_notif)
 
-    # Notification à tous les administrateurs actifs
-    admins = Utilisateur.query.filter_by(est_admin=True, est_actif=True).all()
-    for admin in admins:
-        notif = Notification(
-            admin_id=admin.id,
-            type_notification='transaction_created',
-            message=f"Nouvel achat en attente: {montant_xaf} XAF ({transaction.identifiant_transaction})"
-        )
-        db.session.add(notif)
-    db.session.commit()
-
-    _push_to_users(
-        [user_id],
+    # Un seul événement dans le flux admin, partagé par tous les administrateurs
+    notifications_service.publier_flux_admin(
+        'transaction_created',
+        f"Nouvel achat en attente: {montant_xaf} XAF ({transaction.identifiant_transaction})",
+    )
+    outbox.ajouter_push(
         "Achat en attente",
         f"Votre achat {transaction.identifiant_transaction} est en attente de validation.",
-        data={"type": "transaction_created", "transaction_id": transaction.identifiant_transaction},
+        donnees={"type": "transaction_created", "transaction_id": transaction.identifiant_transaction},
+        utilisateur_ids=[user_id],
+        cle=f"transaction_created:{transaction.identifiant_transaction}",
     )
-    _push_to_users(
-        [admin.id for admin in admins],
+    outbox.ajouter_push(
         "Nouvelle transaction",
         f"Nouvel achat en attente: {montant_xaf} XAF",
-        data={"type": "admin_notification", "transaction_id": transaction.identifiant_transaction},
+        donnees={"type": "admin_notification", "transaction_id": transaction.identifiant_transaction,
+                 "montant_xaf": montant_xaf},
+        admins=True,
+        cle=f"admin_notification:{transaction.identifiant_transaction}",
     )
+    db.session.commit()
 
     return jsonify({
         'transaction_id': transaction.identifiant_transaction,
         'montant_xaf': montant_xaf,
         'montant_usdt': round(montant_usdt, 2),
+        'devise': devise,
+        'montant_local': montant_local,
         'numero_marchand': numero,
         'code_ussd': code_ussd,
         'statut': transaction.statut
@@ -273,37 +442,62 @@ def buy():
 @jwt_required()
 def sell():
     user_id = current_user_id()
+    pays = get_jwt().get('pays')
     data = request.get_json()
-    required = ['montant_usdt', 'reseau', 'operateur_mobile', 'numero_mobile']
+    required = ['reseau', 'operateur_mobile', 'numero_mobile'] + ([] if data.get('devis') else ['montant_usdt'])
     if not all(k in data for k in required):
         return jsonify({"msg": "Champs manquants"}), 400
 
-    # Vérification du solde USDT
-    transactions = Transaction.query.filter_by(utilisateur_id=user_id, statut='complete').all()
-    solde_usdt = sum(t.montant_usdt for t in transactions if t.type_transaction == 'achat') \
-                 - sum(t.montant_usdt for t in transactions if t.type_transaction == 'vente')
-    montant_usdt = float(data['montant_usdt'])
-    if solde_usdt < montant_usdt:
-        return jsonify({"msg": "Solde USDT insuffisant"}), 400
-
-    taux = TauxJournalier.query.filter_by(date=date.today()).first()
-    if not taux:
-        return jsonify({"msg": "Taux non définis pour aujourd'hui"}), 400
+    devis = None
+    if data.get('devis'):
+        # Prix verrouillé par /api/quote : aucune relecture du taux
+        devis, erreur = devis_service.verifier(data['devis'], user_id, 'vente')
+        if erreur:
+            return jsonify({"msg": erreur}), 400
+        montant_usdt = devis['montant_usdt']
+    else:
+        montant_usdt = float(data['montant_usdt'])
 
-    montant_xaf = montant_usdt * taux.taux_achat
+    if devis:
+        montant_xaf, taux_applique = devis['montant_xaf'], devis['taux']
+        devise = devis.get('devise', devises.REFERENCE)
+        version_taux_id = devis.get('version')
+    else:
+        devise = devises.devise_requete()
+        if not devise:
+            return jsonify({"msg": "Devise inconnue"}), 400
+        taux = TauxJournalier.query.filter_by(date=date.today()).first()
+        if not taux:
+            return jsonify({"msg": "Taux non définis pour aujourd'hui"}), 400
+        montant_xaf = montant_usdt * taux.taux_achat
+        taux_applique = taux.taux_achat
+        version = taux_service.version_de(taux)
+        version_taux_id = version.id if version else None
 
-    portefeuille = PortefeuilleAdmin.get_adresse_crypto(data['reseau'])
+    portefeuille = PortefeuilleAdmin.get_adresse_crypto(data['reseau'], pays=pays, montant=montant_usdt)
     if not portefeuille:
         return jsonify({"msg": "Adresse crypto non disponible"}), 400
 
     adresse_admin = portefeuille.adresse
+    montant_xaf = montants.arrondir(montant_xaf)
+    montant_local = montants.arrondir(devises.convertir(montant_xaf, devises.REFERENCE, devise))
+
+    # Réservation du montant sur le solde USDT (compare-and-swap, annulée avec la transaction),
+    # en dernier : aucune vérification ne peut plus échouer après elle
+    reserve, erreur = soldes.reserver(user_id, montant_usdt)
+    if not reserve:
+        db.session.rollback()
+        return jsonify({"msg": erreur}), 400
 
     transaction = Transaction(
         utilisateur_id=user_id,
         type_transaction='vente',
-        montant_xaf=round(montant_xaf, 2),
+        montant_xaf=montant_xaf,
         montant_usdt=montant_usdt,
-        taux_applique=taux.taux_achat,
+        taux_applique=taux_applique,
+        devise=devise,
+        montant_local=montant_local,
+        version_taux_id=version_taux_id,
         reseau=data['reseau'],
         adresse_wallet=data.get('adresse_wallet', ''),
         operateur_mobile=data['operateur_mobile'],
@@ -311,6 +505,7 @@ def sell():
         statut='en_attente'
     )
     db.session.add(transaction)
+    db.session.flush()  # attribue identifiant_transaction
 
     user_notif = Notification(
         utilisateur_id=user_id,
@@ -319,33 +514,34 @@ def sell():
     )
     db.session.add(user_notif)
 
-    admins = Utilisateur.query.filter_by(est_admin=True, est_actif=True).all()
-    for admin in admins:
-        notif = Notification(
-            admin_id=admin.id,
-            type_notification='transaction_created',
-            message=f"Nouvelle vente en attente: {montant_usdt} USDT ({transaction.identifiant_transaction})"
-        )
-        db.session.add(notif)
-    db.session.commit()
-
-    _push_to_users(
-        [user_id],
+    # Un seul événement dans le flux admin, partagé par tous les administrateurs
+    notifications_service.publier_flux_admin(
+        'transaction_created',
+        f"Nouvelle vente en attente: {montant_usdt} USDT ({transaction.identifiant_transaction})",
+    )
+    outbox.ajouter_push(
         "Vente en attente",
         f"Votre vente {transaction.identifiant_transaction} est en attente de validation.",
-        data={"type": "transaction_created", "transaction_id": transaction.identifiant_transaction},
+        donnees={"type": "transaction_created", "transaction_id": transaction.identifiant_transaction},
+        utilisateur_ids=[user_id],
+        cle=f"transaction_created:{transaction.identifiant_transaction}",
     )
-    _push_to_users(
-        [admin.id for admin in admins],
+    outbox.ajouter_push(
         "Nouvelle transaction",
         f"Nouvelle vente en attente: {montant_usdt} USDT",
-        data={"type": "admin_notification", "transaction_id": transaction.identifiant_transaction},
+        donnees={"type": "admin_notification", "transaction_id": transaction.identifiant_transaction,
+                 "montant_xaf": montant_xaf},
+        admins=True,
+        cle=f"admin_notification:{transaction.identifiant_transaction}",
     )
+    db.session.commit()
 
     return jsonify({
         'transaction_id': transaction.identifiant_transaction,
         'montant_usdt': montant_usdt,
-        'montant_xaf': round(montant_xaf, 2),
+        'montant_xaf': montant_xaf,
+        'devise': devise,
+        'montant_local': montant_local,
         'adresse_admin': adresse_admin,
         'statut': transaction.statut
     }), 201
@@ -363,14 +559,78 @@ def get_transaction(transaction_id):
 # -------------------------------------------------------------------
 @api_bp.route('/rates/current', methods=['GET'])
 def current_rates():
+    # Taux précalculés (saisie admin ou moteur de taux) lus dans l'index des versions,
+    # exprimés dans la devise demandée ou celle de l'utilisateur connecté
+    devise = devises.devise_requete()
+    if not devise:
+        return jsonify({"msg": "Devise inconnue"}), 400
+    taux = taux_service.taux_a(datetime.utcnow())
+    if not taux or taux.date != date.today():
+        return jsonify({"msg": "Aucun taux pour aujourd'hui"}), 404
+    return jsonify(dict(
+        devises.taux_en(taux, devise),
+        date=taux.date.isoformat(),
+        devise=devise,
+        version=taux.id,
+    ))
+
+@api_bp.route('/operators', methods=['GET'])
+def operators():
+    """Pays (devise, opérateurs mobile money) et réseaux crypto acceptés."""
+    return jsonify(operateurs_service.exporter())
+
+@api_bp.route('/quote', methods=['POST'])
+@jwt_required()
+def quote():
+    """
+    Devis signé au taux du jour, valable DEVIS_DUREE_SECONDES : à passer tel
+    quel dans le champ `devis` de /api/buy (type 'achat', montant en XAF) ou
+    /api/sell (type 'vente', montant en USDT).
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        montant = float(data.get('montant'))
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Montant invalide"}), 400
+
     taux = TauxJournalier.query.filter_by(date=date.today()).first()
     if not taux:
-        return jsonify({"msg": "Aucun taux pour aujourd'hui"}), 404
-    return jsonify({
-        'date': taux.date.isoformat(),
-        'taux_achat': taux.taux_achat,
-        'taux_vente': taux.taux_vente
-    })
+        return jsonify({"msg": "Taux non définis pour aujourd'hui"}), 400
+
+    devise = devises.devise_requete()
+    if not devise:
+        return jsonify({"msg": "Devise inconnue"}), 400
+    version = taux_service.version_de(taux)
+    devis, erreur = devis_service.calculer(data.get('type'), montant, taux, version.id if version else None, devise)
+    if erreur:
+        return jsonify({"msg": erreur}), 400
+    jeton, expire = devis_service.emettre(devis, current_user_id())
+    return jsonify(dict(devis, devis=jeton, expire_le=datetime.utcfromtimestamp(expire).isoformat()))
+
+@api_bp.route('/rates/at', methods=['GET'])
+def rates_at():
+    """Taux en vigueur à l'instant `t` (ISO 8601, UTC ; défaut : maintenant), lu dans l'index des versions."""
+    instant = request.args.get('t')
+    try:
+        instant = datetime.fromisoformat(instant) if instant else datetime.utcnow()
+    except ValueError:
+        return jsonify({"msg": "Paramètre t invalide (ISO 8601 attendu)"}), 400
+    devise = devises.devise_requete()
+    if not devise:
+        return jsonify({"msg": "Devise inconnue"}), 400
+    if instant.tzinfo:
+        # Décalage explicite : converti en UTC, comme les dates d'effet des versions
+        instant = instant.astimezone(timezone.utc).replace(tzinfo=None)
+    version = taux_service.taux_a(instant)
+    if not version:
+        return jsonify({"msg": "Aucun taux à cette date"}), 404
+    return jsonify(dict(
+        devises.taux_en(version, devise),
+        version=version.id,
+        date=version.date.isoformat(),
+        date_effet=version.date_effet.isoformat(),
+        devise=devise,
+    ))
 
 @api_bp.route('/rates/calculate', methods=['POST'])
 def calculate_rates():
@@ -390,15 +650,23 @@ def calculate_rates():
     except ValueError:
         return jsonify({"msg": "Valeurs numériques invalides"}), 400
 
+    # taux_mondial et benefice en XAF ; montant d'achat dans la devise demandée
+    devise = devises.devise_requete()
+    if not devise:
+        return jsonify({"msg": "Devise inconnue"}), 400
+
     if type_calc == 'vente':   # le client vend des USDT => calcul des XAF reçus
         result, error = calculer_taux_achat_usdt(taux_mondial, benefice, montant)
     elif type_calc == 'achat': # le client achète des USDT => calcul des USDT reçus
-        result, error = calculer_taux_vente_usdt(taux_mondial, benefice, montant)
+        result, error = calculer_taux_vente_usdt(taux_mondial, benefice, devises.convertir(montant, devise))
     else:
         return jsonify({"msg": "Type invalide (utiliser 'achat' ou 'vente')"}), 400
 
     if error:
         return jsonify({"msg": error}), 400
+    result['devise'] = devise
+    if type_calc == 'vente':
+        result['montant_local_final'] = montants.arrondir(devises.convertir(result['xaf_final'], devises.REFERENCE, devise))
     return jsonify(result)
 
 # -------------------------------------------------------------------
@@ -410,21 +678,25 @@ def admin_users():
     users = Utilisateur.query.order_by(Utilisateur.date_inscription.desc()).all()
     return jsonify([u.to_dict() for u in users])
 
-@api_bp.route('/admin/users/<string:user_uuid>', methods=['DELETE'])
+@api_bp.route('/admin/users/<int:user_id>', methods=['DELETE'])
 @admin_required
-def admin_delete_user(user_uuid):
-    user = Utilisateur.query.filter_by(identifiant_unique=user_uuid).first_or_404()
+def admin_delete_user(user_id):
+    # Les utilisateurs sont exposés par leur id (Utilisateur.to_dict)
+    user = Utilisateur.query.get_or_404(user_id)
     if user.id == current_user_id():
         return jsonify({"msg": "Impossible de supprimer votre propre compte"}), 400
     db.session.delete(user)
     db.session.commit()
     return jsonify({"msg": "Utilisateur supprimé"}), 200
 
-@api_bp.route('/admin/users/<string:user_uuid>/toggle-admin', methods=['POST'])
+@api_bp.route('/admin/users/<int:user_id>/toggle-admin', methods=['POST'])
 @admin_required
-def admin_toggle_admin(user_uuid):
-    user = Utilisateur.query.filter_by(identifiant_unique=user_uuid).first_or_404()
+def admin_toggle_admin(user_id):
+    user = Utilisateur.query.get_or_404(user_id)
     user.est_admin = not user.est_admin
+    if user.est_admin:
+        notifications_service.demarrer_flux_admin(user.id)
+    notifications_service.recalculer_compteur(user.id)
     db.session.commit()
     return jsonify({"msg": "Rôle modifié", "est_admin": user.est_admin})
 
@@ -438,27 +710,108 @@ def admin_transactions():
     query = Transaction.query
     if statut and statut != 'tous':
         query = query.filter_by(statut=statut)
-    transactions = query.order_by(Transaction.date_creation.desc()).all()
+    transactions = query.options(joinedload(Transaction.utilisateur))\
+        .order_by(Transaction.date_creation.desc()).all()
     return jsonify([t.to_dict() for t in transactions])
 
+# -------------------------------------------------------------------
+# ADMIN : file de validation partagée (réservation avec bail)
+# -------------------------------------------------------------------
+def _transaction_reservee(transaction, echeance=None):
+    donnees = transaction.to_dict()
+    donnees['reserve_jusqua'] = (echeance or transaction.reserve_jusqua).isoformat()
+    return donnees
+
+@api_bp.route('/admin/queue/claim', methods=['POST'])
+@admin_required
+def admin_queue_claim():
+    """
+    Réserve les N transactions en attente les plus anciennes non réservées
+    (ou dont le bail a expiré). Deux admins simultanés reçoivent des
+    transactions différentes.
+    """
+    data = request.get_json(silent=True) or {}
+    maximum = current_app.config.get('FILE_VALIDATION_MAX_RESERVATION', 20)
+    try:
+        nombre = int(data.get('n', 1))
+    except (TypeError, ValueError):
+        return jsonify({"msg": "n invalide"}), 400
+    if not 1 <= nombre <= maximum:
+        return jsonify({"msg": f"n doit être compris entre 1 et {maximum}"}), 400
+    transactions, echeance = file_validation.reserver(current_user_id(), nombre)
+    reponse = [_transaction_reservee(t, echeance) for t in transactions]
+    db.session.commit()
+    return jsonify({"transactions": reponse, "reserve_jusqua": echeance.isoformat()})
+
+def _identifiants_transactions(data, maximum=None):
+    maximum = maximum or current_app.config.get('FILE_VALIDATION_MAX_RESERVATION', 20)
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids or len(ids) > maximum or not all(isinstance(i, str) for i in ids):
+        return None
+    return ids
+
+@api_bp.route('/admin/queue/renew', methods=['POST'])
+@admin_required
+def admin_queue_renew():
+    """Prolonge le bail des transactions encore réservées par l'admin."""
+    ids = _identifiants_transactions(request.get_json(silent=True) or {})
+    if ids is None:
+        return jsonify({"msg": "Liste 'ids' invalide"}), 400
+    count, echeance = file_validation.prolonger(current_user_id(), ids)
+    db.session.commit()
+    return jsonify({"renewed": count, "reserve_jusqua": echeance.isoformat()})
+
+@api_bp.route('/admin/queue/release', methods=['POST'])
+@admin_required
+def admin_queue_release():
+    """Rend à la file des transactions réservées par l'admin sans les traiter."""
+    ids = _identifiants_transactions(request.get_json(silent=True) or {})
+    if ids is None:
+        return jsonify({"msg": "Liste 'ids' invalide"}), 400
+    count = file_validation.liberer(current_user_id(), ids)
+    db.session.commit()
+    return jsonify({"released": count})
+
+@api_bp.route('/admin/queue/events', methods=['GET'])
+@admin_required
+def admin_queue_events():
+    """
+    Flux SSE de la file de validation : nouvelles transactions en attente et
+    changements de statut (`event: transaction`), réservations
+    (`event: reservation`) et libérations (`event: liberation`). Avec
+    Last-Event-ID, les transactions modifiées entre-temps sont rejouées.
+    """
+    heartbeat = current_app.config.get('SSE_HEARTBEAT', 15)
+    rattrapage = []
+    depuis = _lire_jeton_sync(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    if depuis is not None:
+        transactions = Transaction.query.filter(Transaction.date_mise_a_jour > depuis - SYNC_MARGE)\
+            .order_by(Transaction.date_mise_a_jour).limit(200).all()
+        rattrapage = [('transaction', pubsub.resume_transaction(t)) for t in transactions]
+    return _reponse_sse([file_validation.CANAL_ADMINS], rattrapage, heartbeat)
+
 @api_bp.route('/admin/transactions/<string:trans_id>/validate', methods=['POST'])
 @admin_required
 def admin_validate_transaction(trans_id):
     transaction = Transaction.query.filter_by(identifiant_transaction=trans_id).first_or_404()
+    if file_validation.reservee_par_autre(transaction, current_user_id()):
+        return jsonify({"msg": "Transaction réservée par un autre administrateur"}), 409
     transaction.statut = 'complete'
+    transaction.reserve_par = transaction.reserve_jusqua = None
     transaction.date_validation = db.func.current_timestamp()
     # Notification utilisateur
     notif = Notification(utilisateur_id=transaction.utilisateur_id,
                          type_notification='transaction_validee',
                          message=f"Votre transaction {transaction.montant_usdt} USDT a été validée.")
     db.session.add(notif)
-    db.session.commit()
-    _push_to_users(
-        [transaction.utilisateur_id],
+    outbox.ajouter_push(
         "Transaction validée",
         f"Votre transaction {transaction.identifiant_transaction} a été validée.",
-        data={"type": "transaction_validated", "transaction_id": transaction.identifiant_transaction},
+        donnees={"type": "transaction_validated", "transaction_id": transaction.identifiant_transaction},
+        utilisateur_ids=[transaction.utilisateur_id],
+        cle=f"transaction_validated:{transaction.identifiant_transaction}",
     )
+    db.session.commit()
     return jsonify({"msg": "Transaction validée"})
 
 @api_bp.route('/admin/transactions/<string:trans_id>/reject', methods=['POST'])
@@ -467,20 +820,24 @@ def admin_reject_transaction(trans_id):
     data = request.get_json()
     motif = data.get('motif', '')
     transaction = Transaction.query.filter_by(identifiant_transaction=trans_id).first_or_404()
+    if file_validation.reservee_par_autre(transaction, current_user_id()):
+        return jsonify({"msg": "Transaction réservée par un autre administrateur"}), 409
     transaction.statut = 'rejete'
+    transaction.reserve_par = transaction.reserve_jusqua = None
     transaction.motif_rejet = motif
     transaction.date_validation = db.func.current_timestamp()
     notif = Notification(utilisateur_id=transaction.utilisateur_id,
                          type_notification='transaction_rejetee',
                          message=f"Transaction rejetée. Motif: {motif}")
     db.session.add(notif)
-    db.session.commit()
-    _push_to_users(
-        [transaction.utilisateur_id],
+    outbox.ajouter_push(
         "Transaction rejetée",
         f"Votre transaction {transaction.identifiant_transaction} a été rejetée.",
-        data={"type": "transaction_rejected", "transaction_id": transaction.identifiant_transaction},
+        donnees={"type": "transaction_rejected", "transaction_id": transaction.identifiant_transaction},
+        utilisateur_ids=[transaction.utilisateur_id],
+        cle=f"transaction_rejected:{transaction.identifiant_transaction}",
     )
+    db.session.commit()
     return jsonify({"msg": "Transaction rejetée"})
 
 # -------------------------------------------------------------------
@@ -497,6 +854,8 @@ def admin_wallets():
         'pays': w.pays,
         'type': w.type_portefeuille,
         'est_actif': w.est_actif,
+        'poids': w.poids,
+        'plafond_journalier': w.plafond_journalier,
         'date_ajout': w.date_ajout.isoformat()
     } for w in wallets])
 
@@ -513,7 +872,9 @@ def admin_add_wallet():
         adresse=data['adresse'],
         pays=data.get('pays'),
         type_portefeuille=data['type_portefeuille'],
-        est_actif=data.get('est_actif', True)
+        est_actif=data.get('est_actif', True),
+        poids=int(data.get('poids') or 1),
+        plafond_journalier=float(data['plafond_journalier']) if data.get('plafond_journalier') else None
     )
     db.session.add(wallet)
     db.session.commit()
@@ -561,43 +922,47 @@ def admin_add_rate():
         date_app = datetime.strptime(date_app, '%Y-%m-%d').date()
     else:
         date_app = date.today()
+    erreur = taux_service.verifier_date(date_app)
+    if erreur:
+        return jsonify({"msg": erreur}), 400
 
-    existing = TauxJournalier.query.filter_by(date=date_app).first()
-    if existing:
-        existing.taux_achat = taux_achat
-        existing.taux_vente = taux_vente
-        action = "mis à jour"
-    else:
-        new_rate = TauxJournalier(
-            taux_achat=taux_achat,
-            taux_vente=taux_vente,
-            date=date_app
-        )
-        db.session.add(new_rate)
-        action = "ajouté"
-
-    # Notification broadcast à tous les utilisateurs actifs
-    utilisateurs = Utilisateur.query.filter_by(est_actif=True).all()
-    for utilisateur in utilisateurs:
-        notif = Notification(
-            utilisateur_id=utilisateur.id,
-            type_notification='rate_updated',
-            message=(
-                f"Nouveaux taux {action} ({date_app.isoformat()}): "
-                f"Achat {taux_achat} XAF | Vente {taux_vente} XAF"
-            ),
-        )
-        db.session.add(notif)
-    db.session.commit()
+    _, cree = taux_service.enregistrer_taux(taux_achat, taux_vente, date_app, current_user_id())
+    action = "ajouté" if cree else "mis à jour"
 
-    _push_to_users(
-        [u.id for u in utilisateurs],
+    # Notification broadcast à tous les utilisateurs actifs (insertion en lot)
+    notifications_service.diffuser_aux_actifs(
+        'rate_updated',
+        f"Nouveaux taux {action} ({date_app.isoformat()}): "
+        f"Achat {taux_achat} XAF | Vente {taux_vente} XAF",
+    )
+    outbox.ajouter_push(
         "Mise à jour des taux",
         f"Nouveaux taux: Achat {taux_achat} XAF | Vente {taux_vente} XAF",
-        data={"type": "rate_updated", "date": date_app.isoformat()},
+        donnees={"type": "rate_updated", "date": date_app.isoformat()},
+        actifs=True,
     )
+    db.session.commit()
     return jsonify({"msg": "Taux enregistré"}), 201
 
+@api_bp.route('/admin/rates/stats', methods=['GET'])
+@admin_required
+def admin_rates_stats():
+    """Nombre de jours, moyennes et min/max des taux : historique complet, 7 et 30 derniers jours."""
+    return jsonify(agregats_taux.statistiques())
+
+@api_bp.route('/admin/stats/volumes', methods=['GET'])
+@admin_required
+def admin_stats_volumes():
+    """Volumes complétés par jour et par sens (`jours` derniers jours, 30 par défaut), agrégés en base."""
+    jours = request.args.get('jours', 30, type=int)
+    if not 1 <= jours <= 366:
+        return jsonify({"msg": "jours doit être compris entre 1 et 366"}), 400
+    return jsonify({
+        'jours': jours,
+        'chiffre_affaires': montants.chiffre_affaires(db.session),
+        'volumes': montants.volumes_journaliers(db.session, jours),
+    })
+
 @api_bp.route('/admin/rates/<int:rate_id>', methods=['DELETE'])
 @admin_required
 def admin_delete_rate(rate_id):
@@ -628,6 +993,7 @@ def register_device_token():
         existing.utilisateur_id = user_id
         existing.platform = platform
         existing.est_actif = True
+        existing.date_mise_a_jour = datetime.utcnow()  # rafraîchi à chaque enregistrement (expiration)
     else:
         db.session.add(
             PushToken(
@@ -648,17 +1014,12 @@ def unregister_device_token():
     user_id = current_user_id()
     data = request.get_json() or {}
     token = (data.get('token') or '').strip()
+    query = PushToken.query.filter_by(utilisateur_id=user_id, est_actif=True)
     if token:
-        row = PushToken.query.filter_by(utilisateur_id=user_id, token=token).first()
-        if row:
-            row.est_actif = False
-    else:
-        PushToken.query.filter_by(utilisateur_id=user_id, est_actif=True).update(
-            {"est_actif": False},
-            synchronize_session=False,
-        )
+        query = query.filter_by(token=token)
+    count = query.update({"est_actif": False}, synchronize_session=False)
     db.session.commit()
-    return jsonify({"msg": "Token appareil désactivé"})
+    return jsonify({"msg": "Token appareil désactivé", "count": count})
 
 
 @api_bp.route('/notifications', methods=['GET'])
@@ -669,20 +1030,11 @@ def get_notifications():
     limit = request.args.get('limit', default=50, type=int)
     limit = max(1, min(limit, 200))
 
-    query = Notification.query
-    if user.est_admin:
-        query = query.filter(
-            (Notification.admin_id == user_id) | (Notification.utilisateur_id == user_id)
-        )
-    else:
-        query = query.filter(Notification.utilisateur_id == user_id)
-
-    notifications = query.order_by(Notification.date_creation.desc()).limit(limit).all()
-    unread_count = query.filter_by(est_lue=False).count()
+    entrees = notifications_service.notifications_utilisateur(user, limit)
 
     return jsonify({
-        "notifications": [_notification_to_dict(n) for n in notifications],
-        "unread_count": unread_count,
+        "notifications": [_notification_to_dict(n, est_lue) for n, est_lue in entrees],
+        "unread_count": user.notifications_non_lues,
     })
 
 
@@ -698,6 +1050,10 @@ def mark_notification_read(notification_id):
         or notification.admin_id == user_id
         or (user.est_admin and notification.utilisateur_id == user_id)
     )
+    if notification.est_flux_admin and user.est_admin:
+        notifications_service.marquer_flux_lu(user, [notification.id])
+        db.session.commit()
+        return jsonify({"msg": "Notification marquée comme lue"})
     if not allowed:
         return jsonify({"msg": "Accès refusé"}), 403
 
@@ -711,23 +1067,23 @@ def mark_notification_read(notification_id):
 def mark_all_notifications_read():
     user_id = current_user_id()
     user = Utilisateur.query.get_or_404(user_id)
-    query = Notification.query
+    count = notifications_service.marquer_lues(user)
+    db.session.commit()
+    return jsonify({"msg": "Toutes les notifications ont été marquées comme lues", "count": count})
 
-    if user.est_admin:
-        query = query.filter(
-            ((Notification.admin_id == user_id) | (Notification.utilisateur_id == user_id))
-            & (Notification.est_lue.is_(False))
-        )
-    else:
-        query = query.filter(
-            (Notification.utilisateur_id == user_id) & (Notification.est_lue.is_(False))
-        )
 
-    for notification in query.all():
-        notification.est_lue = True
+@api_bp.route('/notifications/read', methods=['POST'])
+@jwt_required()
+def mark_notifications_read_batch():
+    user_id = current_user_id()
+    ids = _lire_ids(request.get_json() or {})
+    if ids is None:
+        return jsonify({"msg": "Liste 'ids' invalide (1 à 500 identifiants)"}), 400
 
+    user = Utilisateur.query.get_or_404(user_id)
+    count = notifications_service.marquer_lues(user, ids=ids)
     db.session.commit()
-    return jsonify({"msg": "Toutes les notifications ont été marquées comme lues"})
+    return jsonify({"msg": "Notifications marquées comme lues", "count": count})
 
 
 @api_bp.route('/notifications/<int:notification_id>', methods=['DELETE'])
@@ -742,9 +1098,94 @@ def delete_notification(notification_id):
         or notification.admin_id == user_id
         or (user.est_admin and notification.utilisateur_id == user_id)
     )
+    if notification.est_flux_admin and user.est_admin:
+        # Événement partagé : il disparaît seulement des non-lues de cet admin
+        notifications_service.marquer_flux_lu(user, [notification.id])
+        db.session.commit()
+        return jsonify({"msg": "Notification supprimée"})
     if not allowed:
         return jsonify({"msg": "Accès refusé"}), 403
 
     db.session.delete(notification)
     db.session.commit()
     return jsonify({"msg": "Notification supprimée"})
+
+
+@api_bp.route('/notifications', methods=['DELETE'])
+@jwt_required()
+def delete_notifications_batch():
+    user_id = current_user_id()
+    ids = _lire_ids(request.get_json() or {})
+    if ids is None:
+        return jsonify({"msg": "Liste 'ids' invalide (1 à 500 identifiants)"}), 400
+
+    user = Utilisateur.query.get_or_404(user_id)
+    count = notifications_service.supprimer(user, ids)
+    db.session.commit()
+    return jsonify({"msg": "Notifications supprimées", "count": count})
+
+
+# -------------------------------------------------------------------
+# Requêtes groupées (réseaux mobiles lents : un seul aller-retour)
+# -------------------------------------------------------------------
+BATCH_MAX_REQUETES = 20
+# Routes exclues des lots : le lot lui-même et les flux SSE (abonnement pub/sub,
+# fermeture de la session partagée, réponse jamais consommée)
+BATCH_ROUTES_EXCLUES = {'api.batch', 'api.events', 'api.admin_queue_events'}
+
+
+def _executer_sous_requete(chemin):
+    """Exécute une route GET de api_bp dans le contexte courant. Retourne (statut, corps JSON)."""
+    adaptateur = current_app.url_map.bind('localhost')
+    try:
+        endpoint, arguments = adaptateur.match(chemin.split('?', 1)[0], method='GET')
+    except HTTPException as exc:
+        return exc.code, {"msg": exc.description}
+    if not endpoint.startswith('api.') or endpoint in BATCH_ROUTES_EXCLUES:
+        return 400, {"msg": "Route non autorisée dans un lot"}
+
+    # Même contexte d'application : identité JWT et session SQLAlchemy partagées
+    with current_app.test_request_context(chemin, method='GET', headers={
+        'Authorization': request.headers.get('Authorization', ''),
+    }):
+        try:
+            resultat = current_app.view_functions[endpoint](**arguments)
+        except HTTPException as exc:
+            return exc.code, {"msg": exc.description}
+        except Exception as exc:
+            db.session.rollback()
+            try:
+                resultat = current_app.handle_user_exception(exc)
+            except Exception as erreur:
+                print(f"[BATCH] {chemin}: {erreur}")
+                return 500, {"msg": "Erreur interne"}
+        reponse = current_app.make_response(resultat)
+        if reponse.is_streamed:
+            # Flux non prévu par BATCH_ROUTES_EXCLUES : fermé pour libérer ses ressources
+            reponse.close()
+            return 400, {"msg": "Route non autorisée dans un lot"}
+        return reponse.status_code, reponse.get_json(silent=True)
+
+
+@api_bp.route('/batch', methods=['POST'])
+@jwt_required()
+def batch():
+    """
+    Exécute en un appel plusieurs requêtes GET vers les routes /api :
+    {"requests": [{"id": "profil", "path": "/api/user/profile"}, ...]}.
+    Chaque résultat porte son propre statut ; un échec n'interrompt pas le lot.
+    """
+    requetes = (request.get_json() or {}).get('requests')
+    if not isinstance(requetes, list) or not requetes or len(requetes) > BATCH_MAX_REQUETES:
+        return jsonify({"msg": f"Liste 'requests' invalide (1 à {BATCH_MAX_REQUETES} requêtes)"}), 400
+
+    resultats = []
+    for index, requete in enumerate(requetes):
+        chemin = requete.get('path') if isinstance(requete, dict) else None
+        identifiant = requete.get('id', index) if isinstance(requete, dict) else index
+        if not isinstance(chemin, str) or not chemin.startswith('/api/'):
+            statut, corps = 400, {"msg": "Chemin invalide"}
+        else:
+            statut, corps = _executer_sous_requete(chemin)
+        resultats.append({"id": identifiant, "path": chemin, "status": statut, "body": corps})
+    return jsonify({"responses": resultats})
@@ -5,11 +5,12 @@ import uuid
 from flask import Flask, request
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
-from sqlalchemy import inspect, text
+from sqlalchemy import Integer, inspect, text
 from models import db, Utilisateur
 from api_routes import api_bp
 from auth import auth_bp  # si vous conservez les routes web
 from Config import Config
+import outbox
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -57,6 +58,123 @@ def _ensure_sqlite_schema_updates():
             connection.execute(text(statement))
 
 
+# Colonnes ajoutées après la création initiale : (table, colonne, définition SQL)
+SCHEMA_COLONNES = [
+    ("utilisateurs", "notifications_non_lues", "INTEGER NOT NULL DEFAULT 0"),
+    ("utilisateurs", "flux_admin_lu_jusqua", "INTEGER NOT NULL DEFAULT 0"),
+    ("notifications", "est_flux_admin", "BOOLEAN NOT NULL DEFAULT FALSE"),
+    ("utilisateurs", "date_mise_a_jour", "TIMESTAMP"),
+    ("transactions", "date_mise_a_jour", "TIMESTAMP"),
+    ("taux_journaliers", "date_mise_a_jour", "TIMESTAMP"),
+    ("notifications", "date_mise_a_jour", "TIMESTAMP"),
+    ("transactions", "reserve_par", "INTEGER REFERENCES utilisateurs (id)"),
+    ("transactions", "reserve_jusqua", "TIMESTAMP"),
+    ("transactions", "version_taux_id", "INTEGER REFERENCES versions_taux (id)"),
+    ("portefeuilles_admin", "poids", "INTEGER NOT NULL DEFAULT 1"),
+    ("portefeuilles_admin", "plafond_journalier", "FLOAT"),
+    ("transactions", "devise", "VARCHAR(3) NOT NULL DEFAULT 'XAF'"),
+    ("transactions", "montant_local", "BIGINT"),
+]
+
+# Remplissage des lignes existantes quand la colonne vient d'être ajoutée
+SCHEMA_REMPLISSAGE = {
+    ("utilisateurs", "date_mise_a_jour"): "UPDATE utilisateurs SET date_mise_a_jour = date_inscription",
+    ("transactions", "date_mise_a_jour"):
+        "UPDATE transactions SET date_mise_a_jour = COALESCE(date_validation, date_creation)",
+    ("taux_journaliers", "date_mise_a_jour"): "UPDATE taux_journaliers SET date_mise_a_jour = timestamp",
+    ("notifications", "date_mise_a_jour"): "UPDATE notifications SET date_mise_a_jour = date_creation",
+    ("transactions", "montant_local"): "UPDATE transactions SET montant_local = CAST(ROUND(montant_xaf) AS BIGINT)",
+}
+
+SCHEMA_INDEX = [
+    "CREATE INDEX IF NOT EXISTS ix_notifications_utilisateur_id ON notifications (utilisateur_id)",
+    "CREATE INDEX IF NOT EXISTS ix_notifications_admin_id ON notifications (admin_id)",
+    "CREATE INDEX IF NOT EXISTS ix_notifications_est_flux_admin ON notifications (est_flux_admin)",
+    "CREATE INDEX IF NOT EXISTS ix_notifications_date_creation ON notifications (date_creation)",
+    "CREATE INDEX IF NOT EXISTS ix_push_tokens_date_mise_a_jour ON push_tokens (date_mise_a_jour)",
+    "CREATE INDEX IF NOT EXISTS ix_notifications_date_mise_a_jour ON notifications (date_mise_a_jour)",
+    "CREATE INDEX IF NOT EXISTS ix_notifications_utilisateur_maj ON notifications (utilisateur_id, date_mise_a_jour)",
+    "CREATE INDEX IF NOT EXISTS ix_transactions_utilisateur_maj ON transactions (utilisateur_id, date_mise_a_jour)",
+    "CREATE INDEX IF NOT EXISTS ix_transactions_file_validation ON transactions (statut, reserve_jusqua)",
+]
+
+
+# Colonnes monétaires passées de FLOAT à BIGINT en unités mineures (montants.py) :
+# (table, colonne, échelle, définition SQLite)
+SCHEMA_MONTANTS = [
+    ("transactions", "montant_xaf", 1, "BIGINT NOT NULL DEFAULT 0"),
+    ("transactions", "montant_usdt", 1_000_000, "BIGINT NOT NULL DEFAULT 0"),
+    ("transactions", "taux_applique", 10_000, "BIGINT NOT NULL DEFAULT 0"),
+    ("transactions", "montant_local", 1, "BIGINT"),
+]
+
+
+def _convertir_montants(connection):
+    """
+    Convertit en BIGINT (valeur * échelle, arrondie) les colonnes encore en
+    virgule flottante. Idempotent : une colonne déjà entière est ignorée.
+    SQLite ne sait pas changer le type d'une colonne : nouvelle colonne,
+    recopie, suppression de l'ancienne puis renommage.
+    """
+    inspector = inspect(connection)
+    types = {}
+    for table, colonne, echelle, definition in SCHEMA_MONTANTS:
+        if table not in types:
+            types[table] = {col["name"]: col["type"] for col in inspector.get_columns(table)}
+        type_actuel = types[table].get(colonne)
+        if type_actuel is None or isinstance(type_actuel, Integer):
+            continue
+        print(f"[SCHEMA] {table}.{colonne} -> BIGINT (x{echelle})")
+        if connection.dialect.name == "postgresql":
+            connection.execute(text(
+                f"ALTER TABLE {table} ALTER COLUMN {colonne} TYPE BIGINT "
+                f"USING ROUND({colonne}::numeric * {echelle})::bigint"
+            ))
+        else:
+            temporaire = f"{colonne}__entier"
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {temporaire} {definition}"))
+            connection.execute(text(
+                f"UPDATE {table} SET {temporaire} = CAST(ROUND({colonne} * {echelle}) AS INTEGER)"
+            ))
+            connection.execute(text(f"ALTER TABLE {table} DROP COLUMN {colonne}"))
+            connection.execute(text(f"ALTER TABLE {table} RENAME COLUMN {temporaire} TO {colonne}"))
+
+
+def _ensure_schema_updates():
+    """Colonnes et index ajoutés après la création initiale (SQLite et PostgreSQL)."""
+    engine = db.engine
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    colonnes = {
+        table: {col["name"] for col in inspector.get_columns(table)}
+        for table in {t for t, _, _ in SCHEMA_COLONNES} & tables
+    }
+    ajoutees = [
+        (table, colonne, definition)
+        for table, colonne, definition in SCHEMA_COLONNES
+        if table in colonnes and colonne not in colonnes[table]
+    ]
+
+    with engine.begin() as connection:
+        for table, colonne, definition in ajoutees:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {colonne} {definition}"))
+            if (table, colonne) in SCHEMA_REMPLISSAGE:
+                connection.execute(text(SCHEMA_REMPLISSAGE[(table, colonne)]))
+        for statement in SCHEMA_INDEX:
+            connection.execute(text(statement))
+        if "transactions" in tables:
+            _convertir_montants(connection)
+
+    if any(colonne == "notifications_non_lues" for _, colonne, _ in ajoutees):
+        from notifications import reconcilier_compteurs
+        reconcilier_compteurs()
+
+    if any(colonne == "version_taux_id" for _, colonne, _ in ajoutees):
+        # Historique des taux : une version initiale pour chaque jour existant
+        from taux import amorcer_versions
+        amorcer_versions()
+
+
 def _ensure_default_admin():
     """Crée (ou met à jour) l'admin par défaut au démarrage."""
     admin_email = Config.ADMIN_EMAIL
@@ -102,6 +220,7 @@ def _ensure_default_admin():
 with app.app_context():
     db.create_all()
     _ensure_sqlite_schema_updates()
+    _ensure_schema_updates()
     _ensure_default_admin()
 
 app.config.from_object(Config)
@@ -112,5 +231,11 @@ CORS(app)  # Autorise les requêtes depuis votre application Flutter
 app.register_blueprint(api_bp)
 app.register_blueprint(auth_bp)
 
+if app.config.get('OUTBOX_RELAIS') == 'integre':
+    @app.before_request
+    def demarrer_relais_outbox():
+        # À la première requête : après le fork des workers (gunicorn), pas dans les scripts de maintenance
+        outbox.demarrer_relais(app)
+
 if __name__=='__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
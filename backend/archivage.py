@@ -0,0 +1,106 @@
+"""
+Rétention des notifications.
+
+Sont expirées :
+- les notifications personnelles lues plus anciennes que
+  `NOTIFICATIONS_RETENTION_JOURS` ;
+- les événements du flux admin plus anciens que
+  `NOTIFICATIONS_FLUX_RETENTION_JOURS` (lus ou non : ils sont partagés).
+
+Les lignes expirées sont déplacées par lots bornés, un commit par lot et
+une pause entre deux lots pour ne pas bloquer le trafic en ligne, soit vers
+la table `notifications_archive` (copie et suppression dans la même
+transaction), soit vers un fichier JSONL compressé (gzip, en ajout ; un
+arrêt entre l'écriture et le commit peut dupliquer quelques lignes).
+"""
+
+import gzip
+import json
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, insert, select
+
+from models import db, Notification, NotificationArchive, LectureFluxAdmin, Utilisateur
+import notifications as notifications_service
+
+TAILLE_LOT = 1000
+
+COLONNES = ['id', 'utilisateur_id', 'admin_id', 'type_notification', 'message',
+            'est_lue', 'est_flux_admin', 'date_creation']
+
+_notifications = Notification.__table__
+_archive = NotificationArchive.__table__
+_lectures = LectureFluxAdmin.__table__
+
+
+def _deplacer(ids, fichier):
+    """Copie les notifications `ids` vers l'archive (table ou fichier) puis les supprime."""
+    colonnes = select(*[_notifications.c[nom] for nom in COLONNES]).where(_notifications.c.id.in_(ids))
+    if fichier is not None:
+        for row in db.session.execute(colonnes).mappings():
+            ligne = dict(row)
+            if ligne['date_creation']:
+                ligne['date_creation'] = ligne['date_creation'].isoformat()
+            fichier.write(json.dumps(ligne, ensure_ascii=False) + '\n')
+        fichier.flush()
+    else:
+        db.session.execute(insert(_archive).from_select(COLONNES, colonnes))
+    db.session.execute(delete(_lectures).where(_lectures.c.notification_id.in_(ids)))
+    db.session.execute(delete(_notifications).where(_notifications.c.id.in_(ids)))
+    db.session.commit()
+
+
+def _archiver_selection(selection, fichier, taille_lot, pause, maximum):
+    total = 0
+    while maximum is None or total < maximum:
+        lot = taille_lot if maximum is None else min(taille_lot, maximum - total)
+        ids = db.session.execute(selection.limit(lot)).scalars().all()
+        if not ids:
+            break
+        _deplacer(ids, fichier)
+        total += len(ids)
+        if len(ids) < lot:
+            break
+        if pause:
+            time.sleep(pause)
+    return total
+
+
+def archiver(jours=None, jours_flux=None, taille_lot=TAILLE_LOT, pause=0.1, chemin_fichier=None, maximum=None):
+    """
+    Applique la politique de rétention. `maximum` borne le nombre de lignes
+    déplacées par catégorie et par exécution. Retourne le bilan par catégorie.
+    """
+    config = current_app.config
+    jours = jours if jours is not None else config.get('NOTIFICATIONS_RETENTION_JOURS', 90)
+    jours_flux = jours_flux if jours_flux is not None else config.get('NOTIFICATIONS_FLUX_RETENTION_JOURS', 90)
+    maintenant = datetime.utcnow()
+
+    personnelles = select(_notifications.c.id).where(
+        _notifications.c.est_flux_admin.is_(False),
+        _notifications.c.est_lue.is_(True),
+        _notifications.c.date_creation < maintenant - timedelta(days=jours),
+    ).order_by(_notifications.c.id)
+    flux = select(_notifications.c.id).where(
+        _notifications.c.est_flux_admin.is_(True),
+        _notifications.c.date_creation < maintenant - timedelta(days=jours_flux),
+    ).order_by(_notifications.c.id)
+
+    fichier = gzip.open(chemin_fichier, 'at', encoding='utf-8') if chemin_fichier else None
+    try:
+        bilan = {
+            'personnelles': _archiver_selection(personnelles, fichier, taille_lot, pause, maximum),
+            'flux': _archiver_selection(flux, fichier, taille_lot, pause, maximum),
+        }
+    finally:
+        if fichier is not None:
+            fichier.close()
+
+    if bilan['flux']:
+        # Des événements non lus du flux ont pu disparaître : compteurs des admins recalculés
+        for (admin_id,) in db.session.query(Utilisateur.id).filter(Utilisateur.est_admin.is_(True)).all():
+            notifications_service.recalculer_compteur(admin_id)
+        db.session.commit()
+    return bilan
@@ -0,0 +1,197 @@
+"""
+Micro-benchmarks des calculateurs, sérialiseurs et chemins ORM critiques.
+
+Chaque benchmark est exécuté sur plusieurs tours (calibrés automatiquement)
+contre une base SQLite en mémoire. Les résultats sont enregistrés en JSON ;
+le mode comparaison signale les régressions au-delà d'un seuil.
+
+Usage :
+    python bench.py --sortie bench_base.json
+    python bench.py --comparer bench_base.json --seuil 10
+    python bench.py --filtre to_dict
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import date, datetime
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+
+from Config import Config
+from models import db, Utilisateur, Transaction, PortefeuilleAdmin, TauxJournalier, Notification, ParametreSysteme
+from utils import calculer_taux_vente_usdt, calculer_taux_achat_usdt, formater_montant, determiner_reseau_par_adresse
+from taux import amorcer_versions
+
+DUREE_TOUR = 0.05   # secondes visées par tour
+NB_TOURS = 15
+
+
+def creer_app_memoire(database_uri='sqlite://'):
+    """Application minimale (API) sur une base dédiée, pour l'outillage de mesure."""
+    from api_routes import api_bp
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    db.init_app(app)
+    JWTManager(app)
+    app.register_blueprint(api_bp)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def preparer_donnees():
+    """Jeu de données minimal pour les chemins d'écriture achat/vente."""
+    admin = Utilisateur(nom='Admin', telephone='237600000000', email='admin@bench.test',
+                        pays='CM', est_admin=True, est_actif=True)
+    client = Utilisateur(nom='Client', telephone='237600000001', email='client@bench.test',
+                         pays='CM', est_admin=False, est_actif=True)
+    db.session.add_all([admin, client])
+    db.session.add(TauxJournalier(taux_achat=590.0, taux_vente=610.0, date=date.today()))
+    db.session.add(PortefeuilleAdmin(reseau='MTN', adresse='237671737948', pays='CM',
+                                     type_portefeuille='mobile_money'))
+    db.session.add(PortefeuilleAdmin(reseau='TRC20', adresse='TXbenchAdresseCrypto000000000000',
+                                     type_portefeuille='crypto'))
+    db.session.add(ParametreSysteme(cle='limite_journaliere', valeur='{"xaf": 500000}', type_valeur='json'))
+    db.session.commit()
+    amorcer_versions()
+    # Solde suffisant pour que les ventes passent le contrôle de solde
+    db.session.add(Transaction(utilisateur_id=client.id, type_transaction='achat', montant_xaf=6100000,
+                               montant_usdt=10000, taux_applique=610.0, reseau='TRC20', statut='complete'))
+    db.session.commit()
+    return admin, client
+
+
+def mesurer(fonction, duree_tour=DUREE_TOUR, nb_tours=NB_TOURS):
+    """Calibre le nombre d'itérations par tour puis mesure `nb_tours` tours."""
+    iterations = 1
+    while True:
+        debut = time.perf_counter()
+        for _ in range(iterations):
+            fonction()
+        ecoule = time.perf_counter() - debut
+        if ecoule >= duree_tour or iterations >= 1_000_000:
+            break
+        iterations *= 2 if ecoule == 0 else max(2, min(10, int(duree_tour / ecoule) + 1))
+
+    temps = []
+    for _ in range(nb_tours):
+        debut = time.perf_counter()
+        for _ in range(iterations):
+            fonction()
+        temps.append((time.perf_counter() - debut) / iterations)
+
+    return {
+        'min': min(temps),
+        'max': max(temps),
+        'moyenne': statistics.fmean(temps),
+        'mediane': statistics.median(temps),
+        'ecart_type': statistics.stdev(temps) if len(temps) > 1 else 0.0,
+        'iterations': iterations,
+        'tours': nb_tours,
+    }
+
+
+def construire_benchmarks(app, client_http, entetes):
+    """Retourne la liste (nom, callable) des benchmarks."""
+    from api_routes import _notification_to_dict
+
+    transaction = Transaction.query.first()
+    utilisateur = Utilisateur.query.filter_by(est_admin=False).first()
+    notification = Notification(id=1, utilisateur_id=utilisateur.id, type_notification='rate_updated',
+                                message='Nouveaux taux', est_lue=False, date_creation=datetime.utcnow())
+
+    def achat():
+        reponse = client_http.post('/api/buy', headers=entetes, json={
+            'montant_xaf': 25000, 'reseau': 'TRC20', 'operateur_mobile': 'MTN',
+            'adresse_wallet': 'TXclientAdresse00000000000000000',
+        })
+        assert reponse.status_code == 201, reponse.get_data(as_text=True)
+
+    def vente():
+        reponse = client_http.post('/api/sell', headers=entetes, json={
+            'montant_usdt': 1, 'reseau': 'TRC20', 'operateur_mobile': 'MTN', 'numero_mobile': '237670000000',
+        })
+        assert reponse.status_code == 201, reponse.get_data(as_text=True)
+
+    return [
+        ('utils.calculer_taux_vente_usdt', lambda: calculer_taux_vente_usdt(600, 12, 100000)),
+        ('utils.calculer_taux_achat_usdt', lambda: calculer_taux_achat_usdt(600, 12, 250)),
+        ('utils.formater_montant', lambda: formater_montant(1234567.891)),
+        ('utils.determiner_reseau_par_adresse', lambda: determiner_reseau_par_adresse('So1anaAdresse' * 3 + 'abcde')),
+        ('Transaction.to_dict', transaction.to_dict),
+        ('Utilisateur.to_dict', utilisateur.to_dict),
+        ('api_routes._notification_to_dict', lambda: _notification_to_dict(notification)),
+        ('ParametreSysteme.get_valeur', lambda: ParametreSysteme.get_valeur('limite_journaliere')),
+        ('POST /api/buy', achat),
+        ('POST /api/sell', vente),
+    ]
+
+
+def executer(filtre=None, nb_tours=NB_TOURS):
+    app = creer_app_memoire()
+    resultats = {}
+    with app.app_context():
+        _, client = preparer_donnees()
+        entetes = {'Authorization': f"Bearer {create_access_token(identity=str(client.id))}"}
+        client_http = app.test_client()
+        for nom, fonction in construire_benchmarks(app, client_http, entetes):
+            if filtre and filtre not in nom:
+                continue
+            resultats[nom] = mesurer(fonction, nb_tours=nb_tours)
+            print(f"{nom:<40} {resultats[nom]['mediane'] * 1e6:>12.2f} µs (médiane)")
+    return {
+        'date': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'benchmarks': resultats,
+    }
+
+
+def comparer(reference, courant, seuil):
+    """Liste des régressions (médiane plus lente de plus de `seuil` %)."""
+    regressions = []
+    for nom, mesure in courant['benchmarks'].items():
+        base = reference.get('benchmarks', {}).get(nom)
+        if not base or not base['mediane']:
+            continue
+        variation = (mesure['mediane'] - base['mediane']) / base['mediane'] * 100
+        statut = 'REGRESSION' if variation > seuil else 'ok'
+        print(f"{nom:<40} {base['mediane'] * 1e6:>10.2f} -> {mesure['mediane'] * 1e6:>10.2f} µs "
+              f"({variation:+.1f}%) {statut}")
+        if variation > seuil:
+            regressions.append((nom, variation))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks Devisa-FX")
+    parser.add_argument('--sortie', help="Fichier JSON où enregistrer les résultats")
+    parser.add_argument('--comparer', help="Fichier JSON de référence à comparer")
+    parser.add_argument('--seuil', type=float, default=10.0, help="Seuil de régression en %% (médiane)")
+    parser.add_argument('--filtre', help="N'exécuter que les benchmarks dont le nom contient ce texte")
+    parser.add_argument('--tours', type=int, default=NB_TOURS)
+    args = parser.parse_args()
+
+    courant = executer(filtre=args.filtre, nb_tours=args.tours)
+    if args.sortie:
+        with open(args.sortie, 'w', encoding='utf-8') as fichier:
+            json.dump(courant, fichier, indent=2)
+
+    if args.comparer:
+        with open(args.comparer, encoding='utf-8') as fichier:
+            reference = json.load(fichier)
+        regressions = comparer(reference, courant, args.seuil)
+        if regressions:
+            print(f"{len(regressions)} régression(s) au-delà de {args.seuil}%")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Caches de processus invalidés par numéro de version (table versions_cache).
+
+Un `CacheVersionne` garde en mémoire le résultat de sa fonction de
+chargement. Chaque modification des données sources appelle `modifier()`
+dans la transaction qui écrit : la ligne `versions_cache` du cache est
+incrémentée dans la même transaction, et le cache du processus est invalidé
+au commit. Les autres workers relisent le numéro de version au plus une
+fois toutes les `intervalle` secondes (clé de configuration) et rechargent
+s'il a changé. Entre deux vérifications, `valeur()` ne fait aucune requête.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, VersionCache
+
+_versions = VersionCache.__table__
+
+
+class CacheVersionne:
+
+    def __init__(self, nom, charger, cle_intervalle, intervalle_defaut=1.0):
+        self.nom = nom
+        self._charger = charger
+        self._cle_intervalle = cle_intervalle
+        self._intervalle = intervalle_defaut
+        self._intervalle_defaut = intervalle_defaut
+        self._valeur = None
+        self._version = None
+        self._verifie_le = float('-inf')
+        self._verrou = threading.Lock()
+
+    def valeur(self):
+        """Données du cache, rechargées si la version en base a changé depuis la dernière vérification."""
+        if time.monotonic() - self._verifie_le >= self._intervalle:
+            self._verifier()
+        return self._valeur
+
+    def _verifier(self):
+        with self._verrou:
+            if time.monotonic() - self._verifie_le < self._intervalle:
+                return  # vérifié entre-temps par un autre thread
+            self._intervalle = current_app.config.get(self._cle_intervalle, self._intervalle_defaut)
+            version = db.session.execute(
+                select(_versions.c.version).where(_versions.c.nom == self.nom)
+            ).scalar() or 0
+            if version != self._version or self._valeur is None:
+                self._valeur = self._charger()
+                self._version = version
+            self._verifie_le = time.monotonic()
+
+    def invalider(self):
+        """Force la relecture du numéro de version au prochain accès."""
+        self._verifie_le = float('-inf')
+
+    def modifier(self, session=None):
+        """Incrémente la version dans la transaction en cours ; invalidation locale au commit."""
+        session = session or db.session()
+        dialecte = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+        instruction = dialecte.insert(_versions).values(nom=self.nom, version=1, date_mise_a_jour=datetime.utcnow())
+        session.connection().execute(instruction.on_conflict_do_update(
+            index_elements=[_versions.c.nom],
+            set_={'version': _versions.c.version + 1, 'date_mise_a_jour': datetime.utcnow()},
+        ))
+        session.info.setdefault('caches_modifies', set()).add(self)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalider_apres_commit(session):
+    for cache in session.info.pop('caches_modifies', ()):
+        cache.invalider()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _oublier(session):
+    session.info.pop('caches_modifies', None)
@@ -0,0 +1,105 @@
+"""
+Devis signés : verrouillage du taux pour une courte durée.
+
+`/api/quote` calcule un devis (sens, montants, taux, frais) avec le taux du
+jour et le retourne sous forme de jeton `<charge>.<signature>` :
+- charge : JSON compact encodé en base64url ;
+- signature : HMAC-SHA256 de la charge avec `DEVIS_CLE` (à défaut
+  `SECRET_KEY`).
+
+`/api/buy` et `/api/sell` acceptent le jeton (`devis`) et le vérifient sans
+état : ni relecture de `TauxJournalier`, ni recalcul. Le devis est lié à
+l'utilisateur et expire après `DEVIS_DUREE_SECONDES` ; pendant cette durée
+il peut servir à plusieurs ordres au même prix.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+from flask import current_app
+
+import devises
+import montants
+
+TYPES = ('achat', 'vente')
+
+
+def _cle():
+    config = current_app.config
+    return (config.get('DEVIS_CLE') or config['SECRET_KEY']).encode()
+
+
+def _b64(octets):
+    return base64.urlsafe_b64encode(octets).rstrip(b'=').decode()
+
+
+def _b64_decoder(texte):
+    return base64.urlsafe_b64decode(texte + '=' * (-len(texte) % 4))
+
+
+def _signer(charge):
+    return _b64(hmac.new(_cle(), charge.encode(), hashlib.sha256).digest())
+
+
+def calculer(type_transaction, montant, taux, version_id=None, devise=devises.REFERENCE):
+    """
+    Montants d'un ordre au taux du jour, comme les appliquent buy/sell :
+    achat = montant dans `devise` payé au taux de vente, vente = montant en
+    USDT cédé au taux d'achat. Les montants et le taux de référence restent
+    en XAF ; `montant_local` et `taux_local` sont exprimés dans `devise`.
+    `version_id` : VersionTaux du taux utilisé. Retourne (devis, erreur).
+    """
+    if type_transaction not in TYPES:
+        return None, "Type invalide (utiliser 'achat' ou 'vente')"
+    if montant <= 0:
+        return None, "Le montant doit être positif"
+    if type_transaction == 'achat':
+        taux_applique = taux.taux_vente
+        montant_local = montants.arrondir(montant)
+        montant_xaf = montants.arrondir(devises.convertir(montant, devise))
+        montant_usdt = round(montant_xaf / taux_applique, 2)
+    else:
+        taux_applique = taux.taux_achat
+        montant_xaf, montant_usdt = montants.arrondir(montant * taux_applique), montant
+        montant_local = montants.arrondir(devises.convertir(montant_xaf, devises.REFERENCE, devise))
+    return {
+        'type': type_transaction,
+        'montant_xaf': montant_xaf,
+        'montant_usdt': montant_usdt,
+        'taux': taux_applique,
+        'devise': devise,
+        'montant_local': montant_local,
+        'taux_local': devises.taux_en(taux, devise)['taux_vente' if type_transaction == 'achat' else 'taux_achat'],
+        'frais': 0.0,  # aucun frais opérateur n'est appliqué aux ordres
+        'version': version_id,
+    }, None
+
+
+def emettre(devis, utilisateur_id, duree=None):
+    """Signe le devis pour `utilisateur_id`. Retourne (jeton, expiration en timestamp UNIX)."""
+    duree = duree if duree is not None else current_app.config.get('DEVIS_DUREE_SECONDES', 60)
+    expire = int(time.time()) + duree
+    contenu = dict(devis, utilisateur_id=utilisateur_id, exp=expire)
+    charge = _b64(json.dumps(contenu, sort_keys=True, separators=(',', ':')).encode())
+    return f"{charge}.{_signer(charge)}", expire
+
+
+def verifier(jeton, utilisateur_id, type_transaction):
+    """Vérifie signature, expiration, utilisateur et sens du devis. Retourne (devis, erreur)."""
+    if not isinstance(jeton, str) or jeton.count('.') != 1:
+        return None, "Devis invalide"
+    charge, signature = jeton.split('.')
+    if not hmac.compare_digest(signature, _signer(charge)):
+        return None, "Devis invalide"
+    try:
+        devis = json.loads(_b64_decoder(charge))
+    except (ValueError, TypeError):
+        return None, "Devis invalide"
+    if devis.get('exp', 0) < time.time():
+        return None, "Devis expiré, demandez un nouveau devis"
+    if devis.get('utilisateur_id') != utilisateur_id or devis.get('type') != type_transaction:
+        return None, "Devis invalide"
+    return devis, None
@@ -0,0 +1,108 @@
+"""
+Devises locales (XAF, XOF) : conversion et taux par devise.
+
+Les taux journaliers et les montants `montant_xaf` restent en XAF, devise
+de référence. `DEVISES` donne la parité de chaque devise (unités pour 1
+EUR, parités fixes du franc CFA) ; la matrice de conversion
+`matrice()[de][vers]` en est dérivée une fois par configuration.
+
+Les taux d'achat / vente par devise sont dérivés du taux XAF et mis en
+cache par couple (taux_achat, taux_vente) : ils ne sont recalculés que
+lorsque les taux de base changent. Aucune fonction de ce module ne fait de
+requête : la devise de l'utilisateur vient du paramètre `devise` de la
+requête ou du claim `pays` du jeton JWT (registre des opérateurs).
+"""
+
+import threading
+
+from flask import current_app, request
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+
+import operateurs as operateurs_service
+
+REFERENCE = 'XAF'
+TAILLE_CACHE = 256
+
+_matrice = None
+_parites = None
+_taux = {}
+_verrou = threading.Lock()
+
+
+def parites():
+    return current_app.config.get('DEVISES', {REFERENCE: 655.957})
+
+
+def matrice():
+    """Facteurs de conversion : montant_vers = montant_de * matrice()[de][vers]."""
+    global _matrice, _parites
+    courantes = parites()
+    if _parites is not courantes:
+        _matrice = {
+            de: {vers: parite_vers / parite_de for vers, parite_vers in courantes.items()}
+            for de, parite_de in courantes.items()
+        }
+        _parites = courantes
+        _taux.clear()
+    return _matrice
+
+
+def est_connue(devise):
+    return devise in parites()
+
+
+def convertir(montant, de, vers=REFERENCE):
+    """Montant converti de la devise `de` vers `vers`."""
+    if de == vers:
+        return montant
+    return montant * matrice()[de][vers]
+
+
+def taux_en(taux, devise):
+    """
+    Taux d'achat / vente de `taux` (TauxJournalier ou VersionTaux, en XAF)
+    exprimés dans `devise`, arrondis au centime.
+    """
+    facteurs = matrice()[REFERENCE]
+    cle = (taux.taux_achat, taux.taux_vente)
+    par_devise = _taux.get(cle)
+    if par_devise is None:
+        par_devise = {
+            code: {
+                'taux_achat': round(taux.taux_achat * facteur, 2),
+                'taux_vente': round(taux.taux_vente * facteur, 2),
+            }
+            for code, facteur in facteurs.items()
+        }
+        par_devise[REFERENCE] = {'taux_achat': taux.taux_achat, 'taux_vente': taux.taux_vente}
+        with _verrou:
+            if len(_taux) >= TAILLE_CACHE:
+                _taux.clear()
+            _taux[cle] = par_devise
+    return par_devise[devise]
+
+
+def devise_pays(pays):
+    """Devise mobile money du pays (registre des opérateurs)."""
+    devise = operateurs_service.devise(pays)
+    return devise if est_connue(devise) else REFERENCE
+
+
+def devise_requete():
+    """
+    Devise de la requête : paramètre `devise` (query string ou JSON), sinon
+    celle du pays porté par le jeton JWT, sinon XAF. None si le paramètre
+    désigne une devise inconnue.
+    """
+    demandee = request.args.get('devise')
+    if demandee is None and request.is_json:
+        demandee = (request.get_json(silent=True) or {}).get('devise')
+    if demandee is not None:
+        demandee = str(demandee).upper()
+        return demandee if est_connue(demandee) else None
+    try:
+        verify_jwt_in_request(optional=True)
+        pays = get_jwt().get('pays')
+    except Exception:
+        pays = None
+    return devise_pays(pays) if pays else REFERENCE
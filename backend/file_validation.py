@@ -0,0 +1,107 @@
+"""
+File de validation des transactions en attente, partagée entre admins.
+
+Un admin réserve les N prochaines transactions libres (`reserver`) pour une
+durée de bail (`FILE_VALIDATION_BAIL_SECONDES`). La réservation est une
+seule instruction UPDATE ... WHERE id IN (sous-requête) RETURNING :
+- PostgreSQL : la sous-requête prend ses lignes avec FOR UPDATE SKIP LOCKED,
+  deux admins simultanés reçoivent des transactions différentes sans
+  s'attendre ;
+- SQLite : les écritures sont sérialisées, l'UPDATE revérifie la
+  disponibilité dans son WHERE, ce qui donne le même résultat.
+Un bail expiré rend la transaction à nouveau disponible.
+"""
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import joinedload
+
+from models import db, Transaction
+import pubsub
+
+CANAL_ADMINS = pubsub.CANAL_FILE_ADMINS
+
+
+def _disponible(maintenant):
+    return (Transaction.statut == 'en_attente') & or_(
+        Transaction.reserve_jusqua.is_(None),
+        Transaction.reserve_jusqua < maintenant,
+    )
+
+
+def duree_bail():
+    return timedelta(seconds=current_app.config.get('FILE_VALIDATION_BAIL_SECONDES', 300))
+
+
+def reserver(admin_id, nombre):
+    """Réserve jusqu'à `nombre` transactions en attente (les plus anciennes). Retourne les transactions et l'échéance."""
+    maintenant = datetime.utcnow()
+    echeance = maintenant + duree_bail()
+    candidates = (
+        select(Transaction.id)
+        .where(_disponible(maintenant))
+        .order_by(Transaction.date_creation, Transaction.id)
+        .limit(nombre)
+        .with_for_update(skip_locked=True)
+    )
+    ids = db.session.execute(
+        update(Transaction)
+        .where(Transaction.id.in_(candidates), _disponible(maintenant))
+        # Réservation interne aux admins : date_mise_a_jour (sync client) inchangée
+        .values(reserve_par=admin_id, reserve_jusqua=echeance, date_mise_a_jour=Transaction.date_mise_a_jour)
+        .returning(Transaction.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+
+    transactions = []
+    if ids:
+        transactions = Transaction.query.options(joinedload(Transaction.utilisateur))\
+            .filter(Transaction.id.in_(ids)).order_by(Transaction.date_creation, Transaction.id)\
+            .populate_existing().all()
+        pubsub.publier_apres_commit(CANAL_ADMINS, 'reservation', {
+            'admin_id': admin_id,
+            'transactions': [t.identifiant_transaction for t in transactions],
+            'reserve_jusqua': echeance.isoformat(),
+        })
+    return transactions, echeance
+
+
+def prolonger(admin_id, identifiants):
+    """Repousse l'échéance des baux encore détenus par l'admin. Retourne (nombre, échéance)."""
+    echeance = datetime.utcnow() + duree_bail()
+    count = Transaction.query.filter(
+        Transaction.identifiant_transaction.in_(identifiants),
+        Transaction.reserve_par == admin_id,
+        Transaction.statut == 'en_attente',
+    ).update({
+        Transaction.reserve_jusqua: echeance,
+        Transaction.date_mise_a_jour: Transaction.date_mise_a_jour,
+    }, synchronize_session=False)
+    return count, echeance
+
+
+def liberer(admin_id, identifiants):
+    """Rend à la file les transactions réservées par l'admin."""
+    count = Transaction.query.filter(
+        Transaction.identifiant_transaction.in_(identifiants),
+        Transaction.reserve_par == admin_id,
+    ).update({
+        Transaction.reserve_par: None,
+        Transaction.reserve_jusqua: None,
+        Transaction.date_mise_a_jour: Transaction.date_mise_a_jour,
+    }, synchronize_session=False)
+    if count:
+        pubsub.publier_apres_commit(CANAL_ADMINS, 'liberation', {'transactions': list(identifiants)})
+    return count
+
+
+def reservee_par_autre(transaction, admin_id):
+    """Vrai si un autre admin détient un bail en cours sur la transaction."""
+    return (
+        transaction.reserve_par is not None
+        and transaction.reserve_par != admin_id
+        and transaction.reserve_jusqua is not None
+        and transaction.reserve_jusqua > datetime.utcnow()
+    )
@@ -3,6 +3,21 @@ from wtforms import StringField, PasswordField, SelectField, FloatField, TextAre
 from wtforms.validators import DataRequired, Email, Length, EqualTo, ValidationError, NumberRange, Optional
 import re
 
+import operateurs as operateurs_service
+
+
+def choix_reseaux():
+    """Réseaux crypto du registre : [(code, libellé)]"""
+    registre = operateurs_service.registre()
+    return [(code, reseau.get('nom', code)) for code, reseau in registre.reseaux.items()]
+
+
+def choix_operateurs():
+    """Opérateurs mobile money du registre, tous pays : [(code, libellé)]"""
+    registre = operateurs_service.registre()
+    return [(code, operateur.get('nom', code)) for code, operateur in registre.operateurs.items()]
+
+
 class FormulaireInscription(FlaskForm):
     nom = StringField('Nom complet', validators=[
         DataRequired(message='Le nom est requis'),
@@ -58,48 +73,36 @@ class FormulaireAchat(FlaskForm):
         DataRequired(message='L\'adresse du wallet est requise'),
         Length(min=20, max=200)
     ])
-    reseau = SelectField('Réseau', choices=[
-        ('TRC20', 'TRC20 (Tron)'),
-        ('USDT_TON', 'USDT_TON (Toncoin)'),
-        ('USDT_APTOS', 'USDT_APTOS (Aptos)'),
-        ('ETHEREUM', 'Ethereum'),
-        ('SOL', 'Solana')
-    ], validators=[DataRequired()])
-    operateur_mobile = SelectField('Opérateur mobile', choices=[
-        ('MTN', 'MTN'),
-        ('ORANGE', 'Orange'),
-        ('MOOV', 'Moov'),
-        ('TOGOCEL', 'Togocel')
-    ], validators=[DataRequired()])
+    reseau = SelectField('Réseau', choices=[], validators=[DataRequired()])
+    operateur_mobile = SelectField('Opérateur mobile', choices=[], validators=[DataRequired()])
     soumettre = SubmitField('Confirmer l\'achat')
 
+    def __init__(self, *args, **kwargs):
+        super(FormulaireAchat, self).__init__(*args, **kwargs)
+        self.reseau.choices = choix_reseaux()
+        self.operateur_mobile.choices = choix_operateurs()
+
 class FormulaireVente(FlaskForm):
     montant_usdt = FloatField('Montant en USDT', validators=[
         DataRequired(message='Le montant est requis'),
         NumberRange(min=1, max=1000, message='Montant entre 1 et 1000 USDT')
     ])
-    reseau = SelectField('Réseau d\'envoi', choices=[
-        ('TRC20', 'TRC20 (Tron)'),
-        ('USDT_TON', 'USDT_TON (Toncoin)'),
-        ('USDT_APTOS', 'USDT_APTOS (Aptos)'),
-        ('ETHEREUM', 'Ethereum'),
-        ('SOL', 'Solana')
-    ], validators=[DataRequired()])
+    reseau = SelectField('Réseau d\'envoi', choices=[], validators=[DataRequired()])
     adresse_wallet = StringField('Votre adresse wallet (pour vérification)', validators=[
         Length(max=200)
     ])
-    operateur_mobile = SelectField('Opérateur de réception', choices=[
-        ('MTN', 'MTN'),
-        ('ORANGE', 'Orange'),
-        ('MOOV', 'Moov'),
-        ('TOGOCEL', 'Togocel')
-    ], validators=[DataRequired()])
+    operateur_mobile = SelectField('Opérateur de réception', choices=[], validators=[DataRequired()])
     numero_mobile = StringField('Numéro mobile pour recevoir les XAF', validators=[
         DataRequired(message='Le numéro mobile est requis'),
         Length(min=9, max=15)
     ])
     soumettre = SubmitField('Confirmer la vente')
 
+    def __init__(self, *args, **kwargs):
+        super(FormulaireVente, self).__init__(*args, **kwargs)
+        self.reseau.choices = choix_reseaux()
+        self.operateur_mobile.choices = choix_operateurs()
+
 class FormulaireCalculTaux(FlaskForm):
     type_calcul = SelectField('Type de calcul', choices=[
         ('vente', 'Calculer le taux de vente USDT'),
@@ -169,25 +172,14 @@ class FormulaireAjoutWallet(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super(FormulaireAjoutWallet, self).__init__(*args, **kwargs)
-        # Initialiser les choix pour le réseau
-        self.reseau.choices = [
-            ('', 'Sélectionner...'),
-            ('TRC20', 'TRC20 (Tron)'),
-            ('USDT_TON', 'USDT_TON (Toncoin)'),
-            ('USDT_APTOS', 'USDT_APTOS (Aptos)'),
-            ('ETHEREUM', 'Ethereum'),
-            ('SOL', 'Solana'),
-            ('MTN', 'MTN Mobile Money'),
-            ('ORANGE', 'Orange Money'),
-            ('MOOV', 'Moov Money'),
-            ('TOGOCEL', 'Togocel Money')
-        ]
+        # Initialiser les choix pour le réseau (registre des opérateurs)
+        self.reseau.choices = [('', 'Sélectionner...')] + choix_reseaux() + choix_operateurs()
     
     def validate_reseau(self, field):
         if field.data:
             # Vérifier la cohérence entre type_portefeuille et réseau
-            reseaux_crypto = ['TRC20', 'USDT_TON', 'USDT_APTOS', 'ETHEREUM', 'SOL']
-            reseaux_mobile = ['MTN', 'ORANGE', 'MOOV', 'TOGOCEL']
+            reseaux_crypto = operateurs_service.reseaux()
+            reseaux_mobile = operateurs_service.operateurs()
             
             type_portefeuille = self.type_portefeuille.data
             
@@ -0,0 +1,221 @@
+"""
+Historique des taux journaliers en mémoire, par colonnes NumPy.
+
+Le processus charge une fois les taux (`dates`, `achat`, `vente`, triés par
+date) puis applique les changements validés dans la session (ajout, mise à
+jour, suppression d'un TauxJournalier) sans relire la table. Comme l'index
+des versions (taux.py), l'historique est rechargé au plus tard après
+`TAUX_INDEX_TTL` secondes pour les écritures des autres processus.
+
+Les analyses sont vectorisées : fenêtre de dates par recherche
+dichotomique, moyennes mobiles et volatilité glissante, écart et marge,
+min / max / moyenne, et réduction du nombre de points pour les graphiques.
+"""
+
+import threading
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from flask import current_app
+from sqlalchemy import event, inspect, select
+
+from models import db, TauxJournalier
+
+_historique = None
+_charge_le = 0.0
+_verrou = threading.Lock()
+
+
+class HistoriqueTaux:
+    """
+    Colonnes triées par date : dates (datetime64[D]), achat et vente (float64).
+    Instantané immuable : les changements produisent un nouvel historique.
+    """
+
+    def __init__(self, dates, achat, vente, trie=False):
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        achat = np.asarray(achat, dtype=np.float64)
+        vente = np.asarray(vente, dtype=np.float64)
+        if not trie:
+            ordre = np.argsort(dates, kind='stable')
+            dates, achat, vente = dates[ordre], achat[ordre], vente[ordre]
+        self.dates, self.achat, self.vente = dates, achat, vente
+
+    def __len__(self):
+        return len(self.dates)
+
+    def appliquer(self, jour, achat=None, vente=None):
+        """
+        Nouvel historique où le taux de `jour` est ajouté ou mis à jour (ou
+        supprimé si `achat` est None). L'instance courante n'est pas
+        modifiée : les lecteurs en cours gardent trois colonnes cohérentes.
+        """
+        jour = np.datetime64(jour, 'D')
+        position = int(np.searchsorted(self.dates, jour))
+        existe = position < len(self.dates) and self.dates[position] == jour
+        if achat is None:
+            if not existe:
+                return self
+            colonnes = (np.delete(self.dates, position), np.delete(self.achat, position),
+                        np.delete(self.vente, position))
+        elif existe:
+            colonnes = (self.dates, self.achat.copy(), self.vente.copy())
+            colonnes[1][position] = achat
+            colonnes[2][position] = vente
+        else:
+            colonnes = (np.insert(self.dates, position, jour), np.insert(self.achat, position, achat),
+                        np.insert(self.vente, position, vente))
+        return HistoriqueTaux(*colonnes, trie=True)
+
+    def fenetre(self, debut=None, fin=None):
+        """Tranche [debut, fin] (dates incluses) : vues sur les colonnes, sans copie."""
+        gauche = 0 if debut is None else int(np.searchsorted(self.dates, np.datetime64(debut, 'D')))
+        droite = len(self.dates) if fin is None else int(np.searchsorted(self.dates, np.datetime64(fin, 'D'), 'right'))
+        return self.dates[gauche:droite], self.achat[gauche:droite], self.vente[gauche:droite]
+
+
+def ecart(achat, vente):
+    return vente - achat
+
+
+def marge(achat, vente):
+    """Marge en % du taux d'achat (0 si le taux d'achat est nul)."""
+    return np.divide((vente - achat) * 100, achat, out=np.zeros_like(achat), where=achat > 0)
+
+
+def moyenne_mobile(valeurs, n):
+    """Moyenne glissante sur `n` points (NaN tant que la fenêtre n'est pas pleine)."""
+    resultat = np.full(len(valeurs), np.nan)
+    if n < 1 or len(valeurs) < n:
+        return resultat
+    cumul = np.cumsum(np.insert(valeurs, 0, 0.0))
+    resultat[n - 1:] = (cumul[n:] - cumul[:-n]) / n
+    return resultat
+
+
+def volatilite(valeurs, n):
+    """Écart-type glissant des variations journalières relatives (en %) sur `n` points."""
+    resultat = np.full(len(valeurs), np.nan)
+    if n < 2 or len(valeurs) <= n:
+        return resultat
+    variations = np.diff(valeurs) / valeurs[:-1] * 100
+    resultat[n:] = sliding_window_view(variations, n).std(axis=1, ddof=1)
+    return resultat
+
+
+def statistiques(valeurs):
+    if not len(valeurs):
+        return {'min': None, 'max': None, 'moyenne': None}
+    return {'min': float(valeurs.min()), 'max': float(valeurs.max()), 'moyenne': float(valeurs.mean())}
+
+
+def reduire(dates, series, points):
+    """
+    Ramène les séries à au plus `points` valeurs (moyenne par paquet de
+    dates consécutives, date du premier point du paquet). NaN ignorés.
+    """
+    if points < 1 or len(dates) <= points:
+        return dates, series
+    debuts = np.linspace(0, len(dates), points, endpoint=False).astype(np.int64)
+    reduites = {}
+    for nom, valeurs in series.items():
+        valides = ~np.isnan(valeurs)
+        sommes = np.add.reduceat(np.where(valides, valeurs, 0.0), debuts)
+        comptes = np.add.reduceat(valides.astype(np.int64), debuts)
+        reduites[nom] = np.divide(sommes, comptes, out=np.full(len(debuts), np.nan), where=comptes > 0)
+    return dates[debuts], reduites
+
+
+def analyser(debut, fenetre=7, points=200):
+    """
+    Séries et statistiques depuis `debut` (sérialisables en JSON, NaN -> None).
+    Les moyennes mobiles et la volatilité des premiers jours utilisent les
+    `fenetre` jours précédant `debut`.
+    """
+    donnees = historique()
+    dates, achat, vente = donnees.fenetre(np.datetime64(debut, 'D') - np.timedelta64(fenetre, 'D'))
+    series = {
+        'achat': achat,
+        'vente': vente,
+        'ecart': ecart(achat, vente),
+        'marge': marge(achat, vente),
+        'moyenne_mobile_achat': moyenne_mobile(achat, fenetre),
+        'moyenne_mobile_vente': moyenne_mobile(vente, fenetre),
+        'volatilite_achat': volatilite(achat, fenetre),
+        'volatilite_vente': volatilite(vente, fenetre),
+    }
+    premier = int(np.searchsorted(dates, np.datetime64(debut, 'D')))
+    dates = dates[premier:]
+    series = {nom: valeurs[premier:] for nom, valeurs in series.items()}
+    stats = {nom: statistiques(series[nom]) for nom in ('achat', 'vente', 'ecart', 'marge')}
+    dates, series = reduire(dates, series, points)
+    return {
+        'dates': dates.astype(str).tolist(),
+        'series': {
+            nom: np.where(np.isnan(valeurs), None, valeurs.round(4)).tolist()
+            for nom, valeurs in series.items()
+        },
+        'statistiques': stats,
+        'fenetre': fenetre,
+    }
+
+
+def charger():
+    lignes = db.session.execute(
+        select(TauxJournalier.date, TauxJournalier.taux_achat, TauxJournalier.taux_vente)
+    ).all()
+    return HistoriqueTaux([l.date for l in lignes], [l.taux_achat for l in lignes], [l.taux_vente for l in lignes])
+
+
+def historique(forcer=False):
+    """Historique du processus, chargé au premier appel puis tenu à jour."""
+    global _historique, _charge_le
+    ttl = current_app.config.get('TAUX_INDEX_TTL', 30)
+    with _verrou:
+        if forcer or _historique is None or time.monotonic() - _charge_le > ttl:
+            _historique = charger()
+            _charge_le = time.monotonic()
+        return _historique
+
+
+@event.listens_for(db.session, 'after_flush')
+def _relever_taux(session, flush_context):
+    # Suppressions d'abord (lignes supprimées, anciennes dates des lignes déplacées),
+    # puis ajouts et mises à jour : une date libérée peut être reprise dans le même flush
+    suppressions, ecritures = [], []
+    for obj in session.deleted:
+        if isinstance(obj, TauxJournalier):
+            suppressions.append((obj.date, None, None))
+    for obj in session.dirty:
+        if isinstance(obj, TauxJournalier):
+            for ancienne in inspect(obj).attrs.date.history.deleted:
+                if ancienne is not None and ancienne != obj.date:
+                    suppressions.append((ancienne, None, None))
+    for obj in session.new | session.dirty:
+        if isinstance(obj, TauxJournalier):
+            ecritures.append((obj.date, obj.taux_achat, obj.taux_vente))
+    changements = suppressions + ecritures
+    if changements:
+        session.info.setdefault('taux_journaliers', []).extend(changements)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _appliquer(session):
+    global _historique
+    changements = session.info.pop('taux_journaliers', None)
+    if not changements:
+        return
+    with _verrou:
+        if _historique is None:
+            return
+        nouveau = _historique
+        for jour, achat, vente in changements:
+            nouveau = nouveau.appliquer(jour, achat, vente)
+        # Remplacement d'un bloc : un lecteur voit l'ancien ou le nouvel instantané, jamais un mélange
+        _historique = nouveau
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _oublier(session):
+    session.info.pop('taux_journaliers', None)
@@ -0,0 +1,130 @@
+"""
+Tâches de maintenance planifiables (cron, Render jobs).
+
+Usage :
+    python maintenance.py compteurs      # réconciliation des compteurs de non-lues
+    python maintenance.py outbox --continu   # relais des pushs en attente (worker, si OUTBOX_RELAIS=externe)
+    python maintenance.py tokens         # expiration / suppression des tokens push
+    python maintenance.py retention --fichier archive.jsonl.gz   # archivage des notifications
+    python maintenance.py taux --continu   # moteur de taux (taux mondial -> taux du jour)
+    python maintenance.py agregats       # reconstruction des statistiques des taux
+    python maintenance.py soldes         # recalcul des soldes USDT et montants réservés
+"""
+
+import argparse
+import time
+
+
+def tache_compteurs(args):
+    from notifications import reconcilier_compteurs
+
+    corriges = reconcilier_compteurs(taille_lot=args.lot)
+    print(f"[MAINTENANCE] Compteurs de notifications corrigés: {corriges}")
+
+
+def tache_outbox(args):
+    import outbox
+
+    if args.stats:
+        etat = outbox.statistiques()
+        print(f"[OUTBOX] {etat['par_statut']} retard={etat['retard']:.1f}s")
+        return
+    metriques = outbox.executer(continu=args.continu, intervalle=args.intervalle, taille_lot=args.lot)
+    print(f"[OUTBOX] total: {dict(metriques)}")
+
+
+def tache_tokens(args):
+    from tokens_push import nettoyer
+
+    bilan = nettoyer(taille_lot=args.lot, pause=args.pause)
+    print(f"[MAINTENANCE] Tokens push: {bilan['expires']} expirés, {bilan['plafonnes']} au-delà du plafond, "
+          f"{bilan['supprimes']} supprimés")
+
+
+def tache_retention(args):
+    from archivage import archiver
+
+    bilan = archiver(jours=args.jours, jours_flux=args.jours_flux, taille_lot=args.lot, pause=args.pause,
+                     chemin_fichier=args.fichier, maximum=args.max)
+    destination = args.fichier or 'notifications_archive'
+    print(f"[MAINTENANCE] Notifications archivées vers {destination}: "
+          f"{bilan['personnelles']} personnelles, {bilan['flux']} du flux admin")
+
+
+def tache_taux(args):
+    import moteur_taux
+
+    moteur_taux.executer(continu=args.continu, intervalle=args.intervalle, source=args.source)
+
+
+def tache_agregats(args):
+    from models import db
+    import agregats_taux
+
+    agregats_taux.recalculer()
+    db.session.commit()
+    print(f"[MAINTENANCE] Statistiques des taux: {agregats_taux.statistiques()['total']}")
+
+
+def tache_soldes(args):
+    from models import db
+    import soldes
+
+    corriges = soldes.reconcilier()
+    db.session.commit()
+    print(f"[MAINTENANCE] Soldes USDT créés ou corrigés: {corriges}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tâches de maintenance Devisa-FX")
+    sous_commandes = parser.add_subparsers(dest='tache', required=True)
+
+    compteurs = sous_commandes.add_parser('compteurs', help="Réconcilier les compteurs de notifications non lues")
+    compteurs.add_argument('--lot', type=int, default=1000, help="Utilisateurs par tranche")
+    compteurs.set_defaults(executer=tache_compteurs)
+
+    relais = sous_commandes.add_parser('outbox', help="Publier les pushs en attente de l'outbox")
+    relais.add_argument('--lot', type=int, default=100, help="Événements par lot")
+    relais.add_argument('--continu', action='store_true', help="Tourner en boucle (worker)")
+    relais.add_argument('--intervalle', type=float, default=1.0, help="Attente entre deux lots vides (s)")
+    relais.add_argument('--stats', action='store_true', help="Afficher l'état de l'outbox sans publier")
+    relais.set_defaults(executer=tache_outbox)
+
+    tokens = sous_commandes.add_parser('tokens', help="Expirer, plafonner et supprimer les tokens push")
+    tokens.add_argument('--lot', type=int, default=500, help="Tokens par tranche")
+    tokens.add_argument('--pause', type=float, default=0.0, help="Pause entre deux tranches (s)")
+    tokens.set_defaults(executer=tache_tokens)
+
+    retention = sous_commandes.add_parser('retention', help="Archiver les notifications expirées")
+    retention.add_argument('--jours', type=int, help="Âge des notifications lues à archiver (défaut : configuration)")
+    retention.add_argument('--jours-flux', type=int, help="Âge des événements du flux admin à archiver")
+    retention.add_argument('--fichier', help="Archiver dans ce fichier JSONL gzip plutôt qu'en table")
+    retention.add_argument('--lot', type=int, default=1000, help="Notifications par lot")
+    retention.add_argument('--pause', type=float, default=0.1, help="Pause entre deux lots (s)")
+    retention.add_argument('--max', type=int, help="Nombre maximum de lignes par catégorie et par exécution")
+    retention.set_defaults(executer=tache_retention)
+
+    taux = sous_commandes.add_parser('taux', help="Calculer et publier les taux à partir du taux mondial")
+    taux.add_argument('--source', help="Source du taux mondial (défaut : TAUX_MONDIAL_SOURCE)")
+    taux.add_argument('--continu', action='store_true', help="Tourner en boucle (worker)")
+    taux.add_argument('--intervalle', type=float, help="Attente entre deux lectures (s, défaut : configuration)")
+    taux.set_defaults(executer=tache_taux)
+
+    agregats = sous_commandes.add_parser('agregats', help="Reconstruire les statistiques des taux")
+    agregats.set_defaults(executer=tache_agregats)
+
+    recalcul_soldes = sous_commandes.add_parser('soldes', help="Recalculer les soldes USDT depuis les transactions")
+    recalcul_soldes.set_defaults(executer=tache_soldes)
+
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        debut = time.perf_counter()
+        args.executer(args)
+        print(f"[MAINTENANCE] {args.tache} terminé en {time.perf_counter() - debut:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
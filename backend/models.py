@@ -8,6 +8,8 @@ from flask_login import UserMixin
 from datetime import datetime
 import uuid
 
+from montants import Montant, ECHELLE_XAF, ECHELLE_USDT, ECHELLE_TAUX
+
 db = SQLAlchemy()
 
 
@@ -28,6 +30,11 @@ class Utilisateur(UserMixin, db.Model):
     date_inscription = db.Column(db.DateTime, default=datetime.utcnow)
     est_admin = db.Column(db.Boolean, default=False)
     est_actif = db.Column(db.Boolean, default=True)
+    # Compteur dénormalisé des notifications non lues (voir notifications.py)
+    notifications_non_lues = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    # Flux admin partagé : tous les événements d'id <= ce repère sont lus par cet admin
+    flux_admin_lu_jusqua = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    date_mise_a_jour = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relations
     transactions = db.relationship('Transaction', backref='utilisateur', lazy=True, foreign_keys='Transaction.utilisateur_id')
@@ -56,16 +63,23 @@ class Transaction(db.Model):
     Modèle pour les transactions d'achat et de vente de USDT
     """
     __tablename__ = 'transactions'
+    __table_args__ = (
+        db.Index('ix_transactions_utilisateur_maj', 'utilisateur_id', 'date_mise_a_jour'),
+        db.Index('ix_transactions_file_validation', 'statut', 'reserve_jusqua'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     identifiant_transaction = db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4()))
     utilisateur_id = db.Column(db.Integer, db.ForeignKey('utilisateurs.id'), nullable=False)
     
-    # Type et montants
+    # Type et montants (entiers en unités mineures, voir montants.py)
     type_transaction = db.Column(db.Enum('achat', 'vente', name='type_transaction_enum'), nullable=False)
-    montant_xaf = db.Column(db.Float, nullable=False)
-    montant_usdt = db.Column(db.Float, nullable=False)
-    taux_applique = db.Column(db.Float, nullable=False)
+    montant_xaf = db.Column(Montant(ECHELLE_XAF), nullable=False)
+    montant_usdt = db.Column(Montant(ECHELLE_USDT), nullable=False)
+    taux_applique = db.Column(Montant(ECHELLE_TAUX), nullable=False)
+    # Devise du client (XAF, XOF) et montant dans cette devise ; montant_xaf reste la référence
+    devise = db.Column(db.String(3), nullable=False, default='XAF', server_default='XAF')
+    montant_local = db.Column(Montant(ECHELLE_XAF))
     
     # Informations réseau et wallet
     reseau = db.Column(db.String(50), nullable=False)  # TRC20, ETHEREUM, SOL, USDT_TON, USDT_APTOS
@@ -83,6 +97,14 @@ class Transaction(db.Model):
     motif_rejet = db.Column(db.Text)
     date_creation = db.Column(db.DateTime, default=datetime.utcnow)
     date_validation = db.Column(db.DateTime)
+    date_mise_a_jour = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Réservation par un admin dans la file de validation (bail)
+    reserve_par = db.Column(db.Integer, db.ForeignKey('utilisateurs.id'))
+    reserve_jusqua = db.Column(db.DateTime)
+    
+    # Version du taux appliquée (NULL pour les transactions antérieures au versionnement)
+    version_taux_id = db.Column(db.Integer, db.ForeignKey('versions_taux.id'))
     
     # Preuves de paiement
     preuve_paiement = db.Column(db.String(200))  # Chemin vers l'image uploadée
@@ -105,6 +127,9 @@ class Transaction(db.Model):
             'montant_xaf': self.montant_xaf,
             'montant_usdt': self.montant_usdt,
             'taux_applique': self.taux_applique,
+            'devise': self.devise,
+            'montant_local': self.montant_local if self.montant_local is not None else self.montant_xaf,
+            'version_taux_id': self.version_taux_id,
             'reseau': self.reseau,
             'statut': self.statut,
             'date_creation': self.date_creation.isoformat() if self.date_creation else None,
@@ -130,41 +155,80 @@ class PortefeuilleAdmin(db.Model):
     )
     est_actif = db.Column(db.Boolean, default=True)
     date_ajout = db.Column(db.DateTime, default=datetime.utcnow)
+    poids = db.Column(db.Integer, nullable=False, default=1)  # part du trafic (tourniquet pondéré)
+    plafond_journalier = db.Column(db.Float)  # volume max par jour (XAF ou USDT), NULL = illimité
     
     def __repr__(self):
         return f'<PortefeuilleAdmin {self.type_portefeuille} - {self.reseau} - {self.adresse[:10]}...>'
     
     @classmethod
-    def get_numero_marchand(cls, operateur=None):
+    def get_numero_marchand(cls, operateur=None, pays=None, montant=None):
         """
-        Récupérer le numéro marchand mobile money actif
+        Récupérer un numéro marchand mobile money actif (registre en mémoire,
+        voir portefeuilles.py)
         Args:
             operateur: Nom de l'opérateur (optionnel)
+            pays: Pays du client (optionnel)
+            montant: Montant XAF imputé sur le plafond journalier (optionnel)
         Returns:
-            PortefeuilleAdmin object ou None
+            Entrée du registre (id, adresse, reseau, pays) ou None
         """
-        query = cls.query.filter_by(
-            type_portefeuille='mobile_money',
-            est_actif=True
-        )
-        if operateur:
-            query = query.filter_by(reseau=operateur)
-        return query.first()
+        from portefeuilles import choisir
+        return choisir('mobile_money', operateur, pays, montant)
     
     @classmethod
-    def get_adresse_crypto(cls, reseau):
+    def get_adresse_crypto(cls, reseau, pays=None, montant=None):
         """
-        Récupérer l'adresse crypto pour un réseau donné
+        Récupérer l'adresse crypto pour un réseau donné (registre en mémoire)
         Args:
             reseau: Nom du réseau (TRC20, ETHEREUM, etc.)
+            pays: Pays du client (optionnel)
+            montant: Montant USDT imputé sur le plafond journalier (optionnel)
         Returns:
-            PortefeuilleAdmin object ou None
+            Entrée du registre (id, adresse, reseau, pays) ou None
         """
-        return cls.query.filter_by(
-            reseau=reseau,
-            type_portefeuille='crypto',
-            est_actif=True
-        ).first()
+        from portefeuilles import choisir
+        return choisir('crypto', reseau, pays, montant)
+
+
+class VolumePortefeuille(db.Model):
+    """
+    Volume reçu par un portefeuille admin sur une journée, comparé à son
+    plafond_journalier lors du choix du portefeuille.
+    """
+    __tablename__ = 'volumes_portefeuilles'
+    __table_args__ = (
+        db.UniqueConstraint('portefeuille_id', 'jour', name='uq_volume_portefeuille_jour'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    portefeuille_id = db.Column(
+        db.Integer, db.ForeignKey('portefeuilles_admin.id', ondelete='CASCADE'), nullable=False
+    )
+    jour = db.Column(db.Date, nullable=False)
+    volume = db.Column(db.Float, nullable=False, default=0.0)
+    
+    def __repr__(self):
+        return f'<VolumePortefeuille {self.portefeuille_id} {self.jour}: {self.volume}>'
+
+
+class SoldeUtilisateur(db.Model):
+    """
+    Solde USDT d'un utilisateur (achats - ventes complétés) et montant réservé
+    par ses ventes en attente. `version` est incrémentée à chaque écriture :
+    les réservations sont des compare-and-swap sur cette version (soldes.py).
+    """
+    __tablename__ = 'soldes_utilisateurs'
+    
+    utilisateur_id = db.Column(
+        db.Integer, db.ForeignKey('utilisateurs.id', ondelete='CASCADE'), primary_key=True
+    )
+    solde = db.Column(Montant(ECHELLE_USDT), nullable=False, default=0)
+    reserve = db.Column(Montant(ECHELLE_USDT), nullable=False, default=0)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<SoldeUtilisateur {self.utilisateur_id}: {self.solde} (réservé {self.reserve}) v{self.version}>'
 
 
 class TauxJournalier(db.Model):
@@ -178,6 +242,7 @@ class TauxJournalier(db.Model):
     taux_vente = db.Column(db.Float, nullable=False)  # Taux pour vendre USDT (client vend)
     date = db.Column(db.Date, unique=True, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    date_mise_a_jour = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def __repr__(self):
         return f'<TauxJournalier {self.date} - Achat: {self.taux_achat}, Vente: {self.taux_vente}>'
@@ -188,19 +253,67 @@ class TauxJournalier(db.Model):
         return cls.query.order_by(cls.date.desc()).first()
 
 
+class VersionTaux(db.Model):
+    """
+    Historique des taux : une ligne par modification, jamais modifiée ni
+    supprimée. Le taux en vigueur à un instant T est la dernière version dont
+    `date_effet` <= T (voir taux.py).
+    """
+    __tablename__ = 'versions_taux'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    taux_achat = db.Column(db.Float, nullable=False)
+    taux_vente = db.Column(db.Float, nullable=False)
+    date = db.Column(db.Date, nullable=False)  # jour du TauxJournalier concerné
+    date_effet = db.Column(db.DateTime, nullable=False, index=True)
+    auteur_id = db.Column(db.Integer, db.ForeignKey('utilisateurs.id'))
+    date_creation = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<VersionTaux {self.id} {self.date_effet} - Achat: {self.taux_achat}, Vente: {self.taux_vente}>'
+
+
+class AgregatTaux(db.Model):
+    """
+    Statistiques des taux journaliers tenues à jour à chaque écriture
+    (voir agregats_taux.py) : une ligne par portée ('total', '7j', '30j').
+    """
+    __tablename__ = 'agregats_taux'
+    
+    portee = db.Column(db.String(10), primary_key=True)
+    nombre = db.Column(db.Integer, nullable=False, default=0)
+    somme_achat = db.Column(db.Float, nullable=False, default=0.0)
+    somme_vente = db.Column(db.Float, nullable=False, default=0.0)
+    min_achat = db.Column(db.Float)
+    max_achat = db.Column(db.Float)
+    min_vente = db.Column(db.Float)
+    max_vente = db.Column(db.Float)
+    date_reference = db.Column(db.Date)  # fenêtres glissantes : jour de fin (NULL = à recalculer)
+    date_mise_a_jour = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AgregatTaux {self.portee} n={self.nombre}>'
+
+
 class Notification(db.Model):
     """
     Modèle pour les notifications utilisateurs et admin
+    - Notification personnelle : utilisateur_id ou admin_id renseigné
+    - Flux admin (est_flux_admin) : une seule ligne par événement, visible par
+      tous les admins, lecture suivie par admin (LectureFluxAdmin)
     """
     __tablename__ = 'notifications'
+    __table_args__ = (db.Index('ix_notifications_utilisateur_maj', 'utilisateur_id', 'date_mise_a_jour'),)
     
     id = db.Column(db.Integer, primary_key=True)
-    utilisateur_id = db.Column(db.Integer, db.ForeignKey('utilisateurs.id'))
-    admin_id = db.Column(db.Integer, db.ForeignKey('utilisateurs.id'))
+    utilisateur_id = db.Column(db.Integer, db.ForeignKey('utilisateurs.id'), index=True)
+    admin_id = db.Column(db.Integer, db.ForeignKey('utilisateurs.id'), index=True)
     type_notification = db.Column(db.String(50), nullable=False)
     message = db.Column(db.Text, nullable=False)
     est_lue = db.Column(db.Boolean, default=False)
-    date_creation = db.Column(db.DateTime, default=datetime.utcnow)
+    est_flux_admin = db.Column(db.Boolean, default=False, nullable=False, server_default=db.false(), index=True)
+    date_creation = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    date_mise_a_jour = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     def __repr__(self):
         return f'<Notification {self.type_notification} - {"Lue" if self.est_lue else "Non lue"}>'
@@ -211,6 +324,44 @@ class Notification(db.Model):
         db.session.commit()
 
 
+class LectureFluxAdmin(db.Model):
+    """
+    Lecture d'un événement du flux admin par un admin (au-delà de son repère
+    Utilisateur.flux_admin_lu_jusqua).
+    """
+    __tablename__ = 'lectures_flux_admin'
+    __table_args__ = (db.UniqueConstraint('notification_id', 'admin_id', name='uq_lecture_flux_admin'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    notification_id = db.Column(db.Integer, db.ForeignKey('notifications.id', ondelete='CASCADE'), nullable=False)
+    admin_id = db.Column(db.Integer, db.ForeignKey('utilisateurs.id'), nullable=False, index=True)
+    date_lecture = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<LectureFluxAdmin notification={self.notification_id} admin={self.admin_id}>'
+
+
+class NotificationArchive(db.Model):
+    """
+    Notification archivée par la politique de rétention (voir archivage.py).
+    Même identifiant que la ligne d'origine, sans clés étrangères.
+    """
+    __tablename__ = 'notifications_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    utilisateur_id = db.Column(db.Integer, index=True)
+    admin_id = db.Column(db.Integer)
+    type_notification = db.Column(db.String(50), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    est_lue = db.Column(db.Boolean)
+    est_flux_admin = db.Column(db.Boolean)
+    date_creation = db.Column(db.DateTime)
+    date_archivage = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<NotificationArchive {self.id} - {self.type_notification}>'
+
+
 class PushToken(db.Model):
     """
     Token FCM d'un appareil utilisateur/admin pour push hors application.
@@ -223,12 +374,39 @@ class PushToken(db.Model):
     platform = db.Column(db.String(20), default='unknown')  # android, ios, web
     est_actif = db.Column(db.Boolean, default=True)
     date_creation = db.Column(db.DateTime, default=datetime.utcnow)
-    date_mise_a_jour = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    date_mise_a_jour = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     def __repr__(self):
         return f'<PushToken user={self.utilisateur_id} platform={self.platform}>'
 
 
+class EvenementSortant(db.Model):
+    """
+    Événement à publier (outbox), écrit dans le même commit que le changement
+    métier puis relayé vers le push par outbox.relayer().
+    """
+    __tablename__ = 'evenements_sortants'
+    __table_args__ = (db.Index('ix_evenements_sortants_a_publier', 'statut', 'prochaine_tentative'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    cle_dedup = db.Column(db.String(120), nullable=False, index=True)
+    type_evenement = db.Column(db.String(30), nullable=False, default='push')
+    cible = db.Column(db.String(20), nullable=False)  # utilisateurs, admins, actifs
+    destinataires = db.Column(db.Text)  # JSON : ids utilisateurs (cible 'utilisateurs')
+    titre = db.Column(db.String(200), nullable=False)
+    corps = db.Column(db.Text, nullable=False)
+    donnees = db.Column(db.Text)  # JSON
+    statut = db.Column(db.String(20), nullable=False, default='en_attente')  # en_attente, en_cours, publie, doublon, echec
+    tentatives = db.Column(db.Integer, nullable=False, default=0)
+    derniere_erreur = db.Column(db.Text)
+    date_creation = db.Column(db.DateTime, default=datetime.utcnow)
+    prochaine_tentative = db.Column(db.DateTime, default=datetime.utcnow)  # fin du bail si en_cours
+    date_publication = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<EvenementSortant {self.cle_dedup} - {self.statut}>'
+
+
 class ParametreSysteme(db.Model):
     """
     Modèle pour stocker les paramètres système de l'application
@@ -247,39 +425,28 @@ class ParametreSysteme(db.Model):
     
     @classmethod
     def get_valeur(cls, cle, defaut=None):
-        """Récupérer la valeur d'un paramètre"""
-        param = cls.query.filter_by(cle=cle).first()
-        if not param:
-            return defaut
-        
-        # Convertir selon le type
-        if param.type_valeur == 'int':
-            return int(param.valeur)
-        elif param.type_valeur == 'float':
-            return float(param.valeur)
-        elif param.type_valeur == 'bool':
-            return param.valeur.lower() in ('true', '1', 'yes', 'oui')
-        elif param.type_valeur == 'json':
-            import json
-            return json.loads(param.valeur)
-        return param.valeur
+        """Récupérer la valeur d'un paramètre (cache typé du processus, voir parametres.py)"""
+        import parametres
+        return parametres.lire(cle, defaut)
     
     @classmethod
     def set_valeur(cls, cle, valeur, type_valeur='string', description=None):
-        """Définir la valeur d'un paramètre"""
-        param = cls.query.filter_by(cle=cle).first()
-        if param:
-            param.valeur = str(valeur)
-            param.type_valeur = type_valeur
-            if description:
-                param.description = description
-            param.date_modification = datetime.utcnow()
-        else:
-            param = cls(
-                cle=cle,
-                valeur=str(valeur),
-                type_valeur=type_valeur,
-                description=description
-            )
-            db.session.add(param)
+        """Définir la valeur d'un paramètre et valider"""
+        import parametres
+        parametres.ecrire(cle, valeur, type_valeur, description)
         db.session.commit()
+
+
+class VersionCache(db.Model):
+    """
+    Compteur de version d'un cache de processus : incrémenté à chaque
+    modification des données cachées, relu périodiquement par les workers.
+    """
+    __tablename__ = 'versions_cache'
+    
+    nom = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    date_mise_a_jour = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<VersionCache {self.nom}: {self.version}>'
@@ -0,0 +1,113 @@
+"""
+Montants stockés en unités entières et agrégats exacts en base.
+
+Les colonnes monétaires des transactions sont des BIGINT en unités
+mineures : XAF / XOF à l'unité, USDT au micro-USDT (1e-6), taux appliqué
+au 1e-4 XAF. Le type `Montant` fait la conversion à la frontière : le code
+manipule toujours des nombres en unités « humaines » (montant_xaf=25000,
+montant_usdt=40.65) et la base ne voit que des entiers.
+
+Les sommes (solde USDT, chiffre d'affaires, volumes journaliers) sont
+calculées par la base sur ces entiers, donc sans dérive d'arrondi, et
+converties une seule fois à la lecture (le type de la colonne est
+propagé à SUM / CASE / COALESCE).
+"""
+
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import BigInteger, case, func, select
+from sqlalchemy.types import TypeDecorator
+
+ECHELLE_XAF = 1
+ECHELLE_USDT = 1_000_000
+ECHELLE_TAUX = 10_000
+
+
+def vers_unites(valeur, echelle):
+    """Valeur décimale -> entier en unités mineures (arrondi commercial)."""
+    return int((Decimal(str(valeur)) * echelle).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def depuis_unites(unites, echelle):
+    """Entier en unités mineures -> valeur (int pour les devises sans décimales)."""
+    unites = int(unites)  # SUM(BIGINT) est un NUMERIC sous PostgreSQL
+    if echelle == 1:
+        return unites
+    return unites / echelle
+
+
+def arrondir(valeur, echelle=ECHELLE_XAF):
+    """Valeur telle qu'elle sera relue après stockage (XAF à l'unité par défaut)."""
+    return depuis_unites(vers_unites(valeur, echelle), echelle)
+
+
+class Montant(TypeDecorator):
+    """BIGINT en unités mineures, exposé en unités de la devise."""
+    impl = BigInteger
+    cache_ok = True
+
+    def __init__(self, echelle=ECHELLE_XAF, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.echelle = echelle
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return vers_unites(value, self.echelle)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return depuis_unites(value, self.echelle)
+
+
+def _transactions():
+    from models import Transaction
+    return Transaction
+
+
+def solde_usdt(session, utilisateur_id):
+    """Solde USDT d'un utilisateur : achats complétés - ventes complétées."""
+    Transaction = _transactions()
+    return session.execute(
+        select(func.coalesce(func.sum(case(
+            (Transaction.type_transaction == 'achat', Transaction.montant_usdt),
+            else_=-Transaction.montant_usdt,
+        )), 0)).where(Transaction.utilisateur_id == utilisateur_id, Transaction.statut == 'complete')
+    ).scalar()
+
+
+def chiffre_affaires(session, jour=None):
+    """Somme des montant_xaf complétés (d'un jour donné si `jour`)."""
+    Transaction = _transactions()
+    requete = select(func.coalesce(func.sum(Transaction.montant_xaf), 0)).where(Transaction.statut == 'complete')
+    if jour is not None:
+        debut = datetime.combine(jour, time.min)
+        requete = requete.where(Transaction.date_creation >= debut,
+                                Transaction.date_creation < debut + timedelta(days=1))
+    return session.execute(requete).scalar()
+
+
+def volumes_journaliers(session, jours=30):
+    """
+    Volumes complétés par jour et par sens sur les `jours` derniers jours :
+    [{'date', 'type', 'nombre', 'montant_xaf', 'montant_usdt'}], du plus ancien au plus récent.
+    """
+    Transaction = _transactions()
+    debut = datetime.combine(date.today() - timedelta(days=jours - 1), time.min)
+    jour = func.date(Transaction.date_creation)
+    lignes = session.execute(
+        select(jour, Transaction.type_transaction, func.count(),
+               func.sum(Transaction.montant_xaf), func.sum(Transaction.montant_usdt))
+        .where(Transaction.statut == 'complete', Transaction.date_creation >= debut)
+        .group_by(jour, Transaction.type_transaction)
+        .order_by(jour, Transaction.type_transaction)
+    ).all()
+    return [{
+        'date': str(ligne[0]),
+        'type': ligne[1],
+        'nombre': ligne[2],
+        'montant_xaf': ligne[3],
+        'montant_usdt': ligne[4],
+    } for ligne in lignes]
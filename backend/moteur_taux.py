@@ -0,0 +1,128 @@
+"""
+Moteur de taux : calcul automatique des taux à partir du taux mondial.
+
+Le moteur (`python maintenance.py taux --continu`) interroge périodiquement
+une source du taux mondial USDT/XAF, en dérive les taux du jour avec la
+marge `PROFIT_MARGIN` (`utils.calculer_taux_journaliers`) et les publie via
+`taux.enregistrer_taux` : TauxJournalier du jour, nouvelle version datée et
+invalidation de l'index des versions. Les handlers ne font que lire ces
+valeurs précalculées.
+
+Sources (`TAUX_MONDIAL_SOURCE`) :
+- `fichier:/chemin/taux.json` : JSON `{"<champ>": 605.2}` ou nombre seul ;
+- `http://...` / `https://...` : réponse JSON, champ `TAUX_MONDIAL_CHAMP`.
+
+Garde-fous : une lecture qui s'écarte de plus de `TAUX_MOTEUR_ECART_MAX`
+(fraction) du dernier taux publié est ignorée, et une variation inférieure
+à `TAUX_MOTEUR_SEUIL` XAF ne crée pas de nouvelle version.
+"""
+
+import json
+import time
+from datetime import date
+
+import requests
+from flask import current_app
+
+from models import db, TauxJournalier
+from utils import calculer_taux_journaliers
+import notifications as notifications_service
+import taux as taux_service
+
+
+class SourceFichier:
+    """Taux mondial lu dans un fichier local (export manuel, tests)."""
+
+    def __init__(self, chemin, champ):
+        self.chemin = chemin
+        self.champ = champ
+
+    def lire(self):
+        with open(self.chemin, encoding='utf-8') as fichier:
+            contenu = json.load(fichier)
+        return float(contenu[self.champ] if isinstance(contenu, dict) else contenu)
+
+
+class SourceHTTP:
+    """Taux mondial lu dans la réponse JSON d'une API."""
+
+    def __init__(self, url, champ, delai=10):
+        self.url = url
+        self.champ = champ
+        self.delai = delai
+
+    def lire(self):
+        reponse = requests.get(self.url, timeout=self.delai)
+        reponse.raise_for_status()
+        return float(reponse.json()[self.champ])
+
+
+def source_configuree(source=None):
+    """Source décrite par `source` ou `TAUX_MONDIAL_SOURCE`."""
+    config = current_app.config
+    source = source or config.get('TAUX_MONDIAL_SOURCE')
+    champ = config.get('TAUX_MONDIAL_CHAMP', 'rate')
+    if not source:
+        raise ValueError("TAUX_MONDIAL_SOURCE non configurée")
+    if source.startswith('fichier:'):
+        return SourceFichier(source[len('fichier:'):], champ)
+    if source.startswith(('http://', 'https://')):
+        return SourceHTTP(source, champ)
+    raise ValueError(f"Source de taux inconnue: {source}")
+
+
+def deriver(taux_mondial):
+    """Taux d'achat et de vente du jour pour un taux mondial."""
+    benefice = taux_mondial * current_app.config.get('PROFIT_MARGIN', 0.02)
+    return calculer_taux_journaliers(taux_mondial, benefice)
+
+
+def actualiser(source):
+    """
+    Lit le taux mondial et publie les taux dérivés s'ils ont changé.
+    Retourne le bilan du passage (mondial, taux_achat, taux_vente, statut).
+    """
+    config = current_app.config
+    mondial = source.lire()
+    taux = deriver(mondial)
+    bilan = dict(taux, mondial=mondial)
+
+    actuel = TauxJournalier.query.filter_by(date=date.today()).first()
+    if actuel:
+        ecart = abs(taux['taux_vente'] - actuel.taux_vente) / actuel.taux_vente
+        if ecart > config.get('TAUX_MOTEUR_ECART_MAX', 0.1):
+            db.session.rollback()
+            return dict(bilan, statut='rejete')
+        seuil = config.get('TAUX_MOTEUR_SEUIL', 0.5)
+        if abs(taux['taux_vente'] - actuel.taux_vente) < seuil and abs(taux['taux_achat'] - actuel.taux_achat) < seuil:
+            db.session.rollback()
+            return dict(bilan, statut='inchange')
+
+    _, cree = taux_service.enregistrer_taux(taux['taux_achat'], taux['taux_vente'])
+    if cree:
+        # Premier taux de la journée : annoncé comme une saisie admin
+        notifications_service.diffuser_aux_actifs(
+            'rate_updated',
+            f"Nouveaux taux ({date.today().isoformat()}): "
+            f"Achat {taux['taux_achat']} XAF | Vente {taux['taux_vente']} XAF",
+        )
+    db.session.commit()
+    return dict(bilan, statut='cree' if cree else 'mis_a_jour')
+
+
+def executer(continu=False, intervalle=None, source=None):
+    """Boucle du moteur : un passage, puis en mode continu un passage toutes les `intervalle` s."""
+    source = source_configuree(source)
+    intervalle = intervalle or current_app.config.get('TAUX_MOTEUR_INTERVALLE', 60)
+    while True:
+        try:
+            bilan = actualiser(source)
+            print(f"[TAUX] mondial={bilan['mondial']} achat={bilan['taux_achat']} "
+                  f"vente={bilan['taux_vente']} statut={bilan['statut']}")
+        except Exception as exc:
+            db.session.rollback()
+            bilan = None
+            print(f"[TAUX] lecture du taux mondial impossible: {exc}")
+        if not continu:
+            return bilan
+        time.sleep(intervalle)
@@ -0,0 +1,341 @@
+"""
+Opérations ensemblistes sur les notifications et compteurs de non-lues.
+
+Les changements d'état en masse (tout marquer comme lu, lecture ou
+suppression par lot) s'exécutent en une seule instruction UPDATE/DELETE,
+sans charger les lignes dans la session. Chaque fonction retourne le nombre
+de lignes affectées ; le commit reste à la charge de l'appelant.
+
+Les événements destinés aux administrateurs forment un flux partagé : une
+seule ligne `Notification(est_flux_admin=True)` par événement, quel que soit
+le nombre d'admins. La lecture est suivie par admin avec un repère
+(`Utilisateur.flux_admin_lu_jusqua`, pour « tout marquer comme lu ») et des
+lignes `LectureFluxAdmin` pour les lectures individuelles au-delà du repère.
+
+`Utilisateur.notifications_non_lues` est maintenu dans la même transaction
+que chaque changement : les insertions, lectures et suppressions passant par
+l'ORM sont prises en compte par un écouteur `after_flush`, les opérations
+ensemblistes ajustent le compteur elles-mêmes. `reconcilier_compteurs`
+recalcule les compteurs depuis la table pour corriger une éventuelle dérive.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import bindparam, case, delete, event, exists, func, insert, inspect, literal, select, update
+
+from models import db, Notification, Utilisateur, LectureFluxAdmin
+
+_utilisateurs = Utilisateur.__table__
+_lectures = LectureFluxAdmin.__table__
+
+
+def filtre_destinataire(user_id, est_admin):
+    """Condition SQL des notifications visibles par un utilisateur (ou un admin)."""
+    if est_admin:
+        return (Notification.admin_id == user_id) | (Notification.utilisateur_id == user_id)
+    return Notification.utilisateur_id == user_id
+
+
+def _destinataires(notification):
+    return {uid for uid in (notification.utilisateur_id, notification.admin_id) if uid is not None}
+
+
+def ajuster_compteurs(connection, deltas):
+    """Applique {user_id: delta} aux compteurs en une seule instruction (executemany)."""
+    parametres = [{'uid': uid, 'delta': delta} for uid, delta in deltas.items() if delta]
+    if not parametres:
+        return
+    nouveau = _utilisateurs.c.notifications_non_lues + bindparam('delta')
+    connection.execute(
+        update(_utilisateurs)
+        .where(_utilisateurs.c.id == bindparam('uid'))
+        .values(notifications_non_lues=case((nouveau < 0, 0), else_=nouveau)),
+        parametres,
+    )
+
+
+def flux_non_lu(admin):
+    """Condition SQL des événements du flux admin non lus par `admin`."""
+    return (
+        Notification.est_flux_admin.is_(True)
+        & (Notification.id > admin.flux_admin_lu_jusqua)
+        & ~exists().where(
+            LectureFluxAdmin.notification_id == Notification.id,
+            LectureFluxAdmin.admin_id == admin.id,
+        )
+    )
+
+
+@event.listens_for(db.session, 'after_flush')
+def _suivre_non_lues(session, flush_context):
+    """Répercute sur les compteurs les notifications créées, lues ou supprimées via l'ORM."""
+    deltas = defaultdict(int)
+    nouveaux_flux = 0
+    for obj in session.new:
+        if isinstance(obj, Notification) and obj.est_flux_admin:
+            nouveaux_flux += 1
+        elif isinstance(obj, Notification) and not obj.est_lue:
+            for uid in _destinataires(obj):
+                deltas[uid] += 1
+    for obj in session.dirty:
+        if isinstance(obj, Notification):
+            historique = inspect(obj).attrs.est_lue.history
+            if historique.has_changes():
+                avant = bool(historique.deleted and historique.deleted[0])
+                if avant != bool(obj.est_lue):
+                    for uid in _destinataires(obj):
+                        deltas[uid] += -1 if obj.est_lue else 1
+    for obj in session.deleted:
+        if isinstance(obj, Notification) and not obj.est_lue:
+            for uid in _destinataires(obj):
+                deltas[uid] -= 1
+    if deltas:
+        ajuster_compteurs(session.connection(), deltas)
+    if nouveaux_flux:
+        # Un événement du flux est non lu pour tous les admins : une seule instruction
+        session.connection().execute(
+            update(_utilisateurs)
+            .where(_utilisateurs.c.est_admin.is_(True))
+            .values(notifications_non_lues=_utilisateurs.c.notifications_non_lues + nouveaux_flux)
+        )
+
+
+def publier_flux_admin(type_notification, message):
+    """Ajoute un événement au flux admin partagé (une ligne, quel que soit le nombre d'admins)."""
+    notification = Notification(
+        type_notification=type_notification,
+        message=message,
+        est_flux_admin=True,
+    )
+    db.session.add(notification)
+    return notification
+
+
+def notifications_admin(admin, limit, depuis=None):
+    """
+    Notifications personnelles et événements du flux d'un admin, du plus
+    récent au plus ancien. Retourne une liste de (notification, est_lue).
+    Avec `depuis`, seulement ce qui a changé depuis : notifications modifiées
+    et événements du flux créés ou lus par l'admin depuis cette date.
+    """
+    personnelles = Notification.query.filter(filtre_destinataire(admin.id, True))
+    flux = Notification.query.filter(Notification.est_flux_admin.is_(True))
+    if depuis is not None:
+        personnelles = personnelles.filter(Notification.date_mise_a_jour > depuis)
+        lues_depuis = select(LectureFluxAdmin.notification_id).where(
+            LectureFluxAdmin.admin_id == admin.id,
+            LectureFluxAdmin.date_lecture > depuis,
+        )
+        flux = flux.filter((Notification.date_mise_a_jour > depuis) | Notification.id.in_(lues_depuis))
+    personnelles = personnelles.order_by(Notification.date_creation.desc()).limit(limit).all()
+    flux = flux.order_by(Notification.id.desc()).limit(limit).all()
+
+    lues = set()
+    au_dela_du_repere = [n.id for n in flux if n.id > admin.flux_admin_lu_jusqua]
+    if au_dela_du_repere:
+        lues = {
+            row.notification_id for row in db.session.query(LectureFluxAdmin.notification_id).filter(
+                LectureFluxAdmin.admin_id == admin.id,
+                LectureFluxAdmin.notification_id.in_(au_dela_du_repere),
+            )
+        }
+
+    entrees = [(n, bool(n.est_lue)) for n in personnelles]
+    entrees += [(n, n.id <= admin.flux_admin_lu_jusqua or n.id in lues) for n in flux]
+    entrees.sort(key=lambda e: e[0].date_creation or datetime.min, reverse=True)
+    return entrees[:limit]
+
+
+def notifications_utilisateur(user, limit, depuis=None):
+    """(notification, est_lue) visibles par l'utilisateur, modifiées depuis `depuis` si fourni."""
+    if user.est_admin:
+        return notifications_admin(user, limit, depuis)
+    query = Notification.query.filter(Notification.utilisateur_id == user.id)
+    if depuis is not None:
+        query = query.filter(Notification.date_mise_a_jour > depuis)
+    notifications = query.order_by(Notification.date_creation.desc()).limit(limit).all()
+    return [(n, n.est_lue) for n in notifications]
+
+
+def non_lues_admin(admin):
+    """Notifications non lues d'un admin (personnelles et flux), des plus récentes aux plus anciennes."""
+    personnelles = Notification.query.filter_by(admin_id=admin.id, est_lue=False).all()
+    flux = Notification.query.filter(flux_non_lu(admin)).all()
+    return sorted(personnelles + flux, key=lambda n: n.date_creation or datetime.min, reverse=True)
+
+
+def marquer_flux_lu(admin, ids):
+    """Enregistre la lecture par `admin` des événements du flux `ids` (INSERT ... SELECT)."""
+    selection = select(
+        Notification.id, literal(admin.id), literal(datetime.utcnow())
+    ).where(Notification.id.in_(ids), flux_non_lu(admin))
+    count = db.session.execute(
+        insert(_lectures).from_select(['notification_id', 'admin_id', 'date_lecture'], selection)
+    ).rowcount
+    if count:
+        ajuster_compteurs(db.session.connection(), {admin.id: -count})
+    return count
+
+
+def _marquer_tout_le_flux_lu(admin):
+    """Avance le repère de l'admin au dernier événement du flux et purge ses lectures individuelles."""
+    count = Notification.query.filter(flux_non_lu(admin)).count()
+    dernier = select(func.max(Notification.id)).where(Notification.est_flux_admin.is_(True)).scalar_subquery()
+    db.session.execute(
+        update(_utilisateurs)
+        .where(_utilisateurs.c.id == admin.id)
+        .values(flux_admin_lu_jusqua=func.coalesce(dernier, _utilisateurs.c.flux_admin_lu_jusqua))
+    )
+    db.session.execute(delete(_lectures).where(_lectures.c.admin_id == admin.id))
+    return count
+
+
+def diffuser_aux_actifs(type_notification, message):
+    """
+    Crée une notification pour chaque utilisateur actif (insertion en lot)
+    et incrémente leurs compteurs. Retourne la liste des destinataires.
+    """
+    utilisateur_ids = [
+        row.id for row in db.session.query(Utilisateur.id).filter_by(est_actif=True)
+    ]
+    if utilisateur_ids:
+        db.session.execute(insert(Notification), [
+            {"utilisateur_id": uid, "type_notification": type_notification, "message": message}
+            for uid in utilisateur_ids
+        ])
+        db.session.execute(
+            update(_utilisateurs)
+            .where(_utilisateurs.c.est_actif.is_(True))
+            .values(notifications_non_lues=_utilisateurs.c.notifications_non_lues + 1)
+        )
+    return utilisateur_ids
+
+
+def marquer_lues(user, ids=None):
+    """
+    Marque comme lues les notifications non lues de l'utilisateur (toutes, ou
+    celles de `ids`), y compris les événements du flux pour un admin.
+    """
+    query = Notification.query.filter(
+        filtre_destinataire(user.id, user.est_admin),
+        Notification.est_lue.is_(False),
+    )
+    if ids is not None:
+        query = query.filter(Notification.id.in_(ids))
+    count = query.update({Notification.est_lue: True}, synchronize_session=False)
+
+    if ids is None:
+        if user.est_admin:
+            count += _marquer_tout_le_flux_lu(user)
+        # Plus rien de non lu : remise à zéro plutôt que décrément (corrige toute dérive)
+        db.session.execute(
+            update(_utilisateurs).where(_utilisateurs.c.id == user.id).values(notifications_non_lues=0)
+        )
+        return count
+
+    if count:
+        ajuster_compteurs(db.session.connection(), {user.id: -count})
+    if user.est_admin:
+        count += marquer_flux_lu(user, ids)
+    return count
+
+
+def supprimer(user, ids):
+    """
+    Supprime les notifications `ids` appartenant à l'utilisateur. Les
+    événements du flux admin étant partagés, ils sont seulement marqués lus.
+    """
+    lignes = db.session.execute(
+        delete(Notification)
+        .where(filtre_destinataire(user.id, user.est_admin), Notification.id.in_(ids))
+        .returning(Notification.est_lue)
+        .execution_options(synchronize_session=False)
+    ).all()
+    non_lues = sum(1 for (est_lue,) in lignes if not est_lue)
+    if non_lues:
+        ajuster_compteurs(db.session.connection(), {user.id: -non_lues})
+    count = len(lignes)
+    if user.est_admin:
+        count += marquer_flux_lu(user, ids)
+    return count
+
+
+def _non_lues_reelles():
+    """Sous-requête corrélée : nombre réel de non-lues de chaque ligne de `utilisateurs`."""
+    n = Notification.__table__
+    personnelles = (
+        select(func.count())
+        .where(
+            n.c.est_lue.is_(False),
+            n.c.est_flux_admin.is_(False),
+            (n.c.utilisateur_id == _utilisateurs.c.id)
+            | ((n.c.admin_id == _utilisateurs.c.id) & _utilisateurs.c.est_admin.is_(True)),
+        )
+        .scalar_subquery()
+    )
+    flux = (
+        select(func.count())
+        .where(
+            _utilisateurs.c.est_admin.is_(True),
+            n.c.est_flux_admin.is_(True),
+            n.c.id > _utilisateurs.c.flux_admin_lu_jusqua,
+            ~exists()
+            .where(_lectures.c.notification_id == n.c.id, _lectures.c.admin_id == _utilisateurs.c.id)
+            .correlate_except(_lectures),
+        )
+        .scalar_subquery()
+    )
+    return personnelles + flux
+
+
+def recalculer_compteur(user_id):
+    """Recalcule le compteur d'un utilisateur (ex. changement de rôle admin)."""
+    db.session.execute(
+        update(_utilisateurs)
+        .where(_utilisateurs.c.id == user_id)
+        .values(notifications_non_lues=_non_lues_reelles())
+    )
+
+
+def demarrer_flux_admin(user_id):
+    """Un nouvel admin ne reçoit que les événements du flux postérieurs à sa nomination."""
+    dernier = select(func.max(Notification.id)).where(Notification.est_flux_admin.is_(True)).scalar_subquery()
+    db.session.execute(
+        update(_utilisateurs)
+        .where(_utilisateurs.c.id == user_id)
+        .values(flux_admin_lu_jusqua=func.coalesce(dernier, 0))
+    )
+    db.session.execute(delete(_lectures).where(_lectures.c.admin_id == user_id))
+
+
+def reconcilier_compteurs(taille_lot=1000):
+    """
+    Recalcule les compteurs de non-lues par tranches d'utilisateurs (un commit
+    par tranche pour ne pas verrouiller la table). Retourne le nombre de
+    compteurs corrigés.
+    """
+    reel = _non_lues_reelles()
+    corriges = 0
+    dernier_id = 0
+    while True:
+        borne = db.session.execute(
+            select(_utilisateurs.c.id)
+            .where(_utilisateurs.c.id > dernier_id)
+            .order_by(_utilisateurs.c.id)
+            .offset(taille_lot - 1)
+            .limit(1)
+        ).scalar()
+        condition = _utilisateurs.c.id > dernier_id
+        if borne is not None:
+            condition = condition & (_utilisateurs.c.id <= borne)
+        resultat = db.session.execute(
+            update(_utilisateurs)
+            .where(condition, _utilisateurs.c.notifications_non_lues != reel)
+            .values(notifications_non_lues=reel)
+        )
+        db.session.commit()
+        corriges += resultat.rowcount
+        if borne is None:
+            return corriges
+        dernier_id = borne
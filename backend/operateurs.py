@@ -0,0 +1,186 @@
+"""
+Registre unique des pays, opérateurs mobile money et réseaux crypto.
+
+Source : `Config.OPERATEURS` / `Config.RESEAUX_CRYPTO`, ou le fichier JSON
+`OPERATEURS_FICHIER` ({"pays": {...}, "reseaux": {...}}) s'il est configuré.
+Le registre est construit une fois par processus avec toutes ses tables de
+recherche (opérateur par code, par pays, devise par pays, réseaux par
+préfixe / longueur / motif) : les lectures sont des accès de dictionnaire.
+Le fichier est surveillé : s'il a changé (date de modification, vérifiée au
+plus toutes les `OPERATEURS_VERIFICATION` secondes), le registre est
+reconstruit et remplacé d'un bloc.
+
+Gabarits USSD : `{numero}` (numéro marchand) et `{montant}` (montant dans la
+devise du client, voir devises.py).
+"""
+
+import json
+import os
+import threading
+import time
+
+from Config import Config
+
+
+class Registre:
+    """Instantané immuable du registre et de ses index."""
+
+    def __init__(self, pays, reseaux):
+        self.pays = pays
+        self.reseaux = reseaux
+        self.devises = {code: infos.get('devise', 'XAF') for code, infos in pays.items()}
+        self.operateurs_par_pays = {
+            code: dict(infos.get('operateurs', {})) for code, infos in pays.items()
+        }
+        self.operateurs = {}
+        for operateurs in self.operateurs_par_pays.values():
+            for code, operateur in operateurs.items():
+                # Un code présent dans plusieurs pays : la première définition sert de défaut
+                self.operateurs.setdefault(code, operateur)
+
+        self.prefixes = {}
+        self.longueurs = {}
+        self.motifs = []
+        self.reseau_defaut = None
+        for code, reseau in reseaux.items():
+            if reseau.get('prefixe'):
+                self.prefixes.setdefault(reseau['prefixe'], code)
+            if reseau.get('longueur'):
+                self.longueurs.setdefault(int(reseau['longueur']), code)
+            if reseau.get('contient'):
+                self.motifs.append((reseau['contient'].upper(), code))
+            if reseau.get('defaut') and self.reseau_defaut is None:
+                self.reseau_defaut = code
+        self.reseau_defaut = self.reseau_defaut or next(iter(reseaux), None)
+        self.tailles_prefixes = sorted({len(prefixe) for prefixe in self.prefixes})
+
+
+_registre = None
+_source = None  # (chemin, date de modification) du fichier chargé
+_verifie_le = float('-inf')
+_verrou = threading.Lock()
+
+
+def _lire_source():
+    chemin = Config.OPERATEURS_FICHIER
+    if not chemin:
+        return Registre(Config.OPERATEURS, Config.RESEAUX_CRYPTO), None
+    with open(chemin, encoding='utf-8') as fichier:
+        contenu = json.load(fichier)
+    source = (chemin, os.path.getmtime(chemin))
+    return Registre(contenu.get('pays', Config.OPERATEURS), contenu.get('reseaux', Config.RESEAUX_CRYPTO)), source
+
+
+def recharger():
+    """Reconstruit le registre depuis sa source et le remplace."""
+    global _registre, _source, _verifie_le
+    with _verrou:
+        try:
+            registre, source = _lire_source()
+        except (OSError, ValueError) as exc:
+            if _registre is None:
+                raise
+            # Fichier en cours d'écriture ou invalide : on garde le registre précédent
+            # jusqu'à sa prochaine modification
+            print(f"[OPERATEURS] Rechargement impossible: {exc}")
+            if _source is not None:
+                try:
+                    _source = (_source[0], os.path.getmtime(_source[0]))
+                except OSError:
+                    pass
+            _verifie_le = time.monotonic()
+            return _registre
+        _registre, _source = registre, source
+        _verifie_le = time.monotonic()
+        return _registre
+
+
+def registre():
+    """Registre courant (rechargé si le fichier source a changé)."""
+    global _verifie_le
+    if _registre is None:
+        return recharger()
+    if _source is not None and time.monotonic() - _verifie_le >= Config.OPERATEURS_VERIFICATION:
+        try:
+            modifie = os.path.getmtime(_source[0]) != _source[1]
+        except OSError:
+            modifie = False
+        if modifie:
+            return recharger()
+        _verifie_le = time.monotonic()
+    return _registre
+
+
+def operateur(code, pays=None):
+    """Description de l'opérateur `code` (dans `pays` si précisé), ou None."""
+    courant = registre()
+    if pays and code in courant.operateurs_par_pays.get(pays, {}):
+        return courant.operateurs_par_pays[pays][code]
+    return courant.operateurs.get(code)
+
+
+def operateurs(pays=None):
+    """Codes des opérateurs (d'un pays, ou de tous les pays)."""
+    courant = registre()
+    if pays:
+        return list(courant.operateurs_par_pays.get(pays, {}))
+    return list(courant.operateurs)
+
+
+def reseaux():
+    """Codes des réseaux crypto."""
+    return list(registre().reseaux)
+
+
+def devise(pays):
+    """Devise mobile money du pays (XAF par défaut)."""
+    return registre().devises.get(pays, 'XAF')
+
+
+def numero_marchand(pays, code):
+    """Numéro marchand par défaut de l'opérateur dans ce pays ('' s'il n'existe pas)."""
+    return registre().operateurs_par_pays.get(pays, {}).get(code, {}).get('numero_marchand', '')
+
+
+def code_ussd(code, numero, montant, pays=None):
+    """Code USSD de paiement pour l'opérateur `code` (None si l'opérateur n'a pas de gabarit)."""
+    infos = operateur(code, pays)
+    if not infos or not infos.get('ussd'):
+        return None
+    return infos['ussd'].format(numero=numero, montant=montant)
+
+
+def reseau_par_adresse(adresse):
+    """Réseau crypto déduit de la forme de l'adresse (réseau par défaut sinon)."""
+    courant = registre()
+    for taille in courant.tailles_prefixes:
+        reseau = courant.prefixes.get(adresse[:taille])
+        if reseau:
+            return reseau
+    reseau = courant.longueurs.get(len(adresse))
+    if reseau and adresse.isalnum():
+        return reseau
+    majuscules = adresse.upper()
+    for motif, reseau in courant.motifs:
+        if motif in majuscules:
+            return reseau
+    return courant.reseau_defaut
+
+
+def exporter():
+    """Registre sérialisable (pays, opérateurs sans numéro marchand, réseaux)."""
+    courant = registre()
+    return {
+        'pays': {
+            code: {
+                'nom': infos.get('nom', code),
+                'devise': courant.devises[code],
+                'operateurs': [
+                    {'code': code_operateur, 'nom': operateur.get('nom', code_operateur)}
+                    for code_operateur, operateur in courant.operateurs_par_pays[code].items()
+                ],
+            }
+            for code, infos in courant.pays.items()
+        },
+        'reseaux': [{'code': code, 'nom': reseau.get('nom', code)} for code, reseau in courant.reseaux.items()],
+    }
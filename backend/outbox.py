@@ -0,0 +1,379 @@
+"""
+Outbox transactionnelle des notifications push.
+
+Les handlers n'appellent plus FCM directement : `ajouter_push` écrit un
+`EvenementSortant` dans la session, publié par le même commit que le
+changement métier (transaction, notification). Un relais (`relayer`) lit
+les événements en attente par lots, résout les tokens en quelques requêtes
+et publie vers le push.
+
+Processus relais (`OUTBOX_RELAIS`) :
+- `integre` (défaut) : chaque worker web lance le relais dans un thread à
+  sa première requête (`demarrer_relais`, appelé par app.py) ;
+- `externe` : aucun thread dans les workers web ; le relais doit alors
+  tourner à part (`python maintenance.py outbox --continu`), sans quoi les
+  pushs restent en attente.
+Plusieurs relais peuvent tourner ensemble sur PostgreSQL (lots réservés
+avec FOR UPDATE SKIP LOCKED) ; sur SQLite, n'en faire tourner qu'un.
+
+Garanties :
+- au moins une fois : un lot est réservé (statut `en_cours`, bail de
+  `OUTBOX_BAIL` secondes dans `prochaine_tentative`) et commité avant
+  l'envoi, aucune transaction ne reste ouverte pendant l'appel FCM, et le
+  résultat est enregistré dans une seconde transaction courte. Un relais
+  arrêté pendant l'envoi laisse son lot `en_cours` : il est repris à
+  l'expiration du bail ;
+- déduplication : un événement dont la `cle_dedup` a déjà été publiée est
+  marqué `doublon` sans envoi, et la clé est transmise au client
+  (`data.event_id`) pour qu'il ignore un éventuel renvoi ;
+- reprise : en cas d'échec d'envoi, nouvel essai avec délai exponentiel,
+  puis statut `echec` après `MAX_TENTATIVES`.
+
+Anti-rafale : pour les types listés dans `PUSH_TYPES_REGROUPES`, un seul
+push par destinataire et par fenêtre de `PUSH_FENETRE_REGROUPEMENT`
+secondes. Les événements arrivés pendant la fenêtre sont différés à sa fin
+puis envoyés en un résumé (« 12 nouvelles transactions, 3.4M XAF »). L'état
+des derniers envois est gardé en mémoire du relais, borné à
+`TAILLE_MAX_REGROUPEMENT` clés (LRU).
+"""
+
+import json
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from models import db, EvenementSortant, PushToken, Utilisateur
+from push_service import send_push
+
+TAILLE_LOT = 100
+MAX_TENTATIVES = 5
+TOKENS_PAR_ENVOI = 500  # limite FCM d'un envoi multicast
+TAILLE_MAX_REGROUPEMENT = 10_000
+
+RESUMES = {
+    'admin_notification': "{n} nouvelles transactions",
+}
+
+# Compteurs cumulés depuis le démarrage du processus relais
+metriques = Counter()
+
+# (cible, destinataires, type) -> date du dernier envoi, ordre LRU
+_derniers_envois = OrderedDict()
+
+_relais = None  # thread du relais intégré au processus web
+_verrou_relais = threading.Lock()
+
+
+def ajouter_push(titre, corps, donnees=None, utilisateur_ids=None, admins=False, actifs=False, cle=None):
+    """
+    Ajoute un push à l'outbox (sans commit). Destinataires : `utilisateur_ids`,
+    tous les admins actifs (`admins=True`) ou tous les utilisateurs actifs
+    (`actifs=True`). `cle` identifie l'événement pour la déduplication.
+    """
+    if admins:
+        cible, destinataires = 'admins', None
+    elif actifs:
+        cible, destinataires = 'actifs', None
+    else:
+        ids = sorted(set(utilisateur_ids or []))
+        if not ids:
+            return None
+        cible, destinataires = 'utilisateurs', json.dumps(ids)
+
+    evenement = EvenementSortant(
+        cle_dedup=cle or uuid.uuid4().hex,
+        type_evenement='push',
+        cible=cible,
+        destinataires=destinataires,
+        titre=titre,
+        corps=corps,
+        donnees=json.dumps(donnees or {}),
+    )
+    db.session.add(evenement)
+    return evenement
+
+
+def _tokens_par_evenement(evenements):
+    """Résout les tokens actifs de chaque événement du lot (une requête par type de cible)."""
+    ids_utilisateurs = set()
+    for evenement in evenements:
+        if evenement.cible == 'utilisateurs':
+            ids_utilisateurs.update(json.loads(evenement.destinataires or '[]'))
+
+    par_utilisateur = defaultdict(list)
+    if ids_utilisateurs:
+        rows = db.session.query(PushToken.utilisateur_id, PushToken.token).filter(
+            PushToken.utilisateur_id.in_(ids_utilisateurs),
+            PushToken.est_actif.is_(True),
+        ).all()
+        for row in rows:
+            par_utilisateur[row.utilisateur_id].append(row.token)
+
+    par_cible = {}
+    for cible, filtre in (('admins', Utilisateur.est_admin.is_(True)), ('actifs', None)):
+        if not any(e.cible == cible for e in evenements):
+            continue
+        query = db.session.query(PushToken.token).join(
+            Utilisateur, PushToken.utilisateur_id == Utilisateur.id
+        ).filter(Utilisateur.est_actif.is_(True), PushToken.est_actif.is_(True))
+        if filtre is not None:
+            query = query.filter(filtre)
+        par_cible[cible] = [row.token for row in query]
+
+    resultat = {}
+    for evenement in evenements:
+        if evenement.cible == 'utilisateurs':
+            resultat[evenement.id] = [
+                token
+                for uid in json.loads(evenement.destinataires or '[]')
+                for token in par_utilisateur.get(uid, [])
+            ]
+        else:
+            resultat[evenement.id] = par_cible.get(evenement.cible, [])
+    return resultat
+
+
+def _montant_compact(montant):
+    if montant >= 1_000_000:
+        return f"{montant / 1_000_000:.1f}M"
+    if montant >= 1_000:
+        return f"{montant / 1_000:.0f}k"
+    return f"{montant:.0f}"
+
+
+def _noter_envoi(cle, date):
+    _derniers_envois[cle] = date
+    _derniers_envois.move_to_end(cle)
+    while len(_derniers_envois) > TAILLE_MAX_REGROUPEMENT:
+        _derniers_envois.popitem(last=False)
+
+
+def _resumer(evenements, donnees):
+    """Titre, corps et données du push unique remplaçant un groupe d'événements."""
+    dernier = evenements[-1]
+    if len(evenements) == 1:
+        return dernier.titre, dernier.corps, dict(donnees[0], event_id=dernier.cle_dedup)
+    type_push = donnees[0].get('type')
+    corps = RESUMES.get(type_push, "{n} nouvelles notifications").format(n=len(evenements))
+    total = sum(float(d.get('montant_xaf') or 0) for d in donnees)
+    if total:
+        corps += f", {_montant_compact(total)} XAF"
+    return dernier.titre, corps, {
+        'type': type_push,
+        'count': len(evenements),
+        'event_id': f"{dernier.cle_dedup}+{len(evenements) - 1}",
+    }
+
+
+def _grouper(evenements, maintenant, stats):
+    """
+    Regroupe les événements regroupables par (cible, destinataires, type) ;
+    diffère ceux dont la fenêtre est encore ouverte. Retourne la liste des
+    envois (clé de regroupement ou None, [événements couverts]) dans l'ordre
+    d'arrivée.
+    """
+    fenetre = timedelta(seconds=current_app.config.get('PUSH_FENETRE_REGROUPEMENT', 0))
+    types = set(current_app.config.get('PUSH_TYPES_REGROUPES', ()))
+
+    envois, groupes = [], {}
+    for evenement in evenements:
+        type_push = json.loads(evenement.donnees or '{}').get('type')
+        if not fenetre or type_push not in types:
+            envois.append((None, [evenement]))
+            continue
+        cle = (evenement.cible, evenement.destinataires, type_push)
+        dernier_envoi = _derniers_envois.get(cle)
+        if dernier_envoi and maintenant - dernier_envoi < fenetre:
+            evenement.prochaine_tentative = dernier_envoi + fenetre
+            stats['differes'] += 1
+            continue
+        if cle not in groupes:
+            groupes[cle] = []
+            envois.append((cle, groupes[cle]))
+        groupes[cle].append(evenement)
+    return envois
+
+
+def _envoyer(titre, corps, donnees, tokens):
+    """Envoie un push par paquets de TOKENS_PAR_ENVOI. Retourne (envoyés, à réessayer, tokens invalides)."""
+    envoyes, echecs, invalides = 0, 0, []
+    for debut in range(0, len(tokens), TOKENS_PAR_ENVOI):
+        result = send_push(tokens[debut:debut + TOKENS_PAR_ENVOI], titre, corps, data=donnees)
+        envoyes += result.get("sent", 0)
+        echecs += result.get("failed", 0)
+        invalides.extend(result.get("invalid_tokens", []))
+    # Échec complet hors tokens invalides (FCM indisponible) : on réessaiera
+    a_reessayer = envoyes == 0 and echecs > len(invalides)
+    return envoyes, a_reessayer, invalides
+
+
+def relayer(taille_lot=TAILLE_LOT, max_tentatives=MAX_TENTATIVES):
+    """
+    Publie un lot d'événements en attente, en trois temps : réservation du lot
+    et commit, envoi hors transaction, enregistrement des résultats. Retourne
+    les métriques du passage (lus, publies, doublons, differes, regroupes,
+    reessais, echecs, pushs, tokens_invalides, duree).
+    """
+    debut = time.perf_counter()
+    maintenant = datetime.utcnow()
+    stats = Counter()
+
+    # 1. Réservation : en attente, ou en cours dont le bail a expiré (relais arrêté pendant l'envoi)
+    evenements = EvenementSortant.query.filter(
+        EvenementSortant.statut.in_(('en_attente', 'en_cours')),
+        EvenementSortant.prochaine_tentative <= maintenant,
+    ).order_by(EvenementSortant.id).limit(taille_lot).with_for_update(skip_locked=True).all()
+    stats['lus'] = len(evenements)
+    if not evenements:
+        db.session.commit()
+        stats['duree'] = time.perf_counter() - debut
+        return stats
+
+    # Déduplication : clés déjà publiées, puis doublons à l'intérieur du lot
+    cles = {e.cle_dedup for e in evenements}
+    deja_publiees = {
+        row.cle_dedup for row in db.session.query(EvenementSortant.cle_dedup).filter(
+            EvenementSortant.cle_dedup.in_(cles),
+            EvenementSortant.statut == 'publie',
+        )
+    }
+    a_envoyer = []
+    for evenement in evenements:
+        if evenement.cle_dedup in deja_publiees:
+            evenement.statut = 'doublon'
+            stats['doublons'] += 1
+        else:
+            deja_publiees.add(evenement.cle_dedup)
+            a_envoyer.append(evenement)
+
+    envois = _grouper(a_envoyer, maintenant, stats)
+    tokens = _tokens_par_evenement([groupe[0] for _, groupe in envois])
+    bail = maintenant + timedelta(seconds=current_app.config.get('OUTBOX_BAIL', 300))
+    lots = []
+    for cle, groupe in envois:
+        titre, corps, donnees = _resumer(groupe, [json.loads(e.donnees or '{}') for e in groupe])
+        for evenement in groupe:
+            evenement.statut = 'en_cours'
+            evenement.prochaine_tentative = bail
+        lots.append((cle, [e.id for e in groupe], titre, corps, donnees, tokens[groupe[0].id]))
+    db.session.commit()
+
+    # 2. Envoi, sans transaction ouverte
+    resultats = []
+    tokens_invalides = set()
+    for cle, ids, titre, corps, donnees, destinataires in lots:
+        erreur = None
+        try:
+            envoyes, a_reessayer, invalides = _envoyer(titre, corps, donnees, destinataires)
+        except Exception as exc:
+            envoyes, a_reessayer, invalides = 0, True, []
+            erreur = str(exc)[:500]
+        tokens_invalides.update(invalides)
+        stats['pushs'] += envoyes
+        stats['regroupes'] += len(ids) - 1
+        # La fenêtre ne s'ouvre qu'après un envoi réussi : un échec ne diffère pas les suivants
+        if cle and not a_reessayer:
+            _noter_envoi(cle, maintenant)
+        resultats.append((ids, a_reessayer, erreur))
+
+    if not resultats:
+        stats['duree'] = time.perf_counter() - debut
+        metriques.update({k: v for k, v in stats.items() if k != 'duree'})
+        return stats
+
+    # 3. Résultats, dans une seconde transaction courte
+    fin = datetime.utcnow()
+    reserves = {
+        evenement.id: evenement for evenement in EvenementSortant.query.filter(
+            EvenementSortant.id.in_([identifiant for ids, _, _ in resultats for identifiant in ids]),
+            EvenementSortant.statut == 'en_cours',  # pas déjà terminé par un relais ayant repris le bail
+        )
+    }
+    for ids, a_reessayer, erreur in resultats:
+        for evenement in filter(None, (reserves.get(identifiant) for identifiant in ids)):
+            if a_reessayer:
+                evenement.tentatives += 1
+                evenement.derniere_erreur = erreur
+                if evenement.tentatives >= max_tentatives:
+                    evenement.statut = 'echec'
+                    stats['echecs'] += 1
+                else:
+                    evenement.statut = 'en_attente'
+                    evenement.prochaine_tentative = fin + timedelta(seconds=2 ** evenement.tentatives)
+                    stats['reessais'] += 1
+            else:
+                evenement.statut = 'publie'
+                evenement.date_publication = fin
+                stats['publies'] += 1
+
+    if tokens_invalides:
+        PushToken.query.filter(PushToken.token.in_(tokens_invalides)).update(
+            {"est_actif": False},
+            synchronize_session=False,
+        )
+        stats['tokens_invalides'] = len(tokens_invalides)
+    db.session.commit()
+
+    stats['duree'] = time.perf_counter() - debut
+    metriques.update({k: v for k, v in stats.items() if k != 'duree'})
+    return stats
+
+
+def statistiques():
+    """État de l'outbox : nombre d'événements par statut et retard du plus ancien en attente (s)."""
+    par_statut = dict(
+        db.session.query(EvenementSortant.statut, func.count()).group_by(EvenementSortant.statut).all()
+    )
+    plus_ancien = db.session.query(func.min(EvenementSortant.date_creation)).filter(
+        EvenementSortant.statut == 'en_attente'
+    ).scalar()
+    retard = (datetime.utcnow() - plus_ancien).total_seconds() if plus_ancien else 0.0
+    return {'par_statut': par_statut, 'retard': retard}
+
+
+def executer(continu=False, intervalle=1.0, taille_lot=TAILLE_LOT):
+    """Boucle du relais : vide l'outbox puis, en mode continu, attend `intervalle` s entre deux lots vides."""
+    while True:
+        try:
+            stats = relayer(taille_lot=taille_lot)
+        except Exception as exc:
+            # Base indisponible, etc. : le lot réservé sera repris à l'expiration de son bail
+            db.session.rollback()
+            print(f"[OUTBOX] passage du relais impossible: {exc}")
+            if not continu:
+                return metriques
+            time.sleep(intervalle)
+            continue
+        if stats['lus']:
+            debit = stats['lus'] / stats['duree'] if stats['duree'] else 0.0
+            print(f"[OUTBOX] lus={stats['lus']} publies={stats['publies']} doublons={stats['doublons']} "
+                  f"differes={stats['differes']} regroupes={stats['regroupes']} reessais={stats['reessais']} echecs={stats['echecs']} pushs={stats['pushs']} "
+                  f"tokens_invalides={stats['tokens_invalides']} debit={debit:.0f} evt/s")
+            continue
+        if not continu:
+            return metriques
+        time.sleep(intervalle)
+
+
+def demarrer_relais(app):
+    """Lance le relais intégré (une fois par processus), dans un thread avec contexte d'application."""
+    global _relais
+    if _relais is not None:
+        return
+    with _verrou_relais:
+        if _relais is None:
+            intervalle = app.config.get('OUTBOX_INTERVALLE', 1.0)
+            _relais = threading.Thread(target=_relais_integre, args=(app, intervalle), name='outbox-relais',
+                                       daemon=True)
+            _relais.start()
+            print(f"[OUTBOX] relais intégré démarré (intervalle {intervalle}s)")
+
+
+def _relais_integre(app, intervalle):
+    with app.app_context():
+        executer(continu=True, intervalle=intervalle)
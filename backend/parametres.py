@@ -0,0 +1,87 @@
+"""
+Cache typé des paramètres système (ParametreSysteme).
+
+Tous les paramètres sont chargés une fois par processus et convertis selon
+leur `type_valeur` ; `lire` est ensuite une lecture de dictionnaire.
+
+Propagation entre workers : chaque écriture (`ecrire`) incrémente la ligne
+`parametres_systeme` de `versions_cache` dans la même transaction. Un
+worker relit ce numéro au plus une fois toutes les `PARAMETRES_VERIFICATION`
+secondes et recharge les paramètres s'il a changé. Dans le processus qui
+écrit, le cache est invalidé dès le commit.
+
+Les valeurs `json` sont partagées entre les appels : ne pas les modifier.
+"""
+
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+
+from models import db, ParametreSysteme
+from cache_versionne import CacheVersionne
+
+NOM_CACHE = 'parametres_systeme'
+
+_parametres = ParametreSysteme.__table__
+
+
+def convertir(valeur, type_valeur):
+    """Valeur stockée (texte) convertie selon son type."""
+    if type_valeur == 'int':
+        return int(valeur)
+    elif type_valeur == 'float':
+        return float(valeur)
+    elif type_valeur == 'bool':
+        return valeur.lower() in ('true', '1', 'yes', 'oui')
+    elif type_valeur == 'json':
+        return json.loads(valeur)
+    return valeur
+
+
+def _charger():
+    lignes = db.session.execute(
+        select(_parametres.c.cle, _parametres.c.valeur, _parametres.c.type_valeur)
+    ).all()
+    return {ligne.cle: convertir(ligne.valeur, ligne.type_valeur) for ligne in lignes}
+
+
+_cache = CacheVersionne(NOM_CACHE, _charger, 'PARAMETRES_VERIFICATION')
+
+
+def lire(cle, defaut=None):
+    """Valeur typée du paramètre `cle` (`defaut` s'il n'existe pas)."""
+    return _cache.valeur().get(cle, defaut)
+
+
+def tous():
+    """Copie de tous les paramètres typés."""
+    return dict(_cache.valeur())
+
+
+def invalider():
+    """Force la relecture du numéro de version au prochain accès."""
+    _cache.invalider()
+
+
+def ecrire(cle, valeur, type_valeur='string', description=None):
+    """Crée ou modifie un paramètre (sans commit) et incrémente la version du cache."""
+    if type_valeur == 'json' and not isinstance(valeur, str):
+        valeur = json.dumps(valeur)
+    param = ParametreSysteme.query.filter_by(cle=cle).first()
+    if param:
+        param.valeur = str(valeur)
+        param.type_valeur = type_valeur
+        if description:
+            param.description = description
+        param.date_modification = datetime.utcnow()
+    else:
+        param = ParametreSysteme(
+            cle=cle,
+            valeur=str(valeur),
+            type_valeur=type_valeur,
+            description=description
+        )
+        db.session.add(param)
+    _cache.modifier()
+    return param
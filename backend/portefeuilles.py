@@ -0,0 +1,176 @@
+"""
+Registre en mémoire des portefeuilles admin (numéros marchands et adresses crypto).
+
+Les portefeuilles actifs sont chargés une fois par processus et regroupés
+par (type, réseau) et (type, réseau, pays) : choisir le portefeuille d'une
+commande ne fait plus de requête de lecture. Toute écriture ORM d'un
+PortefeuilleAdmin incrémente la version `portefeuilles` de
+`versions_cache` dans la même transaction ; les workers la relisent au plus
+une fois toutes les `PORTEFEUILLES_VERIFICATION` secondes (cache_versionne.py).
+
+Répartition : tourniquet pondéré lissé (`poids`) par groupe. Si le pays du
+client a des portefeuilles pour ce réseau, ils sont essayés d'abord ; tous
+les portefeuilles du réseau ensuite (pays sans portefeuille ou plafonds atteints).
+
+Plafonds : un portefeuille avec `plafond_journalier` ne reçoit une commande
+que si le volume du jour (UTC) plus le montant reste sous le plafond. La
+réservation est un seul upsert conditionnel sur `volumes_portefeuilles`,
+dans la transaction de la commande (annulée avec elle). Les commandes
+rejetées ensuite par un admin ne libèrent pas leur volume. Le dernier
+volume vu n'est retenu en mémoire qu'au commit de la transaction.
+"""
+
+import threading
+from datetime import datetime
+
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, PortefeuilleAdmin, VolumePortefeuille
+from cache_versionne import CacheVersionne
+
+NOM_CACHE = 'portefeuilles'
+
+_portefeuilles = PortefeuilleAdmin.__table__
+_volumes = VolumePortefeuille.__table__
+
+_verrou = threading.Lock()
+_courants = {}  # tourniquet : groupe -> {id: poids courant}
+_volumes_connus = {}  # id -> (jour, volume) : dernier volume commité vu, borne basse du volume réel
+
+
+class Entree:
+    """Portefeuille actif tel que gardé en mémoire."""
+    __slots__ = ('id', 'type_portefeuille', 'reseau', 'adresse', 'pays', 'poids', 'plafond_journalier')
+
+    def __init__(self, ligne):
+        for nom in self.__slots__:
+            setattr(self, nom, getattr(ligne, nom))
+        self.poids = max(self.poids or 1, 1)
+
+    def __repr__(self):
+        return f'<Entree {self.type_portefeuille} - {self.reseau} - {self.adresse[:10]}...>'
+
+
+def _charger():
+    lignes = db.session.execute(
+        select(_portefeuilles).where(_portefeuilles.c.est_actif.is_(True)).order_by(_portefeuilles.c.id)
+    ).all()
+    groupes = {}
+    for ligne in lignes:
+        entree = Entree(ligne)
+        for cle in ((entree.type_portefeuille, None, None),
+                    (entree.type_portefeuille, entree.reseau, None),
+                    (entree.type_portefeuille, entree.reseau, entree.pays)):
+            groupes.setdefault(cle, []).append(entree)
+    with _verrou:
+        _courants.clear()
+    return groupes
+
+
+_cache = CacheVersionne(NOM_CACHE, _charger, 'PORTEFEUILLES_VERIFICATION')
+
+
+def candidats(type_portefeuille, reseau=None, pays=None):
+    """Groupes de portefeuilles actifs à essayer dans l'ordre : ceux du pays, puis tout le réseau."""
+    groupes = _cache.valeur()
+    essais = []
+    if pays and reseau is not None:
+        cle = (type_portefeuille, reseau, pays)
+        if cle in groupes:
+            essais.append((cle, groupes[cle]))
+    cle = (type_portefeuille, reseau, None)
+    essais.append((cle, groupes.get(cle, [])))
+    return essais
+
+
+def _suivant(groupe, entrees):
+    """Tourniquet pondéré lissé : chaque entrée reçoit `poids / total` des tirages, sans rafale."""
+    with _verrou:
+        courants = _courants.setdefault(groupe, {})
+        total = 0
+        meilleur = None
+        for entree in entrees:
+            courants[entree.id] = courants.get(entree.id, 0) + entree.poids
+            total += entree.poids
+            if meilleur is None or courants[entree.id] > courants[meilleur.id]:
+                meilleur = entree
+        courants[meilleur.id] -= total
+        return meilleur
+
+
+def _sature(entree, montant, jour):
+    if entree.plafond_journalier is None or montant is None:
+        return False
+    if montant > entree.plafond_journalier:
+        return True
+    connu = _volumes_connus.get(entree.id)
+    return connu is not None and connu[0] == jour and connu[1] + montant > entree.plafond_journalier
+
+
+def _reserver(entree, montant, jour):
+    """Ajoute `montant` au volume du jour si le plafond le permet (upsert conditionnel)."""
+    connexion = db.session.connection()
+    dialecte = postgresql if connexion.dialect.name == 'postgresql' else sqlite
+    instruction = dialecte.insert(_volumes).values(portefeuille_id=entree.id, jour=jour, volume=montant)
+    instruction = instruction.on_conflict_do_update(
+        index_elements=[_volumes.c.portefeuille_id, _volumes.c.jour],
+        set_={'volume': _volumes.c.volume + instruction.excluded.volume},
+        where=_volumes.c.volume + instruction.excluded.volume <= entree.plafond_journalier,
+    ).returning(_volumes.c.volume)
+    volume = connexion.execute(instruction).scalar()
+    # Retenu au commit seulement : après un rollback, ce volume n'existe plus en base
+    vus = db.session.info.setdefault('volumes_portefeuilles', {})
+    if volume is None:
+        # Plafond atteint par d'autres commandes (éventuellement d'autres workers)
+        vus[entree.id] = (jour, entree.plafond_journalier - montant)
+        return False
+    vus[entree.id] = (jour, volume)
+    return True
+
+
+def choisir(type_portefeuille, reseau=None, pays=None, montant=None):
+    """
+    Portefeuille pour une commande de `montant` (XAF pour mobile_money, USDT
+    pour crypto), ou None si aucun n'est disponible. Avec un montant, le
+    volume est réservé dans la transaction en cours (à commiter par l'appelant).
+    """
+    jour = datetime.utcnow().date()
+    for groupe, entrees in candidats(type_portefeuille, reseau, pays):
+        restants = [entree for entree in entrees if not _sature(entree, montant, jour)]
+        while restants:
+            entree = _suivant(groupe, restants)
+            if entree.plafond_journalier is None or montant is None or _reserver(entree, montant, jour):
+                return entree
+            restants.remove(entree)
+    return None
+
+
+def invalider():
+    """Force la relecture du numéro de version au prochain accès."""
+    _cache.invalider()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _suivre_portefeuilles(session, flush_context):
+    if any(isinstance(obj, PortefeuilleAdmin) for obj in session.new | session.dirty | session.deleted):
+        if _cache not in session.info.get('caches_modifies', ()):
+            _cache.modifier(session)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _retenir_volumes(session):
+    vus = session.info.pop('volumes_portefeuilles', None)
+    if not vus:
+        return
+    with _verrou:
+        for portefeuille_id, (jour, volume) in vus.items():
+            connu = _volumes_connus.get(portefeuille_id)
+            # Le volume du jour ne fait que croître : on garde le plus grand vu
+            if connu is None or connu[0] != jour or connu[1] < volume:
+                _volumes_connus[portefeuille_id] = (jour, volume)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _oublier_volumes(session):
+    session.info.pop('volumes_portefeuilles', None)
@@ -0,0 +1,247 @@
+"""
+Pub/sub léger pour les événements temps réel (flux SSE /api/events).
+
+Les changements sont capturés au niveau de la session SQLAlchemy : un
+écouteur `after_flush` relève les nouvelles notifications personnelles et
+les changements de statut des transactions, et ils ne sont publiés qu'au
+`after_commit` (abandonnés en cas de rollback). Les handlers n'ont rien à
+appeler.
+
+Deux backends (`PUBSUB_BACKEND`) :
+- `memoire` : abonnés du processus courant uniquement (un seul worker, dev,
+  tests) ;
+- `postgres` : publication par NOTIFY sur un canal unique, chaque worker
+  écoute (LISTEN) dans un thread et redistribue à ses abonnés locaux ; en
+  cas de coupure, le thread se reconnecte avec un délai croissant.
+
+Le canal `admins:file` reçoit les nouvelles transactions en attente, leurs
+changements de statut et les réservations de la file de validation
+(`file_validation`). Le canal `admins:flux` reçoit les événements du flux
+admin partagé ; le flux /api/events d'un admin y est abonné en plus de son
+canal personnel (notifications `utilisateur_id` ou `admin_id`).
+
+Chaque événement porte un id horodaté (même format que les jetons de
+/api/sync) : à la reconnexion, Last-Event-ID permet de rattraper les
+changements manqués depuis la base.
+"""
+
+import json
+import queue
+import select
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, func, inspect
+
+from models import db, Notification, Transaction
+
+CANAL_POSTGRES = 'devisa_evenements'
+TAILLE_FILE = 100
+DELAI_RECONNEXION = 1  # s, doublé à chaque échec jusqu'à DELAI_RECONNEXION_MAX
+DELAI_RECONNEXION_MAX = 60
+
+_backend = None
+_verrou_backend = threading.Lock()
+
+
+def canal_utilisateur(user_id):
+    return f"utilisateur:{user_id}"
+
+
+CANAL_FILE_ADMINS = 'admins:file'
+CANAL_FLUX_ADMINS = 'admins:flux'
+
+
+def formater_sse(identifiant, type_evenement, donnees):
+    return f"id: {identifiant}\nevent: {type_evenement}\ndata: {json.dumps(donnees, ensure_ascii=False)}\n\n"
+
+
+def resume_transaction(transaction):
+    """Données publiées pour un changement de statut (attributs déjà en mémoire, sans requête)."""
+    return {
+        'identifiant_transaction': transaction.identifiant_transaction,
+        'type_transaction': transaction.type_transaction,
+        'statut': transaction.statut,
+        'motif_rejet': transaction.motif_rejet,
+        'montant_xaf': transaction.montant_xaf,
+        'montant_usdt': transaction.montant_usdt,
+    }
+
+
+def resume_notification(notification):
+    return {
+        'id': notification.id,
+        'utilisateur_id': notification.utilisateur_id,
+        'admin_id': notification.admin_id,
+        'type_notification': notification.type_notification,
+        'message': notification.message,
+        'est_lue': bool(notification.est_lue),
+        'est_flux_admin': bool(notification.est_flux_admin),
+        'date_creation': notification.date_creation.isoformat() if notification.date_creation else None,
+    }
+
+
+class MemoirePubSub:
+    """Abonnés locaux au processus : une file bornée par connexion SSE."""
+
+    def __init__(self):
+        self._abonnes = defaultdict(set)
+        self._verrou = threading.Lock()
+
+    def abonner(self, canal, file=None):
+        """Abonne une file au canal (nouvelle file, ou `file` pour écouter plusieurs canaux)."""
+        if file is None:
+            file = queue.Queue(maxsize=TAILLE_FILE)
+        with self._verrou:
+            self._abonnes[canal].add(file)
+        return file
+
+    def desabonner(self, canal, file):
+        with self._verrou:
+            self._abonnes[canal].discard(file)
+            if not self._abonnes[canal]:
+                del self._abonnes[canal]
+
+    def publier(self, publications):
+        """Publie une liste de (canal, événement)."""
+        for canal, evenement in publications:
+            self._distribuer(canal, evenement)
+
+    def _distribuer(self, canal, evenement):
+        with self._verrou:
+            files = list(self._abonnes.get(canal, ()))
+        for file in files:
+            try:
+                file.put_nowait(evenement)
+            except queue.Full:
+                # Client trop lent : il rattrapera via Last-Event-ID à la reconnexion
+                pass
+
+
+class PostgresPubSub(MemoirePubSub):
+    """Diffusion entre workers par LISTEN/NOTIFY PostgreSQL."""
+
+    def __init__(self, engine):
+        super().__init__()
+        self._engine = engine
+        self._ecoute = None
+
+    def abonner(self, canal, file=None):
+        if self._ecoute is None:
+            self._ecoute = threading.Thread(target=self._ecouter, name='pubsub-listen', daemon=True)
+            self._ecoute.start()
+        return super().abonner(canal, file)
+
+    def publier(self, publications):
+        with self._engine.connect() as connection:
+            for canal, evenement in publications:
+                message = json.dumps({'canal': canal, 'evenement': evenement})
+                connection.execute(func.pg_notify(CANAL_POSTGRES, message).select())
+            connection.commit()
+
+    def _ecouter(self):
+        """Thread d'écoute : se reconnecte avec un délai croissant si la connexion est perdue."""
+        delai = DELAI_RECONNEXION
+        while True:
+            connexion = None
+            try:
+                connexion = self._connecter()
+                delai = DELAI_RECONNEXION
+                self._recevoir(connexion.dbapi_connection)
+            except Exception as exc:
+                # Les NOTIFY émis pendant la coupure sont perdus pour ce worker
+                print(f"[PUBSUB] écoute PostgreSQL interrompue: {exc} (reconnexion dans {delai}s)")
+            finally:
+                if connexion is not None:
+                    try:
+                        connexion.close()
+                    except Exception:
+                        pass
+            time.sleep(delai)
+            delai = min(delai * 2, DELAI_RECONNEXION_MAX)
+
+    def _connecter(self):
+        """Connexion dédiée (hors pool) en autocommit, abonnée au canal."""
+        connexion = self._engine.raw_connection()
+        connexion.detach()
+        dbapi = connexion.dbapi_connection
+        dbapi.autocommit = True
+        with dbapi.cursor() as curseur:
+            curseur.execute(f"LISTEN {CANAL_POSTGRES}")
+        return connexion
+
+    def _recevoir(self, dbapi):
+        while True:
+            if select.select([dbapi], [], [], 30) == ([], [], []):
+                # Rien depuis 30 s : une requête détecte une connexion coupée silencieusement
+                with dbapi.cursor() as curseur:
+                    curseur.execute("SELECT 1")
+                continue
+            dbapi.poll()
+            while dbapi.notifies:
+                message = json.loads(dbapi.notifies.pop(0).payload)
+                self._distribuer(message['canal'], message['evenement'])
+
+
+def publier_apres_commit(canal, type_evenement, donnees, session=None):
+    """Ajoute un événement à publier au prochain commit de la session (abandonné au rollback)."""
+    session = session or db.session()
+    session.info.setdefault('publications', []).append((canal, type_evenement, donnees))
+
+
+def backend():
+    """Backend configuré (créé au premier appel, dans un contexte d'application)."""
+    global _backend
+    with _verrou_backend:
+        if _backend is None:
+            if current_app.config.get('PUBSUB_BACKEND', 'memoire') == 'postgres':
+                _backend = PostgresPubSub(db.engine)
+            else:
+                _backend = MemoirePubSub()
+    return _backend
+
+
+@event.listens_for(db.session, 'after_flush')
+def _relever_changements(session, flush_context):
+    publications = []
+    for obj in session.new:
+        if isinstance(obj, Notification):
+            resume = resume_notification(obj)
+            # Mêmes destinataires que le rattrapage de /api/events (notifications.notifications_utilisateur)
+            for destinataire in {obj.utilisateur_id, obj.admin_id} - {None}:
+                publications.append((canal_utilisateur(destinataire), 'notification', resume))
+            if obj.est_flux_admin:
+                publications.append((CANAL_FLUX_ADMINS, 'notification', resume))
+        elif isinstance(obj, Transaction) and obj.statut == 'en_attente':
+            # File de validation des admins : nouvelle transaction à traiter
+            publications.append((CANAL_FILE_ADMINS, 'transaction', resume_transaction(obj)))
+    for obj in session.dirty:
+        if isinstance(obj, Transaction) and inspect(obj).attrs.statut.history.has_changes():
+            resume = resume_transaction(obj)
+            publications.append((canal_utilisateur(obj.utilisateur_id), 'transaction', resume))
+            publications.append((CANAL_FILE_ADMINS, 'transaction', resume))
+    if publications:
+        session.info.setdefault('publications', []).extend(publications)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publier(session):
+    publications = session.info.pop('publications', None)
+    if not publications:
+        return
+    identifiant = datetime.utcnow().isoformat()
+    try:
+        backend().publier([
+            (canal, {'id': identifiant, 'type': type_evenement, 'data': donnees})
+            for canal, type_evenement, donnees in publications
+        ])
+    except Exception as exc:
+        print(f"[PUBSUB] publication impossible: {exc}")
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _abandonner(session):
+    session.info.pop('publications', None)
@@ -0,0 +1,405 @@
+"""
+Budgets de requêtes SQL par endpoint.
+
+Chaque route de `api_bp`, `main_bp` et `admin_bp` déclare un nombre maximal
+d'instructions SQL par requête HTTP. Le vérificateur remplit la base à deux
+tailles (chaque taille dans un processus neuf), compte les instructions
+réellement émises et échoue si un budget est dépassé ou si une route
+déclarée « constante » émet plus de requêtes sur la grande base que sur la
+petite (preuve d'un coût O(1) en requêtes).
+
+Usage :
+    python query_budget.py                      # tailles 50 et 500
+    python query_budget.py --tailles 100 2000
+    python query_budget.py --filtre notifications
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from flask_jwt_extended import create_access_token
+from flask_login import LoginManager
+from jinja2 import ChoiceLoader, FunctionLoader
+from sqlalchemy import event
+
+from bench import creer_app_memoire
+from models import db, Utilisateur, Transaction, PortefeuilleAdmin, TauxJournalier, Notification, PushToken
+from notifications import reconcilier_compteurs
+import devis
+import taux as taux_service
+import historique_taux
+import portefeuilles
+import seed
+
+TAILLES = (50, 500)
+
+
+class Budget:
+    """Budget d'une route : méthode, chemin (gabarit), rôle, plafond de requêtes et statut HTTP attendu."""
+
+    def __init__(self, endpoint, methode, chemin, maximum, constant=True, role='client', json=None, form=None,
+                 statut=200):
+        self.endpoint = endpoint
+        self.methode = methode
+        self.chemin = chemin
+        self.maximum = maximum
+        self.constant = constant
+        self.role = role          # 'anonyme', 'client' ou 'admin'
+        self.json = json          # dict, ou callable(contexte) -> dict
+        self.form = form
+        self.statut = statut      # une réponse d'erreur ne compte pas comme budget respecté
+
+
+# Les routes qui modifient les données viennent après les lectures, et les
+# suppressions en dernier, pour que chaque mesure porte sur le même jeu de données.
+BUDGETS = [
+    # --- api_bp : lectures ---
+    Budget('api.profile', 'GET', '/api/user/profile', 1),
+    Budget('api.user_transactions', 'GET', '/api/user/transactions', 2),
+    Budget('api.balance', 'GET', '/api/user/balance', 1),
+    Budget('api.get_transaction', 'GET', '/api/transaction/{transaction}', 2),
+    Budget('api.current_rates', 'GET', '/api/rates/current', 0, role='anonyme'),
+    Budget('api.calculate_rates', 'POST', '/api/rates/calculate', 0, role='anonyme',
+           json={'type': 'achat', 'taux_mondial': 600, 'benefice': 10, 'montant': 50000}),
+    Budget('api.get_notifications', 'GET', '/api/notifications', 2),
+    Budget('api.get_notifications[admin]', 'GET', '/api/notifications', 4, role='admin'),
+    Budget('api.sync', 'GET', '/api/sync', 5),
+    Budget('api.sync[incremental]', 'GET',
+           f"/api/sync?since={(datetime.utcnow() - timedelta(minutes=1)).isoformat()}", 5),
+    Budget('api.sync[admin]', 'GET', '/api/sync', 7, role='admin'),
+    Budget('api.batch', 'POST', '/api/batch', 3,
+           json={'requests': [{'id': 'profil', 'path': '/api/user/profile'},
+                              {'id': 'solde', 'path': '/api/user/balance'},
+                              {'id': 'taux', 'path': '/api/rates/current'}]}),
+    Budget('api.admin_users', 'GET', '/api/admin/users', 2, role='admin'),
+    Budget('api.admin_transactions', 'GET', '/api/admin/transactions', 2, role='admin'),
+    Budget('api.admin_transactions[en_attente]', 'GET', '/api/admin/transactions?statut=en_attente', 2, role='admin'),
+    Budget('api.admin_wallets', 'GET', '/api/admin/wallets', 2, role='admin'),
+    Budget('api.admin_rates', 'GET', '/api/admin/rates', 2, role='admin'),
+    Budget('api.admin_rates_stats', 'GET', '/api/admin/rates/stats', 2, role='admin'),
+    Budget('api.admin_stats_volumes', 'GET', '/api/admin/stats/volumes?jours=7', 4, role='admin'),
+
+    # --- api_bp : écritures ---
+    Budget('api.register', 'POST', '/api/auth/register', 5, role='anonyme',
+           json={'nom': 'Nouveau', 'telephone': '237699999999', 'email': 'nouveau@budget.test',
+                 'pays': 'CM', 'mot_de_passe': 'secret123'}, statut=201),
+    Budget('api.login', 'POST', '/api/auth/login', 2, role='anonyme',
+           json={'email': 'client@budget.test', 'mot_de_passe': 'secret'}),
+    # Achat/vente : un seul événement du flux admin, quel que soit le nombre d'admins
+    Budget('api.buy', 'POST', '/api/buy', 10,
+           json={'montant_xaf': 25000, 'reseau': 'TRC20', 'operateur_mobile': 'MTN',
+                 'adresse_wallet': 'TXclientAdresse00000000000000000'}, statut=201),
+    Budget('api.operators', 'GET', '/api/operators', 0, role='anonyme'),
+    Budget('api.quote', 'POST', '/api/quote', 1, json={'type': 'achat', 'montant': 25000}),
+    Budget('api.buy[devis]', 'POST', '/api/buy', 9,
+           json=lambda contexte: {'devis': contexte['devis_achat'], 'reseau': 'TRC20', 'operateur_mobile': 'MTN',
+                                  'adresse_wallet': 'TXclientAdresse00000000000000000'}, statut=201),
+    Budget('api.sell', 'POST', '/api/sell', 11,
+           json={'montant_usdt': 5, 'reseau': 'TRC20', 'operateur_mobile': 'MTN',
+                 'numero_mobile': '237670000000'}, statut=201),
+    Budget('api.register_device_token', 'POST', '/api/notifications/device-token', 2,
+           json={'token': 'budget-token-client', 'platform': 'android'}),
+    Budget('api.unregister_device_token', 'DELETE', '/api/notifications/device-token', 1,
+           json={'token': 'budget-token-client'}),
+    Budget('api.mark_notification_read', 'POST', '/api/notifications/{notification}/read', 4),
+    Budget('api.mark_notifications_read_batch', 'POST', '/api/notifications/read', 3,
+           json=lambda contexte: {'ids': contexte['notifications_lot']}),
+    Budget('api.mark_all_notifications_read', 'POST', '/api/notifications/read-all', 3),
+    Budget('api.mark_notifications_read_batch[admin]', 'POST', '/api/notifications/read', 4, role='admin',
+           json=lambda contexte: {'ids': contexte['notifications_flux_lot']}),
+    Budget('api.admin_validate_transaction', 'POST', '/api/admin/transactions/{transaction_a_valider}/validate',
+           7, role='admin'),  # + mise à jour du solde USDT versionné
+    Budget('api.admin_reject_transaction', 'POST', '/api/admin/transactions/{transaction_a_rejeter}/reject',
+           6, role='admin', json={'motif': 'Paiement introuvable'}),
+    Budget('api.admin_queue_claim', 'POST', '/api/admin/queue/claim', 3, role='admin', json={'n': 5}),
+    Budget('api.admin_queue_renew', 'POST', '/api/admin/queue/renew', 2, role='admin',
+           json=lambda contexte: {'ids': [contexte['transaction']]}),
+    Budget('api.admin_queue_release', 'POST', '/api/admin/queue/release', 2, role='admin',
+           json=lambda contexte: {'ids': [contexte['transaction']]}),
+    Budget('api.admin_add_wallet', 'POST', '/api/admin/wallets', 4, role='admin',
+           json={'reseau': 'ORANGE', 'adresse': '237696574076', 'type_portefeuille': 'mobile_money'},
+           statut=201),
+    # admin courant, utilisateur, rôle, repère du flux admin, compteur de non-lues, relecture après commit
+    Budget('api.admin_toggle_admin', 'POST', '/api/admin/users/{autre_utilisateur}/toggle-admin', 7, role='admin'),
+    Budget('api.admin_add_rate', 'POST', '/api/admin/rates', 10, role='admin',
+           json={'taux_achat': 591, 'taux_vente': 611, 'date': (date.today() + timedelta(days=1)).isoformat()},
+           statut=201),
+
+    # --- main_bp (pages web, session Flask-Login) ---
+    Budget('main.index', 'GET', '/', 1, statut=302),  # client connecté : redirection vers le tableau de bord
+    Budget('main.dashboard', 'GET', '/dashboard', 3),  # + solde USDT agrégé en base
+    Budget('main.transaction_status', 'GET', '/transaction/{transaction}', 2),
+    Budget('main.calculate', 'GET', '/calculate', 0, role='anonyme'),
+    Budget('main.buy', 'GET', '/buy', 2),
+    Budget('main.sell', 'GET', '/sell', 2),
+
+    # --- admin_bp ---
+    Budget('admin.admin_dashboard', 'GET', '/admin/', 10, role='admin'),
+    Budget('admin.admin_transactions', 'GET', '/admin/transactions', 2, role='admin'),
+    Budget('admin.admin_wallets', 'GET', '/admin/wallets', 2, role='admin'),
+    Budget('admin.liste_utilisateurs', 'GET', '/admin/utilisateurs', 8, role='admin'),
+    Budget('admin.admin_rates', 'GET', '/admin/rates', 4, role='admin'),
+    Budget('admin.rates_history_api', 'GET', '/admin/api/rates/history', 1, role='admin'),
+    Budget('admin.export_rates', 'GET', '/admin/rates/export', 1, role='admin'),
+    Budget('admin.rates_analytics_api', 'GET', '/admin/api/rates/analytics?days=365&points=50', 1, role='admin'),
+    Budget('admin.validate_transaction', 'POST', '/admin/transaction/{transaction_web}/validate', 6, role='admin'),
+    Budget('admin.update_rates_api', 'POST', '/admin/api/rates/update', 6, role='admin',
+           json={'taux_achat': 592, 'taux_vente': 612,
+                 'date_application': (date.today() + timedelta(days=2)).isoformat()}),
+    Budget('admin.duplicate_rate', 'POST', '/admin/rates/duplicate/{taux_ancien}', 9, role='admin',
+           form={'nouvelle_date': (date.today() + timedelta(days=3)).isoformat()}),
+    Budget('admin.mark_notification_read', 'POST', '/admin/notification/{notification_admin}/read', 4,
+           role='admin'),
+    Budget('api.mark_all_notifications_read[admin]', 'POST', '/api/notifications/read-all', 6, role='admin'),
+
+    # --- suppressions ---
+    Budget('api.delete_notification', 'DELETE', '/api/notifications/{notification_a_supprimer}', 3),
+    Budget('api.delete_notifications_batch', 'DELETE', '/api/notifications', 2,
+           json=lambda contexte: {'ids': contexte['notifications_a_supprimer']}),
+    Budget('api.admin_delete_wallet', 'DELETE', '/api/admin/wallets/{portefeuille}', 4, role='admin'),
+    # +1 requête si le taux supprimé portait un min/max des agrégats (dépend des données, pas du volume)
+    Budget('api.admin_delete_rate', 'DELETE', '/api/admin/rates/{taux_ancien}', 6, constant=False, role='admin'),
+    Budget('admin.delete_rate', 'POST', '/admin/rates/delete/{taux_a_supprimer}', 6, constant=False, role='admin'),
+]
+
+
+@contextmanager
+def compter_requetes(engine):
+    """Compte les instructions SQL émises sur `engine` dans le bloc."""
+    compteur = {'total': 0, 'instructions': []}
+
+    def _avant(conn, cursor, statement, parameters, context, executemany):
+        compteur['total'] += 1
+        compteur['instructions'].append(statement)
+
+    event.listen(engine, 'before_cursor_execute', _avant)
+    try:
+        yield compteur
+    finally:
+        event.remove(engine, 'before_cursor_execute', _avant)
+
+
+def creer_app_budget():
+    """Application de mesure : API + pages web, avec Flask-Login configuré."""
+    from routes import main_bp, admin_bp
+
+    app = creer_app_memoire()
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    # Registre des portefeuilles : pas de relecture de version pendant la mesure
+    app.config['PORTEFEUILLES_VERIFICATION'] = 3600.0
+    app.register_blueprint(main_bp)
+    app.register_blueprint(admin_bp)
+    # Les gabarits HTML ne font pas partie du dépôt : gabarits vides de substitution,
+    # les pages web sont mesurées hors rendu
+    app.jinja_loader = ChoiceLoader([app.jinja_loader, FunctionLoader(lambda nom: '')])
+
+    login_manager = LoginManager(app)
+
+    @login_manager.user_loader
+    def charger_utilisateur(user_id):
+        return Utilisateur.query.get(int(user_id))
+
+    return app
+
+
+def preparer(taille):
+    """Remplit la base et retourne le contexte (identifiants) utilisé par les gabarits de chemins."""
+    admin = Utilisateur(nom='Admin', telephone='237600000000', email='admin@budget.test',
+                        pays='CM', est_admin=True, est_actif=True, mot_de_passe_hash='secret')
+    client = Utilisateur(nom='Client', telephone='237600000001', email='client@budget.test',
+                         pays='CM', est_admin=False, est_actif=True, mot_de_passe_hash='secret')
+    autre = Utilisateur(nom='Autre', telephone='237600000002', email='autre@budget.test',
+                        pays='CM', est_admin=False, est_actif=True)
+    db.session.add_all([admin, client, autre])
+    db.session.add(PortefeuilleAdmin(reseau='MTN', adresse='237671737948', pays='CM',
+                                     type_portefeuille='mobile_money'))
+    db.session.add(PortefeuilleAdmin(reseau='TRC20', adresse='TXbudgetAdresseCrypto00000000000',
+                                     type_portefeuille='crypto'))
+    db.session.commit()
+
+    seed.seeder(utilisateurs=taille, transactions=taille, notifications=taille, tokens=taille,
+                jours=max(30, taille // 10), graine=taille)
+
+    maintenant = datetime.utcnow()
+    taux = TauxJournalier.query.filter_by(date=date.today()).first()
+    # Historique propre au client et à l'admin, proportionnel à la taille
+    seed.inserer_par_lots(Transaction.__table__, ({
+        'identifiant_transaction': f"budget-{taille}-{i}",
+        'utilisateur_id': client.id,
+        'type_transaction': 'achat',
+        'montant_xaf': 61000.0,
+        'montant_usdt': 100.0,
+        'taux_applique': taux.taux_vente,
+        'reseau': 'TRC20',
+        'statut': 'complete' if i % 4 else 'en_attente',
+        'date_creation': maintenant - timedelta(minutes=i),
+    } for i in range(taille)))
+    seed.inserer_par_lots(Notification.__table__, ({
+        'utilisateur_id': client.id,
+        'type_notification': 'transaction_created',
+        'message': f"Notification {i}",
+        'est_lue': False,
+        'date_creation': maintenant - timedelta(minutes=i),
+    } for i in range(taille)))
+    seed.inserer_par_lots(Notification.__table__, ({
+        'est_flux_admin': True,
+        'type_notification': 'transaction_created',
+        'message': f"Nouvel achat {i}",
+        'est_lue': False,
+        'date_creation': maintenant - timedelta(minutes=i),
+    } for i in range(taille)))
+    db.session.add(PushToken(utilisateur_id=client.id, token='budget-token-client', platform='android'))
+    db.session.commit()
+    reconcilier_compteurs()
+
+    en_attente = Transaction.query.filter_by(utilisateur_id=client.id, statut='en_attente')\
+        .order_by(Transaction.id).limit(3).all()
+    notifications = Notification.query.filter_by(utilisateur_id=client.id, est_lue=False)\
+        .order_by(Notification.id).limit(42).all()
+    flux = Notification.query.filter_by(est_flux_admin=True)\
+        .order_by(Notification.id).limit(21).all()
+    taux_anciens = TauxJournalier.query.filter(TauxJournalier.date < date.today())\
+        .order_by(TauxJournalier.date).limit(2).all()
+    portefeuille = PortefeuilleAdmin.query.filter_by(reseau='TRC20').first()
+    devis_achat, _ = devis.calculer('achat', 25000, TauxJournalier.query.filter_by(date=date.today()).first())
+    # Index des versions, historique des taux et registre des portefeuilles chargés une fois par processus : hors mesure
+    taux_service.index()
+    historique_taux.historique()
+    portefeuilles.candidats('mobile_money')
+
+    return {
+        'admin_id': admin.id,
+        'client_id': client.id,
+        'autre_utilisateur': autre.id,
+        'transaction': en_attente[0].identifiant_transaction,
+        'transaction_a_valider': en_attente[1].identifiant_transaction,
+        'transaction_a_rejeter': en_attente[2].identifiant_transaction,
+        'transaction_web': en_attente[0].identifiant_transaction,
+        'notification': notifications[0].id,
+        'notification_a_supprimer': notifications[1].id,
+        'notifications_lot': [n.id for n in notifications[2:22]],
+        'notifications_a_supprimer': [n.id for n in notifications[22:42]],
+        'notification_admin': flux[0].id,
+        'notifications_flux_lot': [n.id for n in flux[1:21]],
+        'taux_ancien': taux_anciens[0].id,
+        'taux_a_supprimer': taux_anciens[1].id,
+        'portefeuille': portefeuille.id,
+        'devis_achat': devis.emettre(devis_achat, client.id, duree=3600)[0],
+    }
+
+
+def _requete(client_http, budget, contexte, jetons):
+    """Exécute la requête HTTP décrite par le budget."""
+    entetes = {}
+    if budget.role != 'anonyme':
+        entetes['Authorization'] = f"Bearer {jetons[budget.role]}"
+    return client_http.open(
+        budget.chemin.format(**contexte),
+        method=budget.methode,
+        headers=entetes,
+        json=budget.json(contexte) if callable(budget.json) else budget.json,
+        data=budget.form,
+    )
+
+
+def mesurer(taille, filtre=None):
+    """Mesure le nombre d'instructions SQL de chaque route pour une taille de base."""
+    app = creer_app_budget()
+    with app.app_context():
+        contexte = preparer(taille)
+        jetons = {
+            'client': create_access_token(identity=str(contexte['client_id'])),
+            'admin': create_access_token(identity=str(contexte['admin_id'])),
+        }
+        engine = db.engine
+
+    # Un client HTTP par rôle : les pages web utilisent la session Flask-Login
+    clients_http = {}
+    for role in ('anonyme', 'client', 'admin'):
+        clients_http[role] = app.test_client()
+        if role != 'anonyme':
+            with clients_http[role].session_transaction() as session:
+                session['_user_id'] = str(contexte[f"{role}_id"])
+                session['_fresh'] = True
+
+    resultats = {}
+    for budget in BUDGETS:
+        if filtre and filtre not in budget.endpoint:
+            continue
+        client_http = clients_http[budget.role]
+        if budget.methode == 'GET':
+            # Tour de chauffe : les lectures sont mesurées en régime établi
+            _requete(client_http, budget, contexte, jetons)
+        with compter_requetes(engine) as compteur:
+            reponse = _requete(client_http, budget, contexte, jetons)
+        resultats[budget.endpoint] = {
+            'requetes': compteur['total'],
+            'statut_http': reponse.status_code,
+            'instructions': compteur['instructions'],
+        }
+    return resultats
+
+
+def verifier(mesures_par_taille, detail=False):
+    """Compare les mesures aux budgets ; retourne la liste des échecs."""
+    tailles = sorted(mesures_par_taille)
+    echecs = []
+    print(f"{'endpoint':<45} " + ' '.join(f"{'n=' + str(t):>8}" for t in tailles) + f" {'budget':>7}")
+    for budget in BUDGETS:
+        comptes = [mesures_par_taille[t].get(budget.endpoint) for t in tailles]
+        if any(c is None for c in comptes):
+            continue
+        valeurs = [c['requetes'] for c in comptes]
+        problemes = []
+        statuts = sorted({c['statut_http'] for c in comptes if c['statut_http'] != budget.statut})
+        if statuts:
+            problemes.append(f"statut HTTP {', '.join(map(str, statuts))} au lieu de {budget.statut}")
+        if max(valeurs) > budget.maximum:
+            problemes.append(f"budget dépassé ({max(valeurs)} > {budget.maximum})")
+        if budget.constant and valeurs[-1] > valeurs[0]:
+            problemes.append(f"croît avec le volume ({valeurs[0]} -> {valeurs[-1]})")
+        ligne = f"{budget.endpoint:<45} " + ' '.join(f"{v:>8}" for v in valeurs) + f" {budget.maximum:>7}"
+        print(ligne + ('  ÉCHEC: ' + '; '.join(problemes) if problemes else ''))
+        if problemes:
+            echecs.append((budget.endpoint, problemes))
+            if detail:
+                for instruction in comptes[-1]['instructions']:
+                    print(f"      {' '.join(instruction.split())[:160]}")
+    return echecs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Budgets de requêtes SQL par endpoint")
+    parser.add_argument('--tailles', type=int, nargs=2, default=list(TAILLES), metavar=('PETITE', 'GRANDE'))
+    parser.add_argument('--filtre', help="Ne mesurer que les endpoints contenant ce texte")
+    parser.add_argument('--detail', action='store_true', help="Afficher les instructions des routes en échec")
+    parser.add_argument('--mesurer', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mesurer:
+        # Mode interne : une taille, résultat JSON sur la sortie standard
+        resultats = mesurer(args.mesurer, filtre=args.filtre)
+        print(json.dumps(resultats))
+        return
+
+    mesures = {}
+    for taille in args.tailles:
+        commande = [sys.executable, __file__, '--mesurer', str(taille)]
+        if args.filtre:
+            commande += ['--filtre', args.filtre]
+        sortie = subprocess.run(commande, capture_output=True, text=True, check=True).stdout
+        mesures[taille] = json.loads(sortie.strip().splitlines()[-1])
+
+    echecs = verifier(mesures, detail=args.detail)
+    if echecs:
+        print(f"{len(echecs)} endpoint(s) hors budget")
+        sys.exit(1)
+    print("Tous les budgets sont respectés")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,9 +9,19 @@ import urllib.parse
 
 from models import db, Utilisateur, Transaction, PortefeuilleAdmin, TauxJournalier, Notification
 from forms import FormulaireInscription, FormulaireConnexion, FormulaireAchat, FormulaireVente, FormulaireCalculTaux, FormulaireTaux
-from utils import calculer_taux_vente_usdt, calculer_taux_achat_usdt, generer_numero_marchand, formater_montant
+from utils import calculer_taux_vente_usdt, calculer_taux_achat_usdt, formater_montant
 from auth import auth_bp
 from Config import Config
+import notifications as notifications_service
+import taux as taux_service
+import historique_taux
+import agregats_taux
+import operateurs as operateurs_service
+import devises
+import montants
+import soldes
+import portefeuilles  # registre des portefeuilles admin (écouteurs de session)
+import file_validation
 
 main_bp = Blueprint('main', __name__)
 
@@ -107,8 +117,8 @@ def dashboard():
         utilisateur_id=current_user.id
     ).order_by(Transaction.date_creation.desc()).limit(10).all()
     
-    solde_usdt = sum(t.montant_usdt for t in transactions if t.statut == 'complete' and t.type_transaction == 'achat')
-    solde_usdt -= sum(t.montant_usdt for t in transactions if t.statut == 'complete' and t.type_transaction == 'vente')
+    # Solde sur toutes les transactions complétées (pas seulement les 10 affichées)
+    solde_usdt = montants.solde_usdt(db.session, current_user.id)
     
     return render_template('dashboard.html', 
                          transactions=transactions,
@@ -128,10 +138,14 @@ def buy():
     taux_vente = taux_du_jour.taux_vente
 
     if form.validate_on_submit():
-        montant_xaf = form.montant_xaf.data
+        montant_xaf = montants.arrondir(form.montant_xaf.data)
         montant_usdt = montant_xaf / taux_vente
+        devise = devises.devise_pays(current_user.pays)
+        montant_local = montants.arrondir(devises.convertir(montant_xaf, devises.REFERENCE, devise))
 
-        portefeuille = PortefeuilleAdmin.get_numero_marchand(form.operateur_mobile.data)
+        portefeuille = PortefeuilleAdmin.get_numero_marchand(
+            form.operateur_mobile.data, pays=current_user.pays, montant=montant_xaf
+        )
         if not portefeuille:
             flash("Aucun numéro marchand disponible.", "error")
             return redirect(url_for('main.dashboard'))
@@ -139,12 +153,8 @@ def buy():
         numero = portefeuille.adresse
         adresse = None  # facultatif pour l'achat
         
-        if form.operateur_mobile.data=='MTN':
-            code_encode=f"*126*14*{numero}*{montant_xaf}#"
-        else:
-            code_encode=f"#150*14*505874*{numero}*{montant_xaf}"
-
-        code = code_encode
+        code = operateurs_service.code_ussd(form.operateur_mobile.data, numero, montant_local, current_user.pays)
+        version = taux_service.version_de(taux_du_jour)
 
         transaction = Transaction(
             utilisateur_id=current_user.id,
@@ -152,6 +162,9 @@ def buy():
             montant_xaf=montant_xaf,
             montant_usdt=round(montant_usdt, 2),
             taux_applique=taux_vente,
+            version_taux_id=version.id if version else None,
+            devise=devise,
+            montant_local=montant_local,
             reseau=form.reseau.data,
             adresse_wallet=form.adresse_wallet.data,
             operateur_mobile=form.operateur_mobile.data,
@@ -161,12 +174,10 @@ def buy():
         db.session.add(transaction)
         db.session.commit()
 
-        notification = Notification(
-            admin_id=1,
-            type_notification='nouvelle_transaction',
-            message=f"Nouvel achat : {montant_xaf} XAF par {current_user.nom}"
+        notifications_service.publier_flux_admin(
+            'nouvelle_transaction',
+            f"Nouvel achat : {montant_xaf} XAF par {current_user.nom}",
         )
-        db.session.add(notification)
         db.session.commit()
 
         # ✅ Passage des valeurs facultatives en query string
@@ -191,9 +202,12 @@ def sell():
     
     if form.validate_on_submit():
         montant_usdt = form.montant_usdt.data
-        montant_xaf = montant_usdt * taux_achat
+        montant_xaf = montants.arrondir(montant_usdt * taux_achat)
+        devise = devises.devise_pays(current_user.pays)
 
-        portefeuille = PortefeuilleAdmin.get_adresse_crypto(form.reseau.data)
+        portefeuille = PortefeuilleAdmin.get_adresse_crypto(
+            form.reseau.data, pays=current_user.pays, montant=montant_usdt
+        )
         if not portefeuille:
             flash("Aucune adresse crypto disponible.", "error")
             return redirect(url_for('main.dashboard'))
@@ -201,12 +215,23 @@ def sell():
         adresse = portefeuille.adresse
         numero = None  # facultatif pour la vente
 
+        # Réservation en dernier, juste avant la création de la vente
+        reserve, erreur = soldes.reserver(current_user.id, montant_usdt)
+        if not reserve:
+            db.session.rollback()
+            flash(erreur, "error")
+            return redirect(url_for('main.dashboard'))
+
+        version = taux_service.version_de(taux_du_jour)
         transaction = Transaction(
             utilisateur_id=current_user.id,
             type_transaction='vente',
-            montant_xaf=round(montant_xaf, 2),
+            montant_xaf=montant_xaf,
             montant_usdt=montant_usdt,
             taux_applique=taux_achat,
+            version_taux_id=version.id if version else None,
+            devise=devise,
+            montant_local=montants.arrondir(devises.convertir(montant_xaf, devises.REFERENCE, devise)),
             reseau=form.reseau.data,
             adresse_wallet=form.adresse_wallet.data,
             operateur_mobile=form.operateur_mobile.data,
@@ -216,12 +241,10 @@ def sell():
         db.session.add(transaction)
         db.session.commit()
 
-        notification = Notification(
-            admin_id=1,
-            type_notification='nouvelle_transaction',
-            message=f"Nouvelle vente : {montant_usdt} USDT par {current_user.nom}"
+        notifications_service.publier_flux_admin(
+            'nouvelle_transaction',
+            f"Nouvelle vente : {montant_usdt} USDT par {current_user.nom}",
         )
-        db.session.add(notification)
         db.session.commit()
 
         return redirect(url_for('main.transaction_status',
@@ -240,10 +263,11 @@ def transaction_status(transaction_id):
         utilisateur_id=current_user.id
     ).first_or_404()
 
-    if transaction.operateur_mobile == 'MTN':
-        code = f"*126*14*{transaction.numero_marchand}*{transaction.montant_xaf}#"
-    else:
-        code = f"#150*14*505874*{transaction.numero_marchand}*{transaction.montant_xaf}"
+    code = operateurs_service.code_ussd(
+        transaction.operateur_mobile, transaction.numero_marchand,
+        transaction.montant_local if transaction.montant_local is not None else transaction.montant_xaf,
+        current_user.pays
+    )
 
 
     # Récupérer numero et adresse depuis la query string (facultatif)
@@ -301,18 +325,8 @@ def admin_dashboard():
     transactions_complete = Transaction.query.filter_by(statut='complete').count()
     
     # Chiffre d'affaires
-    ca_aujourdhui = db.session.query(
-        db.func.sum(Transaction.montant_xaf)
-    ).filter(
-        db.func.date(Transaction.date_creation) == date.today(),
-        Transaction.statut == 'complete'
-    ).scalar() or 0
-    
-    ca_total = db.session.query(
-        db.func.sum(Transaction.montant_xaf)
-    ).filter(
-        Transaction.statut == 'complete'
-    ).scalar() or 0
+    ca_aujourdhui = montants.chiffre_affaires(db.session, date.today())
+    ca_total = montants.chiffre_affaires(db.session)
     
     # Dernières transactions
     dernieres_transactions = Transaction.query.order_by(
@@ -320,10 +334,7 @@ def admin_dashboard():
     ).limit(10).all()
     
     # Notifications non lues
-    notifications = Notification.query.filter_by(
-        admin_id=current_user.id,
-        est_lue=False
-    ).order_by(Notification.date_creation.desc()).all()
+    notifications = notifications_service.non_lues_admin(current_user)
     print(dernieres_transactions)
     
     return render_template('admin_dashboard.html',
@@ -368,8 +379,12 @@ def validate_transaction(transaction_id):
     transaction = Transaction.query.filter_by(
         identifiant_transaction=transaction_id
     ).first_or_404()
+    if file_validation.reservee_par_autre(transaction, current_user.id):
+        flash('Transaction réservée par un autre administrateur.', 'error')
+        return jsonify({'success': False, 'message': 'Transaction réservée par un autre administrateur'}), 409
     
     transaction.statut = 'complete'
+    transaction.reserve_par = transaction.reserve_jusqua = None
     transaction.date_validation = datetime.utcnow()
     
     # Notifier l'utilisateur
@@ -396,8 +411,12 @@ def reject_transaction(transaction_id):
     transaction = Transaction.query.filter_by(
         identifiant_transaction=transaction_id
     ).first_or_404()
+    if file_validation.reservee_par_autre(transaction, current_user.id):
+        flash('Transaction réservée par un autre administrateur.', 'error')
+        return jsonify({'success': False, 'message': 'Transaction réservée par un autre administrateur'}), 409
     
     transaction.statut = 'rejete'
+    transaction.reserve_par = transaction.reserve_jusqua = None
     transaction.motif_rejet = motif
     transaction.date_validation = datetime.utcnow()
     
@@ -528,6 +547,8 @@ def add_wallet():
     adresse = request.form.get('adresse')
     pays = request.form.get('pays')
     type_portefeuille = request.form.get('type')
+    poids = request.form.get('poids', type=int) or 1
+    plafond_journalier = request.form.get('plafond_journalier', type=float)
     
     if not all([reseau, adresse, type_portefeuille]):
         return jsonify({'success': False, 'message': 'Données manquantes'}), 400
@@ -536,7 +557,9 @@ def add_wallet():
         reseau=reseau,
         adresse=adresse,
         pays=pays,
-        type_portefeuille=type_portefeuille
+        type_portefeuille=type_portefeuille,
+        poids=poids,
+        plafond_journalier=plafond_journalier
     )
     
     db.session.add(portefeuille)
@@ -579,18 +602,19 @@ def admin_rates():
         TauxJournalier.date.desc()
     ).limit(30).all()
     
-    # Statistiques des taux
-    taux_moyen_achat = db.session.query(db.func.avg(TauxJournalier.taux_achat)).scalar() or 0
-    taux_moyen_vente = db.session.query(db.func.avg(TauxJournalier.taux_vente)).scalar() or 0
+    # Statistiques des taux (agrégats maintenus à chaque écriture)
+    statistiques = agregats_taux.statistiques()['total']
+    taux_moyen_achat, taux_moyen_vente = statistiques['moyenne_achat'], statistiques['moyenne_vente']
     
     if form.validate_on_submit():
         taux_achat = form.taux_achat.data
         taux_vente = form.taux_vente.data
         date_application = form.date_application.data or date.today()
         
-        # Validation : taux de vente doit être supérieur au taux d'achat
-        if taux_vente <= taux_achat:
-            flash('Le taux de vente doit être supérieur au taux d\'achat.', 'error')
+        # Validation : taux de vente supérieur au taux d'achat, date non passée
+        erreur = taux_service.verifier_date(date_application)
+        if taux_vente <= taux_achat or erreur:
+            flash(erreur or 'Le taux de vente doit être supérieur au taux d\'achat.', 'error')
             return render_template('admin_rates.html',
                                  form=form,
                                  taux_aujourdhui=taux_aujourdhui,
@@ -599,37 +623,21 @@ def admin_rates():
                                  taux_moyen_vente=round(taux_moyen_vente, 2),
                                  today=date.today())
         
-        # Vérifier si un taux existe déjà pour cette date
-        taux_existant = TauxJournalier.query.filter_by(date=date_application).first()
-        
-        if taux_existant:
-            # Mettre à jour le taux existant
-            taux_existant.taux_achat = taux_achat
-            taux_existant.taux_vente = taux_vente
-            taux_existant.timestamp = datetime.utcnow()
-            message = 'Taux mis à jour avec succès pour le '
-        else:
-            # Créer un nouveau taux
-            nouveau_taux = TauxJournalier(
-                taux_achat=taux_achat,
-                taux_vente=taux_vente,
-                date=date_application
-            )
-            db.session.add(nouveau_taux)
+        # Créer ou mettre à jour le taux de la date (nouvelle version dans l'historique)
+        _, cree = taux_service.enregistrer_taux(taux_achat, taux_vente, date_application, current_user.id)
+        if cree:
             message = 'Nouveau taux ajouté avec succès pour le '
+        else:
+            message = 'Taux mis à jour avec succès pour le '
         
         db.session.commit()
         
         # Notifier tous les utilisateurs via notification
         if date_application == date.today():
-            utilisateurs = Utilisateur.query.filter_by(est_actif=True).all()
-            for utilisateur in utilisateurs:
-                notification = Notification(
-                    utilisateur_id=utilisateur.id,
-                    type_notification='taux_mis_a_jour',
-                    message=f'Nouveaux taux disponibles : Achat {taux_achat} XAF | Vente {taux_vente} XAF'
-                )
-                db.session.add(notification)
+            notifications_service.diffuser_aux_actifs(
+                'taux_mis_a_jour',
+                f'Nouveaux taux disponibles : Achat {taux_achat} XAF | Vente {taux_vente} XAF'
+            )
             db.session.commit()
         
         flash(f'{message} {date_application.strftime("%d/%m/%Y")}.', 'success')
@@ -659,19 +667,42 @@ def rates_history_api():
     jours = request.args.get('days', 30, type=int)
     date_debut = date.today() - timedelta(days=jours)
     
-    historique = TauxJournalier.query.filter(
-        TauxJournalier.date >= date_debut
-    ).order_by(TauxJournalier.date).all()
+    devise = devises.devise_requete()
+    if not devise:
+        return jsonify({'error': 'Devise inconnue'}), 400
+    
+    dates, achat, vente = historique_taux.historique().fenetre(date_debut)
+    if devise != devises.REFERENCE:
+        facteur = devises.matrice()[devises.REFERENCE][devise]
+        achat, vente = (achat * facteur).round(2), (vente * facteur).round(2)
     
     data = {
-        'dates': [t.date.strftime('%Y-%m-%d') for t in historique],
-        'achat': [float(t.taux_achat) for t in historique],
-        'vente': [float(t.taux_vente) for t in historique],
-        'ecart': [float(t.taux_vente - t.taux_achat) for t in historique]
+        'devise': devise,
+        'dates': dates.astype(str).tolist(),
+        'achat': achat.tolist(),
+        'vente': vente.tolist(),
+        'ecart': historique_taux.ecart(achat, vente).tolist()
     }
     
     return jsonify(data)
 
+@admin_bp.route('/api/rates/analytics')
+@login_required
+def rates_analytics_api():
+    """
+    Analyses de l'historique des taux sur `days` jours : moyennes mobiles et
+    volatilité sur `fenetre` jours, écart, marge, min/max/moyenne. Les séries
+    sont réduites à `points` valeurs au plus pour les graphiques.
+    """
+    if not current_user.est_admin:
+        return jsonify({'error': 'Non autorisé'}), 403
+    
+    jours = request.args.get('days', 90, type=int)
+    fenetre = max(request.args.get('fenetre', 7, type=int), 1)
+    points = request.args.get('points', 200, type=int)
+    
+    return jsonify(historique_taux.analyser(date.today() - timedelta(days=jours), fenetre, points))
+
 @admin_bp.route('/api/rates/update', methods=['POST'])
 @login_required
 def update_rates_api():
@@ -700,22 +731,12 @@ def update_rates_api():
         else:
             date_application = date.today()
         
-        # Vérifier si un taux existe déjà pour cette date
-        taux_existant = TauxJournalier.query.filter_by(date=date_application).first()
+        erreur = taux_service.verifier_date(date_application)
+        if erreur:
+            return jsonify({'success': False, 'message': erreur})
         
-        if taux_existant:
-            taux_existant.taux_achat = taux_achat
-            taux_existant.taux_vente = taux_vente
-            taux_existant.timestamp = datetime.utcnow()
-            message = 'Taux mis à jour'
-        else:
-            nouveau_taux = TauxJournalier(
-                taux_achat=taux_achat,
-                taux_vente=taux_vente,
-                date=date_application
-            )
-            db.session.add(nouveau_taux)
-            message = 'Nouveau taux ajouté'
+        _, cree = taux_service.enregistrer_taux(taux_achat, taux_vente, date_application, current_user.id)
+        message = 'Nouveau taux ajouté' if cree else 'Taux mis à jour'
         
         db.session.commit()
         
@@ -775,19 +796,17 @@ def duplicate_rate(rate_id):
     try:
         nouvelle_date = datetime.strptime(nouvelle_date, '%Y-%m-%d').date()
         
+        erreur = taux_service.verifier_date(nouvelle_date)
+        if erreur:
+            return jsonify({'success': False, 'message': erreur})
+        
         # Vérifier si un taux existe déjà pour cette date
         taux_existant = TauxJournalier.query.filter_by(date=nouvelle_date).first()
         
         if taux_existant:
             return jsonify({'success': False, 'message': 'Un taux existe déjà pour cette date'})
         
-        nouveau_taux = TauxJournalier(
-            taux_achat=taux_source.taux_achat,
-            taux_vente=taux_source.taux_vente,
-            date=nouvelle_date
-        )
-        
-        db.session.add(nouveau_taux)
+        taux_service.enregistrer_taux(taux_source.taux_achat, taux_source.taux_vente, nouvelle_date, current_user.id)
         db.session.commit()
         
         return jsonify({
@@ -812,8 +831,11 @@ def export_rates():
         flash('Accès non autorisé.', 'error')
         return redirect(url_for('main.dashboard'))
     
-    # Récupérer tous les taux
-    taux = TauxJournalier.query.order_by(TauxJournalier.date.desc()).all()
+    # Historique en mémoire, du plus récent au plus ancien
+    dates, achat, vente = historique_taux.historique().fenetre()
+    dates, achat, vente = dates[::-1], achat[::-1], vente[::-1]
+    ecarts = historique_taux.ecart(achat, vente).round(2)
+    marges = historique_taux.marge(achat, vente).round(2)
     
     # Créer un CSV
     import csv
@@ -826,16 +848,8 @@ def export_rates():
     writer.writerow(['Date', 'Taux Achat (XAF)', 'Taux Vente (XAF)', 'Écart (XAF)', 'Marge (%)'])
     
     # Données
-    for t in taux:
-        ecart = t.taux_vente - t.taux_achat
-        marge = (ecart / t.taux_achat) * 100 if t.taux_achat > 0 else 0
-        writer.writerow([
-            t.date.strftime('%Y-%m-%d'),
-            t.taux_achat,
-            t.taux_vente,
-            round(ecart, 2),
-            round(marge, 2)
-        ])
+    writer.writerows(zip(dates.astype(str).tolist(), achat.tolist(), vente.tolist(),
+                         ecarts.tolist(), marges.tolist()))
     
     output.seek(0)
     
@@ -851,6 +865,11 @@ def mark_notification_read(notification_id):
     """Marquer une notification comme lue"""
     notification = Notification.query.get_or_404(notification_id)
     
+    if notification.est_flux_admin and current_user.est_admin:
+        notifications_service.marquer_flux_lu(current_user, [notification.id])
+        db.session.commit()
+        return jsonify({'success': True})
+
     if notification.admin_id != current_user.id and notification.utilisateur_id != current_user.id:
         return jsonify({'success': False, 'message': 'Non autorisé'}), 403
     
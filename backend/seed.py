@@ -0,0 +1,341 @@
+"""
+Générateur de données synthétiques pour les tests de montée en charge.
+
+Insère en masse des utilisateurs, transactions, notifications, tokens push
+et taux journaliers avec des distributions proches de la production, via des
+lots Core ``insert()`` (ou ``COPY`` sur PostgreSQL) plutôt que des objets ORM.
+
+Usage :
+    python seed.py --utilisateurs 100000 --transactions 2000000 \\
+                   --notifications 5000000 --tokens 150000 --jours 365
+"""
+
+import argparse
+import csv
+import io
+import math
+import random
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.types import TypeDecorator
+
+from models import db, Utilisateur, Transaction, Notification, PushToken, TauxJournalier
+from notifications import reconcilier_compteurs
+from taux import amorcer_versions
+import agregats_taux
+
+TAILLE_LOT = 5000
+
+# Distributions observées en production (approximations)
+PAYS = [('CM', 0.8), ('TG', 0.2)]
+OPERATEURS_PAR_PAYS = {
+    'CM': [('MTN', 0.55), ('ORANGE', 0.45)],
+    'TG': [('TOGOCEL', 0.6), ('MOOV', 0.4)],
+}
+RESEAUX = [('TRC20', 0.6), ('ETHEREUM', 0.12), ('SOL', 0.12), ('USDT_TON', 0.1), ('USDT_APTOS', 0.06)]
+PLATEFORMES = [('android', 0.85), ('ios', 0.13), ('web', 0.02)]
+TYPES_NOTIFICATION = [
+    ('transaction_created', 0.45),
+    ('rate_updated', 0.3),
+    ('transaction_validee', 0.2),
+    ('transaction_rejetee', 0.05),
+]
+
+
+def _tirage(rng, distribution):
+    """Tirage pondéré rapide dans une petite distribution discrète."""
+    r = rng.random()
+    cumul = 0.0
+    for valeur, poids in distribution:
+        cumul += poids
+        if r < cumul:
+            return valeur
+    return distribution[-1][0]
+
+
+def _date_recente(rng, maintenant, jours):
+    """Date dans les `jours` derniers jours, plus dense vers le présent (croissance)."""
+    return maintenant - timedelta(seconds=int(jours * 86400 * rng.random() ** 2))
+
+
+def _index_utilisateur_actif(rng, nb):
+    """Index d'utilisateur biaisé : une minorité d'utilisateurs fait la majorité du volume."""
+    return min(nb - 1, int(nb * rng.random() ** 3))
+
+
+def _montant_xaf(rng):
+    """Montant XAF log-normal borné aux limites de l'application (5 000 - 500 000)."""
+    montant = rng.lognormvariate(math.log(40000), 0.9)
+    return float(round(min(max(montant, 5000), 499000), -2))
+
+
+def _copier_postgres(connection, table, lignes):
+    """Charge un lot via COPY ... FROM STDIN (psycopg2)."""
+    colonnes = list(lignes[0].keys())
+    # COPY contourne les types SQLAlchemy : conversion explicite des montants en unités entières
+    conversions = {
+        c: table.c[c].type.process_bind_param for c in colonnes
+        if isinstance(table.c[c].type, TypeDecorator)
+    }
+    tampon = io.StringIO()
+    writer = csv.writer(tampon)
+    for ligne in lignes:
+        writer.writerow([
+            '\\N' if ligne[c] is None
+            else conversions[c](ligne[c], connection.dialect) if c in conversions
+            else ligne[c]
+            for c in colonnes
+        ])
+    tampon.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(colonnes)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        tampon,
+    )
+
+
+def inserer_par_lots(table, lignes, taille_lot=TAILLE_LOT, copy=False):
+    """
+    Insère un itérable de dictionnaires par lots, une transaction par lot.
+    Retourne le nombre de lignes insérées.
+    """
+    engine = db.engine
+    utiliser_copy = copy and engine.dialect.name == 'postgresql'
+    total = 0
+    lot = []
+
+    def _vider(lot):
+        with engine.begin() as connection:
+            if utiliser_copy:
+                _copier_postgres(connection, table, lot)
+            else:
+                connection.execute(insert(table), lot)
+
+    for ligne in lignes:
+        lot.append(ligne)
+        if len(lot) >= taille_lot:
+            _vider(lot)
+            total += len(lot)
+            lot = []
+    if lot:
+        _vider(lot)
+        total += len(lot)
+    return total
+
+
+def _max_id(modele):
+    return db.session.execute(select(func.max(modele.id))).scalar() or 0
+
+
+def generer_utilisateurs(rng, nb, decalage, maintenant, jours):
+    for i in range(nb):
+        n = decalage + i
+        pays = _tirage(rng, PAYS)
+        indicatif = '237' if pays == 'CM' else '228'
+        yield {
+            'nom': f"Utilisateur {n}",
+            'telephone': f"{indicatif}{n:09d}",
+            'email': f"seed{n}@devisa.test",
+            'pays': pays,
+            'mot_de_passe_hash': 'seed',
+            'email_verifie': rng.random() < 0.7,
+            'google_id': None,
+            'date_inscription': _date_recente(rng, maintenant, jours),
+            'est_admin': i < 5,
+            'est_actif': i < 5 or rng.random() < 0.95,
+        }
+
+
+def generer_taux(rng, jours, dates_existantes, aujourd_hui):
+    taux_mondial = 600.0
+    for j in range(jours, -1, -1):
+        # Marche aléatoire du taux mondial autour de 600 XAF
+        taux_mondial = max(550.0, min(680.0, taux_mondial + rng.gauss(0, 2.5)))
+        jour = aujourd_hui - timedelta(days=j)
+        if jour in dates_existantes:
+            continue
+        yield {
+            'taux_achat': round(taux_mondial * 0.98, 2),
+            'taux_vente': round(taux_mondial * 1.02, 2),
+            'date': jour,
+            'timestamp': datetime.combine(jour, datetime.min.time()) + timedelta(hours=8),
+        }
+
+
+def generer_transactions(rng, nb, utilisateurs, taux_par_jour, maintenant, jours):
+    nb_utilisateurs = len(utilisateurs)
+    for _ in range(nb):
+        utilisateur_id, pays = utilisateurs[_index_utilisateur_actif(rng, nb_utilisateurs)]
+        date_creation = _date_recente(rng, maintenant, jours)
+        taux_achat, taux_vente = taux_par_jour.get(date_creation.date(), (588.0, 612.0))
+        achat = rng.random() < 0.6
+        montant_xaf = _montant_xaf(rng)
+        taux = taux_vente if achat else taux_achat
+        age = (maintenant - date_creation).total_seconds()
+
+        # Les ordres récents sont en attente, les anciens majoritairement complétés
+        if age < 3600 * 6 and rng.random() < 0.7:
+            statut = 'en_attente'
+        else:
+            statut = 'rejete' if rng.random() < 0.05 else 'complete'
+        date_validation = None
+        if statut != 'en_attente':
+            date_validation = date_creation + timedelta(minutes=rng.randint(2, 240))
+
+        yield {
+            'identifiant_transaction': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            'utilisateur_id': utilisateur_id,
+            'type_transaction': 'achat' if achat else 'vente',
+            'montant_xaf': montant_xaf,
+            'montant_usdt': round(montant_xaf / taux, 2),
+            'taux_applique': taux,
+            'reseau': _tirage(rng, RESEAUX),
+            'adresse_wallet': f"T{rng.getrandbits(160):040x}"[:34],
+            'operateur_mobile': _tirage(rng, OPERATEURS_PAR_PAYS[pays]),
+            'numero_marchand': '237671737948' if pays == 'CM' else '22890000000',
+            'statut': statut,
+            'motif_rejet': 'Paiement introuvable' if statut == 'rejete' else None,
+            'date_creation': date_creation,
+            'date_validation': date_validation,
+            'preuve_paiement': None,
+            'reference_paiement': None,
+        }
+
+
+def generer_notifications(rng, nb, utilisateurs, admins, maintenant, jours):
+    nb_utilisateurs = len(utilisateurs)
+    for _ in range(nb):
+        type_notification = _tirage(rng, TYPES_NOTIFICATION)
+        date_creation = _date_recente(rng, maintenant, jours)
+        age_jours = (maintenant - date_creation).days
+        # Environ 20% des notifications transactionnelles vont au flux admin partagé
+        pour_admin = admins and type_notification == 'transaction_created' and rng.random() < 0.4
+        yield {
+            'utilisateur_id': None if pour_admin else utilisateurs[_index_utilisateur_actif(rng, nb_utilisateurs)][0],
+            'admin_id': None,
+            'est_flux_admin': bool(pour_admin),
+            'type_notification': type_notification,
+            'message': f"Notification synthétique ({type_notification})",
+            # Les notifications anciennes ont presque toutes été lues
+            'est_lue': rng.random() < min(0.98, 0.3 + age_jours / 30),
+            'date_creation': date_creation,
+        }
+
+
+def generer_tokens(rng, nb, utilisateurs, decalage, maintenant, jours):
+    nb_utilisateurs = len(utilisateurs)
+    for i in range(nb):
+        date_creation = _date_recente(rng, maintenant, jours)
+        date_mise_a_jour = date_creation + (maintenant - date_creation) * rng.random()
+        yield {
+            'utilisateur_id': utilisateurs[rng.randrange(nb_utilisateurs)][0],
+            'token': f"seed-{decalage + i}-{rng.getrandbits(64):016x}",
+            'platform': _tirage(rng, PLATEFORMES),
+            'est_actif': rng.random() < 0.8,
+            'date_creation': date_creation,
+            'date_mise_a_jour': date_mise_a_jour,
+        }
+
+
+def seeder(utilisateurs=0, transactions=0, notifications=0, tokens=0, jours=365,
+           taille_lot=TAILLE_LOT, copy=False, graine=None, verbeux=False):
+    """
+    Remplit la base courante (contexte d'application requis).
+    Les transactions, notifications et tokens sont rattachés aux utilisateurs
+    existants et nouvellement créés. Retourne le nombre de lignes par table.
+    """
+    rng = random.Random(graine)
+    maintenant = datetime.utcnow()
+    aujourd_hui = maintenant.date()
+    resultats = {}
+
+    def _etape(nom, table, lignes):
+        debut = time.perf_counter()
+        resultats[nom] = inserer_par_lots(table, lignes, taille_lot=taille_lot, copy=copy)
+        if verbeux:
+            duree = time.perf_counter() - debut
+            print(f"[SEED] {nom}: {resultats[nom]} lignes en {duree:.1f}s")
+
+    dates_existantes = {d for (d,) in db.session.execute(select(TauxJournalier.date))}
+    _etape('taux_journaliers', TauxJournalier.__table__,
+           generer_taux(rng, jours, dates_existantes, aujourd_hui))
+    # Insertions Core : une version initiale par jour dans l'historique des taux
+    amorcer_versions()
+    agregats_taux.recalculer()
+    db.session.commit()
+
+    if utilisateurs:
+        decalage = _max_id(Utilisateur) + 1
+        _etape('utilisateurs', Utilisateur.__table__,
+               generer_utilisateurs(rng, utilisateurs, decalage, maintenant, jours))
+
+    if not (transactions or notifications or tokens):
+        return resultats
+
+    population = db.session.execute(
+        select(Utilisateur.id, Utilisateur.pays, Utilisateur.est_admin).order_by(Utilisateur.id)
+    ).all()
+    if not population:
+        raise ValueError("Aucun utilisateur en base : utilisez --utilisateurs")
+    clients = [(u.id, u.pays if u.pays in OPERATEURS_PAR_PAYS else 'CM') for u in population]
+    admins = [u.id for u in population if u.est_admin]
+    taux_par_jour = {
+        t.date: (t.taux_achat, t.taux_vente)
+        for t in db.session.execute(select(TauxJournalier.date, TauxJournalier.taux_achat, TauxJournalier.taux_vente))
+    }
+    db.session.rollback()
+
+    if transactions:
+        _etape('transactions', Transaction.__table__,
+               generer_transactions(rng, transactions, clients, taux_par_jour, maintenant, jours))
+    if notifications:
+        _etape('notifications', Notification.__table__,
+               generer_notifications(rng, notifications, clients, admins, maintenant, jours))
+        # Les insertions Core ne passent pas par l'ORM : recalcul des compteurs de non-lues
+        reconcilier_compteurs()
+    if tokens:
+        _etape('push_tokens', PushToken.__table__,
+               generer_tokens(rng, tokens, clients, _max_id(PushToken) + 1, maintenant, jours))
+    return resultats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Générateur de données synthétiques Devisa-FX")
+    parser.add_argument('--utilisateurs', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=10000)
+    parser.add_argument('--notifications', type=int, default=20000)
+    parser.add_argument('--tokens', type=int, default=1500)
+    parser.add_argument('--jours', type=int, default=365, help="Profondeur d'historique en jours")
+    parser.add_argument('--lot', type=int, default=TAILLE_LOT, help="Taille des lots d'insertion")
+    parser.add_argument('--copy', action='store_true', help="Utiliser COPY sur PostgreSQL")
+    parser.add_argument('--graine', type=int, default=None, help="Graine aléatoire (reproductible)")
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+        debut = time.perf_counter()
+        resultats = seeder(
+            utilisateurs=args.utilisateurs,
+            transactions=args.transactions,
+            notifications=args.notifications,
+            tokens=args.tokens,
+            jours=args.jours,
+            taille_lot=args.lot,
+            copy=args.copy,
+            graine=args.graine,
+            verbeux=True,
+        )
+        total = sum(resultats.values())
+        duree = time.perf_counter() - debut
+        print(f"[SEED] Terminé: {total} lignes en {duree:.1f}s ({total / max(duree, 1e-9):.0f} lignes/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Solde USDT versionné et réservation des ventes par compare-and-swap.
+
+`soldes_utilisateurs` garde par utilisateur le solde complété (achats -
+ventes complétés), le montant réservé par ses ventes en attente et un
+numéro de version. Une vente réserve son montant avant d'être créée
+(`reserver`) :
+
+    1. lecture de (solde, reserve, version) ;
+    2. refus si solde - reserve < montant ;
+    3. UPDATE ... SET reserve = reserve + montant, version = version + 1
+       WHERE utilisateur_id = :id AND version = :version_lue
+
+Si la ligne a changé entre 1 et 3 (autre vente, validation), l'UPDATE ne
+touche aucune ligne : l'opération est recommencée sur l'état relu, au plus
+`SOLDE_TENTATIVES` fois. Aucun verrou de table : les ventes de deux
+utilisateurs ne se gênent pas, et deux ventes simultanées du même
+utilisateur ne peuvent pas dépasser son solde. La réservation fait partie
+de la transaction de la vente et disparaît avec elle si elle est annulée.
+
+Les changements de statut passant par l'ORM (validation, rejet) sont
+répercutés par un écouteur `after_flush` en incréments relatifs, qui
+incrémentent aussi la version. La ligne d'un utilisateur est créée depuis
+ses transactions au premier accès ; `reconcilier()` (`python maintenance.py
+soldes`) la recalcule pour tous (insertions Core du seed, dérive). Les
+montants sont manipulés en micro-USDT entiers (montants.py).
+"""
+
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import current_app
+from sqlalchemy import BigInteger, bindparam, case, event, func, inspect, literal, select, true, type_coerce, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, SoldeUtilisateur, Transaction
+from montants import ECHELLE_USDT, depuis_unites, vers_unites
+
+EN_COURS = ('en_attente', 'valide')
+
+_soldes = SoldeUtilisateur.__table__
+_transactions = Transaction.__table__
+
+statistiques = Counter()  # reservations, conflits, refus, abandons (depuis le démarrage du processus)
+_verrou = threading.Lock()
+
+
+def _compter(nom):
+    with _verrou:
+        statistiques[nom] += 1
+
+
+def _dialecte(connexion):
+    return postgresql if connexion.dialect.name == 'postgresql' else sqlite
+
+
+def _sommes():
+    """Expressions SQL (solde, réservé) en unités, sur les transactions sélectionnées."""
+    t = _transactions
+    montant = type_coerce(t.c.montant_usdt, BigInteger)
+    solde = func.coalesce(func.sum(case(
+        ((t.c.statut == 'complete') & (t.c.type_transaction == 'achat'), montant),
+        ((t.c.statut == 'complete') & (t.c.type_transaction == 'vente'), -montant),
+        else_=literal(0, BigInteger),
+    )), 0)
+    reserve = func.coalesce(func.sum(case(
+        ((t.c.type_transaction == 'vente') & t.c.statut.in_(EN_COURS), montant),
+        else_=literal(0, BigInteger),
+    )), 0)
+    return solde, reserve
+
+
+def _initialiser(connexion, utilisateur_id):
+    """Crée la ligne de l'utilisateur depuis ses transactions (sans effet si elle existe)."""
+    solde, reserve = _sommes()
+    requete = select(literal(utilisateur_id), solde, reserve, literal(0)).where(
+        _transactions.c.utilisateur_id == utilisateur_id
+    )
+    instruction = _dialecte(connexion).insert(_soldes).from_select(
+        ['utilisateur_id', 'solde', 'reserve', 'version'], requete
+    )
+    connexion.execute(instruction.on_conflict_do_nothing(index_elements=[_soldes.c.utilisateur_id]))
+
+
+def _lire(connexion, utilisateur_id):
+    """(solde, réservé, version) en unités, la ligne étant créée si besoin."""
+    requete = select(
+        type_coerce(_soldes.c.solde, BigInteger), type_coerce(_soldes.c.reserve, BigInteger), _soldes.c.version
+    ).where(_soldes.c.utilisateur_id == utilisateur_id)
+    ligne = connexion.execute(requete).first()
+    if ligne is None:
+        _initialiser(connexion, utilisateur_id)
+        ligne = connexion.execute(requete).first()
+    return ligne
+
+
+def etat(utilisateur_id, session=None):
+    """Solde, montant réservé et disponible (USDT) d'un utilisateur."""
+    solde, reserve, version = _lire((session or db.session()).connection(), utilisateur_id)
+    return {
+        'solde': depuis_unites(solde, ECHELLE_USDT),
+        'reserve': depuis_unites(reserve, ECHELLE_USDT),
+        'disponible': depuis_unites(solde - reserve, ECHELLE_USDT),
+        'version': version,
+    }
+
+
+def reserver(utilisateur_id, montant, session=None):
+    """
+    Réserve `montant` USDT sur le solde disponible de l'utilisateur, dans la
+    transaction en cours (à commiter par l'appelant avec la vente).
+    Retourne (True, None) ou (False, message d'erreur).
+    """
+    session = session or db.session()
+    connexion = session.connection()
+    unites = vers_unites(montant, ECHELLE_USDT)
+    if unites <= 0:
+        return False, "Le montant doit être positif"
+    tentatives = current_app.config.get('SOLDE_TENTATIVES', 10)
+    for essai in range(tentatives):
+        solde, reserve, version = _lire(connexion, utilisateur_id)
+        if solde - reserve < unites:
+            _compter('refus')
+            return False, "Solde USDT insuffisant"
+        modifiees = connexion.execute(
+            update(_soldes)
+            .where(_soldes.c.utilisateur_id == utilisateur_id, _soldes.c.version == version)
+            .values(reserve=type_coerce(_soldes.c.reserve, BigInteger) + unites, version=_soldes.c.version + 1)
+        ).rowcount
+        if modifiees == 1:
+            session.info.setdefault('soldes_reserves', []).append((utilisateur_id, unites))
+            _compter('reservations')
+            return True, None
+        # Version changée depuis la lecture : on relit, après une courte attente
+        # aléatoire pour que les perdants ne se représentent pas ensemble
+        _compter('conflits')
+        time.sleep(random.uniform(0, 0.002 * (essai + 1)))
+    _compter('abandons')
+    print(f"[SOLDES] Réservation abandonnée après {tentatives} conflits (utilisateur {utilisateur_id})")
+    return False, "Solde en cours de modification, veuillez réessayer"
+
+
+def reconcilier():
+    """
+    Recalcule le solde et le réservé de tous les utilisateurs depuis les
+    transactions (à lancer hors charge). Retourne le nombre de lignes créées ou corrigées.
+    """
+    connexion = db.session.connection()
+    solde, reserve = _sommes()
+    requete = (
+        select(_transactions.c.utilisateur_id, solde, reserve, literal(0))
+        .where(true())  # SQLite : lève l'ambiguïté INSERT ... SELECT ... ON CONFLICT
+        .group_by(_transactions.c.utilisateur_id)
+    )
+    instruction = _dialecte(connexion).insert(_soldes).from_select(
+        ['utilisateur_id', 'solde', 'reserve', 'version'], requete
+    )
+    instruction = instruction.on_conflict_do_update(
+        index_elements=[_soldes.c.utilisateur_id],
+        set_={
+            'solde': instruction.excluded.solde,
+            'reserve': instruction.excluded.reserve,
+            'version': _soldes.c.version + 1,
+        },
+        where=(_soldes.c.solde != instruction.excluded.solde) | (_soldes.c.reserve != instruction.excluded.reserve),
+    )
+    return connexion.execute(instruction).rowcount
+
+
+def _contribution(type_transaction, statut, unites):
+    """(solde, réservé) apportés par une transaction, en unités."""
+    if statut == 'complete':
+        return (unites if type_transaction == 'achat' else -unites), 0
+    if type_transaction == 'vente' and statut in EN_COURS:
+        return 0, unites
+    return 0, 0
+
+
+@event.listens_for(db.session, 'after_flush')
+def _suivre_transactions(session, flush_context):
+    """Répercute sur les soldes les transactions créées, modifiées ou supprimées via l'ORM."""
+    deltas = defaultdict(lambda: [0, 0])
+    reservees = session.info.get('soldes_reserves', [])
+
+    def appliquer(utilisateur_id, type_transaction, statut, montant_usdt, signe):
+        solde, reserve = _contribution(type_transaction, statut, vers_unites(montant_usdt or 0, ECHELLE_USDT))
+        deltas[utilisateur_id][0] += signe * solde
+        deltas[utilisateur_id][1] += signe * reserve
+
+    for obj in session.new:
+        if not isinstance(obj, Transaction):
+            continue
+        unites = vers_unites(obj.montant_usdt or 0, ECHELLE_USDT)
+        if (obj.type_transaction == 'vente' and obj.statut in EN_COURS
+                and (obj.utilisateur_id, unites) in reservees):
+            reservees.remove((obj.utilisateur_id, unites))  # déjà réservé par reserver()
+            continue
+        appliquer(obj.utilisateur_id, obj.type_transaction, obj.statut, obj.montant_usdt, 1)
+    for obj in session.deleted:
+        if isinstance(obj, Transaction):
+            appliquer(obj.utilisateur_id, obj.type_transaction, obj.statut, obj.montant_usdt, -1)
+    noms = ('utilisateur_id', 'type_transaction', 'statut', 'montant_usdt')
+    for obj in session.dirty:
+        if not isinstance(obj, Transaction):
+            continue
+        attributs = inspect(obj).attrs
+        if not any(attributs[nom].history.has_changes() for nom in noms):
+            continue
+        ancien = {nom: (attributs[nom].history.deleted or [getattr(obj, nom)])[0] for nom in noms}
+        appliquer(ancien['utilisateur_id'], ancien['type_transaction'], ancien['statut'], ancien['montant_usdt'], -1)
+        appliquer(obj.utilisateur_id, obj.type_transaction, obj.statut, obj.montant_usdt, 1)
+
+    parametres = [
+        {'uid': uid, 'delta_solde': solde, 'delta_reserve': reserve}
+        for uid, (solde, reserve) in deltas.items() if solde or reserve
+    ]
+    if parametres:
+        # Lignes absentes : rien à faire, elles seront créées depuis les transactions
+        session.connection().execute(
+            update(_soldes).where(_soldes.c.utilisateur_id == bindparam('uid')).values(
+                solde=type_coerce(_soldes.c.solde, BigInteger) + bindparam('delta_solde', type_=BigInteger),
+                reserve=type_coerce(_soldes.c.reserve, BigInteger) + bindparam('delta_reserve', type_=BigInteger),
+                version=_soldes.c.version + 1,
+            ),
+            parametres,
+        )
+
+
+@event.listens_for(db.session, 'after_commit')
+def _oublier_apres_commit(session):
+    session.info.pop('soldes_reserves', None)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _oublier(session):
+    session.info.pop('soldes_reserves', None)
@@ -0,0 +1,180 @@
+"""
+Versions des taux et taux en vigueur à un instant donné.
+
+`TauxJournalier` reste le taux courant de chaque jour (une ligne par date) ;
+chaque modification ajoute en plus une `VersionTaux` avec sa `date_effet` :
+- taux du jour : effet immédiat ;
+- date future : effet à minuit de cette date ;
+- date passée : refusée (`verifier_date`), l'historique des taux en vigueur
+  à un instant déjà écoulé n'est jamais réécrit.
+Une transaction référence la version appliquée (`version_taux_id`), ce qui
+garde la trace du taux même après une modification dans la journée.
+
+Les versions sont chargées en mémoire dans un index trié par `date_effet` :
+« taux à l'instant T » est une recherche dichotomique (O(log n)), sans
+requête. L'index est invalidé au commit d'une nouvelle version dans le
+processus, et rechargé au plus tard après `TAUX_INDEX_TTL` secondes pour
+les versions écrites par les autres workers.
+"""
+
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date, datetime, time as heure
+
+from flask import current_app
+from sqlalchemy import event, insert, select
+
+from models import db, TauxJournalier, VersionTaux
+
+Version = namedtuple('Version', 'id date_effet taux_achat taux_vente date')
+
+_index = None
+_charge_le = 0.0
+_verrou = threading.Lock()
+
+
+class IndexTaux:
+    """Versions triées par (date_effet, id) ; recherche dichotomique sur date_effet."""
+
+    def __init__(self, versions):
+        self._versions = sorted(versions, key=lambda v: (v.date_effet, v.id))
+        self._instants = [v.date_effet for v in self._versions]
+
+    def __len__(self):
+        return len(self._versions)
+
+    def a(self, instant):
+        """Version en vigueur à `instant` (None si antérieur à toute version)."""
+        position = bisect_right(self._instants, instant)
+        return self._versions[position - 1] if position else None
+
+    def entre(self, debut, fin):
+        """Versions prenant effet dans [debut, fin[."""
+        return self._versions[bisect_left(self._instants, debut):bisect_left(self._instants, fin)]
+
+
+def charger_index():
+    colonnes = (VersionTaux.id, VersionTaux.date_effet, VersionTaux.taux_achat,
+                VersionTaux.taux_vente, VersionTaux.date)
+    return IndexTaux(Version(*row) for row in db.session.execute(select(*colonnes)))
+
+
+def index(forcer=False):
+    """Index des versions du processus, rechargé s'il est invalidé ou trop ancien."""
+    global _index, _charge_le
+    ttl = current_app.config.get('TAUX_INDEX_TTL', 30)
+    with _verrou:
+        if forcer or _index is None or time.monotonic() - _charge_le > ttl:
+            _index = charger_index()
+            _charge_le = time.monotonic()
+        return _index
+
+
+def invalider():
+    global _index
+    with _verrou:
+        _index = None
+
+
+def taux_a(instant):
+    """Version en vigueur à `instant`."""
+    return index().a(instant)
+
+
+def verifier_date(date_application, maintenant=None):
+    """Message d'erreur si le taux de cette date ne peut plus être modifié (date passée), sinon None."""
+    maintenant = maintenant or datetime.utcnow()
+    if date_application < maintenant.date():
+        return "Impossible de modifier le taux d'une date passée"
+    return None
+
+
+def _date_effet(date_application, maintenant):
+    if date_application == maintenant.date():
+        return maintenant
+    return datetime.combine(date_application, heure.min)  # date future
+
+
+def enregistrer_taux(taux_achat, taux_vente, date_application=None, auteur_id=None):
+    """
+    Crée ou met à jour le TauxJournalier de `date_application` et ajoute la
+    version correspondante (sans commit). Retourne (taux, créé). La date ne
+    doit pas être passée : les appelants la contrôlent avec `verifier_date`.
+    """
+    maintenant = datetime.utcnow()
+    date_application = date_application or date.today()
+    erreur = verifier_date(date_application, maintenant)
+    if erreur:
+        raise ValueError(erreur)
+    taux = TauxJournalier.query.filter_by(date=date_application).first()
+    cree = taux is None
+    if cree:
+        taux = TauxJournalier(taux_achat=taux_achat, taux_vente=taux_vente, date=date_application)
+        db.session.add(taux)
+    else:
+        taux.taux_achat = taux_achat
+        taux.taux_vente = taux_vente
+        taux.timestamp = maintenant
+    db.session.add(VersionTaux(
+        taux_achat=taux_achat,
+        taux_vente=taux_vente,
+        date=date_application,
+        date_effet=_date_effet(date_application, maintenant),
+        auteur_id=auteur_id,
+    ))
+    return taux, cree
+
+
+def version_de(taux):
+    """
+    Version correspondant au TauxJournalier `taux` (lu pour un ordre) : la
+    version en vigueur si elle porte les mêmes valeurs, après un rechargement
+    de l'index si nécessaire (version écrite par un autre worker). None pour
+    un taux antérieur au versionnement.
+    """
+    maintenant = datetime.utcnow()
+    for forcer in (False, True):
+        version = index(forcer).a(maintenant)
+        if version and (version.date, version.taux_achat, version.taux_vente) == \
+                (taux.date, taux.taux_achat, taux.taux_vente):
+            return version
+    return None
+
+
+def amorcer_versions():
+    """Crée une version (effet à minuit) pour chaque TauxJournalier qui n'en a aucune. Retourne le nombre créé."""
+    _taux, _versions = TauxJournalier.__table__, VersionTaux.__table__
+    manquants = db.session.execute(
+        select(_taux.c.date, _taux.c.taux_achat, _taux.c.taux_vente)
+        .where(~select(_versions.c.id).where(_versions.c.date == _taux.c.date).exists())
+    ).all()
+    if manquants:
+        db.session.execute(insert(_versions), [{
+            'taux_achat': row.taux_achat,
+            'taux_vente': row.taux_vente,
+            'date': row.date,
+            'date_effet': datetime.combine(row.date, heure.min),
+            'date_creation': datetime.utcnow(),
+        } for row in manquants])
+        db.session.commit()
+        invalider()
+    return len(manquants)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _relever_versions(session, flush_context):
+    if any(isinstance(obj, VersionTaux) for obj in session.new):
+        session.info['versions_taux_modifiees'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalider_apres_commit(session):
+    if session.info.pop('versions_taux_modifiees', False):
+        invalider()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _oublier(session):
+    session.info.pop('versions_taux_modifiees', None)
@@ -0,0 +1,89 @@
+"""
+Nettoyage des tokens push (FCM).
+
+Trois passes, chacune par tranches de `taille_lot` lignes avec un commit par
+tranche (verrous courts, pas de longue transaction) :
+- expiration : un token actif dont `date_mise_a_jour` (rafraîchie à chaque
+  enregistrement par l'application) dépasse `PUSH_TOKEN_EXPIRATION_JOURS`
+  est désactivé ;
+- plafond : au-delà de `PUSH_TOKENS_MAX_PAR_UTILISATEUR` tokens actifs, les
+  plus anciens d'un utilisateur sont désactivés ;
+- suppression : un token inactif depuis plus de
+  `PUSH_TOKEN_SUPPRESSION_JOURS` est supprimé.
+
+La désactivation met à jour `date_mise_a_jour` : le délai de suppression
+court donc à partir de la désactivation.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, select, update
+
+from models import db, PushToken
+
+TAILLE_LOT = 500
+
+_tokens = PushToken.__table__
+
+
+def _par_tranches(selection, instruction, taille_lot, pause):
+    """Applique `instruction(ids)` aux ids de `selection` par tranches, un commit par tranche."""
+    total = 0
+    while True:
+        ids = db.session.execute(selection.limit(taille_lot)).scalars().all()
+        if not ids:
+            return total
+        db.session.execute(instruction(ids))
+        db.session.commit()
+        total += len(ids)
+        if len(ids) < taille_lot:
+            return total
+        if pause:
+            time.sleep(pause)
+
+
+def _desactiver(ids):
+    return update(_tokens).where(_tokens.c.id.in_(ids)).values(est_actif=False, date_mise_a_jour=datetime.utcnow())
+
+
+def expirer(jours, taille_lot=TAILLE_LOT, pause=0.0):
+    """Désactive les tokens actifs non rafraîchis depuis `jours` jours."""
+    limite = datetime.utcnow() - timedelta(days=jours)
+    selection = select(_tokens.c.id).where(
+        _tokens.c.est_actif.is_(True),
+        _tokens.c.date_mise_a_jour < limite,
+    ).order_by(_tokens.c.id)
+    return _par_tranches(selection, _desactiver, taille_lot, pause)
+
+
+def plafonner(maximum, taille_lot=TAILLE_LOT, pause=0.0):
+    """Ne garde actifs que les `maximum` tokens les plus récents de chaque utilisateur."""
+    rang = func.row_number().over(
+        partition_by=_tokens.c.utilisateur_id,
+        order_by=(_tokens.c.date_mise_a_jour.desc(), _tokens.c.id.desc()),
+    ).label('rang')
+    classement = select(_tokens.c.id, rang).where(_tokens.c.est_actif.is_(True)).subquery()
+    selection = select(classement.c.id).where(classement.c.rang > maximum).order_by(classement.c.id)
+    return _par_tranches(selection, _desactiver, taille_lot, pause)
+
+
+def supprimer_inactifs(jours, taille_lot=TAILLE_LOT, pause=0.0):
+    """Supprime les tokens inactifs depuis `jours` jours."""
+    limite = datetime.utcnow() - timedelta(days=jours)
+    selection = select(_tokens.c.id).where(
+        _tokens.c.est_actif.is_(False),
+        _tokens.c.date_mise_a_jour < limite,
+    ).order_by(_tokens.c.id)
+    return _par_tranches(selection, lambda ids: delete(_tokens).where(_tokens.c.id.in_(ids)), taille_lot, pause)
+
+
+def nettoyer(taille_lot=TAILLE_LOT, pause=0.0):
+    """Exécute les trois passes avec les seuils de la configuration. Retourne le bilan."""
+    config = current_app.config
+    return {
+        'expires': expirer(config.get('PUSH_TOKEN_EXPIRATION_JOURS', 60), taille_lot, pause),
+        'plafonnes': plafonner(config.get('PUSH_TOKENS_MAX_PAR_UTILISATEUR', 5), taille_lot, pause),
+        'supprimes': supprimer_inactifs(config.get('PUSH_TOKEN_SUPPRESSION_JOURS', 180), taille_lot, pause),
+    }
@@ -2,6 +2,8 @@ import math
 from decimal import Decimal, ROUND_HALF_UP
 from datetime import datetime, timedelta
 
+import operateurs as operateurs_service
+
 def calculer_taux_vente_usdt(taux_mondial, benefice, montant_xaf):
     """Calcul du taux de vente USDT selon la logique du fichier taux.py"""
     taux_marchant = float(taux_mondial)
@@ -62,34 +64,22 @@ def calculer_taux_achat_usdt(taux_mondial, benefice, montant_usdt):
         'frais_par_usdt': round(frais_par_usdt, 2)
     }, None
 
-def generer_numero_marchand(pays, operateur):
-    """Génère un numéro marchand basé sur le pays et l'opérateur"""
-    numeros = {
-        'CM': {
-            'MTN': '237670000000',
-            'ORANGE': '237690000000'
-        },
-        'TG': {
-            'TOGOCEL': '22890000000',
-            'MOOV': '22870000000'
-        }
+def calculer_taux_journaliers(taux_mondial, benefice):
+    """Taux du jour hors frais opérateur : même marge que calculer_taux_vente_usdt / calculer_taux_achat_usdt"""
+    taux_marchant = float(taux_mondial)
+    return {
+        'taux_vente': round(taux_marchant + benefice, 2),  # le client achète des USDT
+        'taux_achat': round(taux_marchant - benefice, 2),  # le client vend des USDT
     }
-    return numeros.get(pays, {}).get(operateur, '')
+
+def generer_numero_marchand(pays, operateur):
+    """Numéro marchand par défaut du pays et de l'opérateur (registre des opérateurs)"""
+    return operateurs_service.numero_marchand(pays, operateur)
 
 def formater_montant(montant):
     """Formate un montant avec séparateurs de milliers"""
     return f"{montant:,.2f}".replace(',', ' ').replace('.', ',')
 
 def determiner_reseau_par_adresse(adresse):
-    """Détermine le réseau cryptographique basé sur l'adresse wallet"""
-    if adresse.startswith('T'):
-        return 'TRC20'
-    elif adresse.startswith('0x'):
-        return 'ETHEREUM'
-    elif len(adresse) == 44 and adresse.isalnum():
-        return 'SOL'
-    elif 'TON' in adresse.upper():
-        return 'USDT_TON'
-    elif 'APT' in adresse.upper():
-        return 'USDT_APTOS'
-    return 'TRC20'  # Par défaut
\ No newline at end of file
+    """Détermine le réseau cryptographique basé sur l'adresse wallet (registre des opérateurs)"""
+    return operateurs_service.reseau_par_adresse(adresse)
\ No newline at end of file